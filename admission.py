@@ -0,0 +1,150 @@
+"""Admission control for the API.
+
+Requests are sorted into pools (interactive, analysis, bulk). Each pool
+runs at most max_concurrent requests and queues at most max_queue more
+for up to max_wait seconds. Anything beyond that is shed at once with 503
+and a Retry-After estimate, so a spike degrades one pool instead of
+stalling every worker. A pool can yield to another: it does not start new
+requests while the other has requests waiting, which keeps cheap
+interactive calls ahead of analyses.
+"""
+import math
+import time
+import asyncio
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from starlette.responses import JSONResponse
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("overloaded")
+        self.retry_after = retry_after
+
+
+class Pool:
+    def __init__(self, name: str, max_concurrent: int, max_queue: int, max_wait: float,
+                 yields_to: Optional["Pool"] = None):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.yields_to = yields_to
+        self.active = 0
+        self.waiters = deque()
+        # Moving average of how long an admitted request holds its slot
+        self.service_seconds = 1.0
+        self.counters = {"admitted": 0, "queued": 0, "shed_queue_full": 0, "shed_timeout": 0}
+
+    def _can_start(self) -> bool:
+        if self.active >= self.max_concurrent:
+            return False
+        return not (self.yields_to and self.yields_to.waiters)
+
+    def retry_after(self) -> int:
+        wait = self.service_seconds * (len(self.waiters) + 1) / self.max_concurrent
+        return max(1, min(60, math.ceil(wait)))
+
+    def wake(self):
+        """Hand free slots to queued requests, oldest first"""
+        while self.waiters and self._can_start():
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    async def acquire(self):
+        if not self.waiters and self._can_start():
+            self.active += 1
+            self.counters["admitted"] += 1
+            return
+        if len(self.waiters) >= self.max_queue:
+            self.counters["shed_queue_full"] += 1
+            raise Overloaded(self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.counters["queued"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # The slot was handed over just as the wait ran out
+                self.counters["admitted"] += 1
+                return
+            self.waiters.remove(waiter)
+            waiter.cancel()
+            self.counters["shed_timeout"] += 1
+            raise Overloaded(self.retry_after())
+        except asyncio.CancelledError:
+            # Client went away while queued; give back a slot if one was handed over
+            if waiter.done() and not waiter.cancelled():
+                self.active -= 1
+                self.wake()
+            else:
+                self.waiters.remove(waiter)
+                waiter.cancel()
+            raise
+        self.counters["admitted"] += 1
+
+    def release(self, held_seconds: float):
+        self.active -= 1
+        self.service_seconds = 0.8 * self.service_seconds + 0.2 * held_seconds
+
+    def snapshot(self) -> dict:
+        return {
+            "active": self.active,
+            "queue_depth": len(self.waiters),
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "mean_service_seconds": round(self.service_seconds, 3),
+            **self.counters,
+        }
+
+
+class AdmissionController:
+    def __init__(self, pools: Dict[str, Pool], classify: Callable[[str], Optional[str]]):
+        self.pools = pools
+        self.classify = classify
+
+    def release(self, pool: Pool, held_seconds: float):
+        pool.release(held_seconds)
+        # A freed slot (or a shorter queue) may let any pool start a waiter
+        for other in self.pools.values():
+            other.wake()
+
+    def snapshot(self) -> dict:
+        return {name: pool.snapshot() for name, pool in self.pools.items()}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware holding a pool slot until the response is fully sent"""
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        name = self.controller.classify(scope["path"]) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        pool = self.controller.pools[name]
+        try:
+            await pool.acquire()
+        except Overloaded as e:
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry later"},
+                status_code=503,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(pool, time.monotonic() - started)
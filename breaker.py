@@ -0,0 +1,149 @@
+"""Circuit breaker with adaptive timeouts for slow or failing dependencies.
+
+Calls are tracked over a sliding time window. When enough of them fail or
+run slow, the circuit opens and callers are turned away immediately (so they
+can use a fallback) instead of waiting on timeouts. After a cool-down a few
+half-open probe calls are let through; a healthy probe closes the circuit,
+a failing one opens it again. Each call's timeout follows the observed p95
+latency of recent successful calls, within fixed bounds.
+"""
+import time
+import threading
+from collections import deque
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a call while the circuit is open"""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window_seconds: float = 60.0, min_calls: int = 5,
+                 failure_rate: float = 0.5, slow_call_seconds: float = 10.0, open_seconds: float = 30.0,
+                 half_open_probes: int = 1, timeout_default: float = 15.0, timeout_min: float = 2.0,
+                 timeout_max: float = 30.0, timeout_multiplier: float = 1.5):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.timeout_default = timeout_default
+        self.timeout_min = timeout_min
+        self.timeout_max = timeout_max
+        self.timeout_multiplier = timeout_multiplier
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        # (finished_at, succeeded, latency) for calls inside the window
+        self._calls = deque()
+        self._counters = {"calls": 0, "successes": 0, "failures": 0, "slow_calls": 0,
+                          "rejected": 0, "opened": 0}
+
+    def _prune(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _open(self, now: float):
+        self._state = self.OPEN
+        self._opened_at = now
+        self._counters["opened"] += 1
+
+    def _state_at(self, now: float) -> str:
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes_in_flight = 0
+        return self._state
+
+    def _p95(self):
+        latencies = sorted(latency for _, ok, latency in self._calls if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+
+    def _timeout(self) -> float:
+        p95 = self._p95()
+        if p95 is None:
+            return self.timeout_default
+        return min(self.timeout_max, max(self.timeout_min, p95 * self.timeout_multiplier))
+
+    def _acquire(self):
+        """Admit a call, returning (timeout, is_probe), or raise CircuitOpenError"""
+        with self._lock:
+            state = self._state_at(time.monotonic())
+            if state == self.OPEN or (state == self.HALF_OPEN and self._probes_in_flight >= self.half_open_probes):
+                self._counters["rejected"] += 1
+                raise CircuitOpenError(f"{self.name} circuit is open")
+            if state == self.HALF_OPEN:
+                self._probes_in_flight += 1
+                return self._timeout(), True
+            return self._timeout(), False
+
+    def _record(self, ok: bool, latency: float, probe: bool):
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            self._counters["calls"] += 1
+            self._counters["successes" if ok else "failures"] += 1
+            if slow:
+                self._counters["slow_calls"] += 1
+            self._calls.append((now, ok, latency))
+            self._prune(now)
+
+            if probe:
+                self._probes_in_flight -= 1
+                if ok and not slow:
+                    # Healthy again: start over with a clean window
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                else:
+                    self._open(now)
+                return
+
+            if self._state != self.CLOSED or len(self._calls) < self.min_calls:
+                return
+            bad = sum(1 for _, ok, latency in self._calls if not ok or latency >= self.slow_call_seconds)
+            if bad / len(self._calls) >= self.failure_rate:
+                self._open(now)
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn(timeout, *args, **kwargs) through the breaker.
+
+        fn gets the current adaptive timeout and should pass it on to the client
+        it calls. Any exception counts as a failure and is re-raised.
+        """
+        timeout, probe = self._acquire()
+        started = time.monotonic()
+        try:
+            result = fn(timeout, *args, **kwargs)
+        except BaseException:
+            self._record(False, time.monotonic() - started, probe)
+            raise
+        self._record(True, time.monotonic() - started, probe)
+        return result
+
+    def snapshot(self) -> dict:
+        """Current state, window statistics and lifetime counters"""
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            state = self._state_at(now)
+            failures = sum(1 for _, ok, _ in self._calls if not ok)
+            slow = sum(1 for _, _, latency in self._calls if latency >= self.slow_call_seconds)
+            p95 = self._p95()
+            return {
+                "state": state,
+                "window_calls": len(self._calls),
+                "window_failures": failures,
+                "window_slow_calls": slow,
+                "window_p95_seconds": round(p95, 3) if p95 is not None else None,
+                "timeout_seconds": round(self._timeout(), 3),
+                "open_for_seconds": round(now - self._opened_at, 1) if state == self.OPEN else 0,
+                **self._counters,
+            }
@@ -0,0 +1,285 @@
+"""Caches for derived data, local to a worker or shared between nodes.
+
+LRUCache is a bounded, thread-safe least-recently-used map. Each cache is
+tied to a data version (see Storage.get_version): when the version moves
+on, every entry is dropped at once rather than expired one by one.
+
+CacheNamespace puts a named, versioned cache in front of a backend:
+
+    MemoryBackend  nothing shared: each namespace's own LRU is the cache (the default)
+    RedisBackend   a Redis server (or anything speaking its protocol) shared
+                   by every worker and node; needs the redis package and is
+                   selected with CACHE_URL=redis://host:6379/0
+
+Keys are scoped to the namespace's current data version, so a change to the
+underlying data retires old entries everywhere without deleting them. Every
+namespace keeps what this worker has read in its own LRU of max_entries, so
+each has its own bound and hit rate; with Redis that LRU sits in front of
+the shared entries for local-hit latency. The worker that changes the data calls invalidate(),
+which announces the change over pub/sub. Other workers pick up the new
+version as soon as the message arrives, or within poll_seconds if it is
+lost or the change came from outside the API, such as the ingest CLI.
+"""
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+class LRUCache:
+    def __init__(self, name: str, max_entries: int = 256):
+        self.name = name
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def sync_version(self, version):
+        """Drop every entry if the underlying data has changed since they were cached"""
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self._stats["invalidations"] += 1
+                self._entries.clear()
+                self._version = version
+
+    def get(self, key):
+        """Return (found, value), marking the entry as recently used"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return True, self._entries[key]
+            self._stats["misses"] += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get_or_compute(self, key, compute):
+        found, value = self.get(key)
+        if not found:
+            # Computed outside the lock; two concurrent misses both compute, last one wins
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "version": self._version,
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+                **self._stats,
+            }
+
+
+class MemoryBackend:
+    """No shared store: entries live only in each namespace's own LRU, and pub/sub
+    reaches this process's subscribers only"""
+
+    shared = False
+
+    def __init__(self):
+        self._subscribers = []
+
+    def publish(self, channel: str, message: str):
+        for subscribed, callback in list(self._subscribers):
+            if subscribed == channel:
+                callback(message)
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]):
+        self._subscribers.append((channel, callback))
+
+    def close(self):
+        pass
+
+    def snapshot(self) -> dict:
+        return {"backend": "memory", "subscribers": len(self._subscribers)}
+
+
+class RedisBackend:
+    """Cache backend on a Redis server, shared by every worker that points at it.
+    Values are stored as JSON with a TTL; errors are counted and treated as misses,
+    so an unreachable server degrades to recomputing rather than failing requests."""
+
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "mh", socket_timeout: float = 0.25):
+        if redis is None:
+            raise RuntimeError("CACHE_URL needs the redis package (pip install redis)")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=socket_timeout,
+                                            socket_connect_timeout=socket_timeout)
+        self._pubsub = None
+        self._thread = None
+        self._callbacks = {}
+        self._stats = {"hits": 0, "misses": 0, "sets": 0, "errors": 0, "messages": 0}
+
+    def get(self, key: str):
+        try:
+            raw = self._client.get(f"{self.prefix}:{key}")
+        except redis.RedisError:
+            self._stats["errors"] += 1
+            return False, None
+        if raw is None:
+            self._stats["misses"] += 1
+            return False, None
+        self._stats["hits"] += 1
+        return True, json.loads(raw)
+
+    def set(self, key: str, value, ttl_seconds: Optional[int] = None):
+        try:
+            self._client.set(f"{self.prefix}:{key}", json.dumps(value), ex=ttl_seconds)
+            self._stats["sets"] += 1
+        except redis.RedisError:
+            self._stats["errors"] += 1
+
+    def publish(self, channel: str, message: str):
+        try:
+            self._client.publish(f"{self.prefix}:{channel}", message)
+        except redis.RedisError:
+            self._stats["errors"] += 1
+
+    def subscribe(self, channel: str, callback: Callable[[str], None]):
+        channel = f"{self.prefix}:{channel}"
+        callbacks = self._callbacks.setdefault(channel, [])
+        callbacks.append(callback)
+        if len(callbacks) > 1:
+            return
+
+        def handle(message):
+            self._stats["messages"] += 1
+            data = message["data"]
+            for subscriber in list(callbacks):
+                subscriber(data.decode() if isinstance(data, bytes) else data)
+
+        try:
+            if self._pubsub is None:
+                self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{channel: handle})
+            if self._thread is None:
+                # Reconnects and resubscribes on its own after a dropped connection
+                self._thread = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True,
+                                                          exception_handler=self._on_pubsub_error)
+        except redis.RedisError:
+            # Without pub/sub, versions are still re-read every poll_seconds
+            self._stats["errors"] += 1
+
+    def _on_pubsub_error(self, error, pubsub, thread):
+        self._stats["errors"] += 1
+        time.sleep(1)
+
+    def close(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
+        if self._pubsub is not None:
+            self._pubsub.close()
+            self._pubsub = None
+        self._client.close()
+
+    def snapshot(self) -> dict:
+        return {"backend": "redis", **self._stats}
+
+
+def create_cache_backend(url: Optional[str] = None):
+    """The backend CACHE_URL names, or the in-process one when it is unset"""
+    if url:
+        return RedisBackend(url)
+    return MemoryBackend()
+
+
+class CacheNamespace:
+    """A named cache whose keys are scoped to the current version of its data"""
+
+    def __init__(self, name: str, backend, version: Callable[[], int], max_entries: int = 256,
+                 ttl_seconds: int = 3600, poll_seconds: float = 1.0):
+        self.name = name
+        self.backend = backend
+        self.load_version = version
+        self.ttl_seconds = ttl_seconds
+        self.poll_seconds = poll_seconds
+        # What this worker has read; the whole cache unless the backend is shared
+        self.local = LRUCache(name, max_entries)
+        self._lock = threading.Lock()
+        self._version = None
+        self._read_at = 0.0
+        self._stats = {"shared_hits": 0, "computed": 0, "invalidations_sent": 0, "invalidations_received": 0}
+        backend.subscribe(INVALIDATION_CHANNEL, self._on_invalidation)
+
+    def _on_invalidation(self, name: str):
+        if name == self.name:
+            with self._lock:
+                self._stats["invalidations_received"] += 1
+                self._read_at = 0.0
+
+    def version(self, refresh: bool = False) -> int:
+        """The data version, re-read at most every poll_seconds unless an invalidation arrived"""
+        with self._lock:
+            version, read_at = self._version, self._read_at
+        if refresh or version is None or time.monotonic() - read_at > self.poll_seconds:
+            version = self.load_version()
+            with self._lock:
+                self._version, self._read_at = version, time.monotonic()
+        return version
+
+    def invalidate(self):
+        """Call after changing the data: re-reads the version here and tells every other worker"""
+        version = self.version(refresh=True)
+        with self._lock:
+            self._stats["invalidations_sent"] += 1
+        self.backend.publish(INVALIDATION_CHANNEL, self.name)
+        return version
+
+    def get_or_compute(self, key, compute):
+        """The cached value for key at the current data version, computing and storing it on a miss.
+        Keys and values must be JSON-serializable for a shared backend."""
+        version = self.version()
+        self.local.sync_version(version)
+        found, value = self.local.get(key)
+        if found:
+            return value
+
+        found = False
+        if self.backend.shared:
+            backend_key = f"{self.name}:{version}:{json.dumps(key)}"
+            found, value = self.backend.get(backend_key)
+            if found:
+                with self._lock:
+                    self._stats["shared_hits"] += 1
+        if not found:
+            # Computed outside any lock; concurrent misses both compute, last one wins
+            value = compute()
+            with self._lock:
+                self._stats["computed"] += 1
+            if self.backend.shared:
+                self.backend.set(backend_key, value, self.ttl_seconds)
+        self.local.set(key, value)
+        return value
+
+    def snapshot(self) -> dict:
+        """The local LRU's size and counters, with hit_rate counting shared hits as hits"""
+        local = self.local.snapshot()
+        with self._lock:
+            stats = {**local, "version": self._version, **self._stats}
+        lookups = local["hits"] + local["misses"]
+        hits = local["hits"] + stats["shared_hits"]
+        stats["hit_rate"] = round(hits / lookups, 3) if lookups else None
+        return stats
@@ -0,0 +1,169 @@
+"""Streaming bulk export of responses and analysis results.
+
+Rows come from a streaming storage cursor and are encoded chunk by chunk, so
+memory stays flat however many rows are exported and the first bytes are
+available immediately. Used by the /export endpoint and from the command line:
+
+    python export.py responses --format csv --start-date 2025-01-01 --output responses.csv
+    python export.py analyses --format parquet --user-id 42 --output analyses.parquet
+"""
+import io
+import csv
+import sys
+import json
+import argparse
+
+from storage import Storage, create_storage
+
+DATASETS = ("responses", "analyses")
+FORMATS = ("ndjson", "csv", "parquet")
+
+COLUMNS = {
+    "responses": ["id", "user_id", "session_id", "question_id", "question_type", "question_text",
+                  "response_value", "response_text", "created_at"],
+    "analyses": ["id", "user_id", "session_id", "overall_score", "risk_level",
+                 "conditions", "clinicians", "analysis_version", "llm_model", "prompt_tokens",
+                 "completion_tokens", "llm_latency_ms", "cost_usd", "created_at"],
+}
+INTEGER_COLUMNS = {"id", "user_id", "question_id", "overall_score", "prompt_tokens", "completion_tokens"}
+FLOAT_COLUMNS = {"llm_latency_ms", "cost_usd"}
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+# Rows per encoded chunk (and per Parquet row group)
+CHUNK_ROWS = 5000
+
+
+def _chunks(rows, size: int = CHUNK_ROWS):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_ndjson(rows, columns):
+    for chunk in _chunks(rows):
+        yield "".join(
+            json.dumps({c: row.get(c) for c in columns}, default=str) + "\n" for row in chunk
+        ).encode()
+
+
+def iter_csv(rows, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for chunk in _chunks(rows):
+        writer.writerows([row.get(c) for c in columns] for row in chunk)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, when there are no rows
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+class _ChunkSink:
+    """Write-only file object that collects bytes until they are drained"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(rows, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow")
+
+    def column_type(c):
+        if c in INTEGER_COLUMNS:
+            return pa.int64()
+        return pa.float64() if c in FLOAT_COLUMNS else pa.string()
+
+    schema = pa.schema([(c, column_type(c)) for c in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    for chunk in _chunks(rows):
+        data = {
+            c: [row.get(c) if c in INTEGER_COLUMNS | FLOAT_COLUMNS or row.get(c) is None else str(row.get(c))
+                for row in chunk]
+            for c in columns
+        }
+        # Each chunk becomes one row group, flushed out as soon as it is written
+        writer.write_table(pa.table(data, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+ENCODERS = {
+    "ndjson": iter_ndjson,
+    "csv": iter_csv,
+    "parquet": iter_parquet,
+}
+
+
+def export_stream(storage: Storage, dataset: str, fmt: str, start_date=None, end_date=None, user_id=None):
+    """Generator of encoded bytes for a dataset export"""
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+
+    rows = storage.iter_export(dataset, start_date=start_date, end_date=end_date, user_id=user_id)
+    return ENCODERS[fmt](rows, COLUMNS[dataset])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export responses or analysis results")
+    parser.add_argument("dataset", choices=DATASETS)
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--start-date", help="Include rows created on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--end-date", help="Include rows created on or before this date (YYYY-MM-DD)")
+    parser.add_argument("--user-id", type=int)
+    parser.add_argument("--output", help="Output file (defaults to stdout)")
+    args = parser.parse_args()
+
+    storage = create_storage()
+    output = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for data in export_stream(storage, args.dataset, args.format,
+                                  args.start_date, args.end_date, args.user_id):
+            output.write(data)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
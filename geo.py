@@ -0,0 +1,226 @@
+"""Offline geocoding and geohash helpers for nearest-clinician search.
+
+Locations are "City, ST" strings. They are resolved against a built-in
+gazetteer of US cities (plus state centroids as a fallback), or a fuller
+CSV gazetteer (city,state,latitude,longitude) named by GAZETTEER_PATH.
+Coordinates are stored with a geohash so a radius search only touches the
+index ranges for the few cells around the user.
+"""
+import os
+import csv
+import math
+import re
+from typing import List, Optional, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_MILE = 1.609344
+KM_PER_DEGREE = 111.32
+
+# Precision stored on clinicians (cells of roughly 1.2 x 0.6 km)
+GEOHASH_PRECISION = 6
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+CITY_COORDINATES = {
+    ("New York", "NY"): (40.71, -74.01), ("Brooklyn", "NY"): (40.68, -73.94),
+    ("Buffalo", "NY"): (42.89, -78.88), ("Rochester", "NY"): (43.16, -77.61),
+    ("Syracuse", "NY"): (43.05, -76.15), ("Albany", "NY"): (42.65, -73.75),
+    ("Los Angeles", "CA"): (34.05, -118.24), ("San Diego", "CA"): (32.72, -117.16),
+    ("San Jose", "CA"): (37.34, -121.89), ("San Francisco", "CA"): (37.77, -122.42),
+    ("Fresno", "CA"): (36.74, -119.79), ("Sacramento", "CA"): (38.58, -121.49),
+    ("Long Beach", "CA"): (33.77, -118.19), ("Oakland", "CA"): (37.80, -122.27),
+    ("Bakersfield", "CA"): (35.37, -119.02), ("Anaheim", "CA"): (33.84, -117.91),
+    ("Santa Ana", "CA"): (33.75, -117.87), ("Riverside", "CA"): (33.95, -117.40),
+    ("Stockton", "CA"): (37.96, -121.29), ("Pasadena", "CA"): (34.15, -118.14),
+    ("Berkeley", "CA"): (37.87, -122.27), ("Palo Alto", "CA"): (37.44, -122.14),
+    ("Chicago", "IL"): (41.88, -87.63),
+    ("Houston", "TX"): (29.76, -95.37), ("San Antonio", "TX"): (29.42, -98.49),
+    ("Dallas", "TX"): (32.78, -96.80), ("Austin", "TX"): (30.27, -97.74),
+    ("Fort Worth", "TX"): (32.76, -97.33), ("El Paso", "TX"): (31.76, -106.49),
+    ("Arlington", "TX"): (32.74, -97.11), ("Corpus Christi", "TX"): (27.80, -97.40),
+    ("Plano", "TX"): (33.02, -96.70),
+    ("Phoenix", "AZ"): (33.45, -112.07), ("Tucson", "AZ"): (32.22, -110.97),
+    ("Mesa", "AZ"): (33.42, -111.83), ("Scottsdale", "AZ"): (33.49, -111.93),
+    ("Philadelphia", "PA"): (39.95, -75.17), ("Pittsburgh", "PA"): (40.44, -80.00),
+    ("Jacksonville", "FL"): (30.33, -81.66), ("Miami", "FL"): (25.76, -80.19),
+    ("Tampa", "FL"): (27.95, -82.46), ("Orlando", "FL"): (28.54, -81.38),
+    ("St Petersburg", "FL"): (27.77, -82.64), ("Tallahassee", "FL"): (30.44, -84.28),
+    ("Fort Lauderdale", "FL"): (26.12, -80.14),
+    ("Columbus", "OH"): (39.96, -83.00), ("Cleveland", "OH"): (41.50, -81.69),
+    ("Cincinnati", "OH"): (39.10, -84.51), ("Toledo", "OH"): (41.65, -83.54),
+    ("Charlotte", "NC"): (35.23, -80.84), ("Raleigh", "NC"): (35.78, -78.64),
+    ("Greensboro", "NC"): (36.07, -79.79), ("Durham", "NC"): (35.99, -78.90),
+    ("Indianapolis", "IN"): (39.77, -86.16), ("Fort Wayne", "IN"): (41.08, -85.14),
+    ("Seattle", "WA"): (47.61, -122.33), ("Spokane", "WA"): (47.66, -117.43),
+    ("Denver", "CO"): (39.74, -104.99), ("Colorado Springs", "CO"): (38.83, -104.82),
+    ("Aurora", "CO"): (39.73, -104.83),
+    ("Washington", "DC"): (38.91, -77.04),
+    ("Boston", "MA"): (42.36, -71.06), ("Cambridge", "MA"): (42.37, -71.11),
+    ("Nashville", "TN"): (36.16, -86.78), ("Memphis", "TN"): (35.15, -90.05),
+    ("Knoxville", "TN"): (35.96, -83.92), ("Chattanooga", "TN"): (35.05, -85.31),
+    ("Detroit", "MI"): (42.33, -83.05), ("Ann Arbor", "MI"): (42.28, -83.74),
+    ("Grand Rapids", "MI"): (42.96, -85.67),
+    ("Oklahoma City", "OK"): (35.47, -97.52), ("Tulsa", "OK"): (36.15, -95.99),
+    ("Portland", "OR"): (45.52, -122.68),
+    ("Las Vegas", "NV"): (36.17, -115.14), ("Henderson", "NV"): (36.04, -114.98),
+    ("Reno", "NV"): (39.53, -119.81),
+    ("Louisville", "KY"): (38.25, -85.76), ("Lexington", "KY"): (38.04, -84.50),
+    ("Baltimore", "MD"): (39.29, -76.61),
+    ("Milwaukee", "WI"): (43.04, -87.91), ("Madison", "WI"): (43.07, -89.40),
+    ("Albuquerque", "NM"): (35.08, -106.65), ("Santa Fe", "NM"): (35.69, -105.94),
+    ("Kansas City", "MO"): (39.10, -94.58), ("St Louis", "MO"): (38.63, -90.20),
+    ("Atlanta", "GA"): (33.75, -84.39), ("Savannah", "GA"): (32.08, -81.09),
+    ("Omaha", "NE"): (41.26, -95.93), ("Lincoln", "NE"): (40.81, -96.70),
+    ("Virginia Beach", "VA"): (36.85, -75.98), ("Norfolk", "VA"): (36.85, -76.29),
+    ("Richmond", "VA"): (37.54, -77.44),
+    ("Minneapolis", "MN"): (44.98, -93.27), ("St Paul", "MN"): (44.95, -93.09),
+    ("New Orleans", "LA"): (29.95, -90.07), ("Baton Rouge", "LA"): (30.45, -91.19),
+    ("Wichita", "KS"): (37.69, -97.34),
+    ("Honolulu", "HI"): (21.31, -157.86),
+    ("Anchorage", "AK"): (61.22, -149.90),
+    ("Newark", "NJ"): (40.74, -74.17), ("Jersey City", "NJ"): (40.73, -74.08),
+    ("Boise", "ID"): (43.62, -116.21),
+    ("Des Moines", "IA"): (41.59, -93.62),
+    ("Salt Lake City", "UT"): (40.76, -111.89),
+    ("Birmingham", "AL"): (33.52, -86.80),
+    ("Providence", "RI"): (41.82, -71.41),
+    ("Hartford", "CT"): (41.76, -72.69),
+    ("Little Rock", "AR"): (34.75, -92.29),
+    ("Jackson", "MS"): (32.30, -90.18),
+    ("Charleston", "SC"): (32.78, -79.93), ("Columbia", "SC"): (34.00, -81.03),
+    ("Manchester", "NH"): (42.99, -71.45),
+    ("Burlington", "VT"): (44.48, -73.21),
+    ("Portland", "ME"): (43.66, -70.26),
+    ("Wilmington", "DE"): (39.74, -75.55),
+    ("Charleston", "WV"): (38.35, -81.63),
+    ("Sioux Falls", "SD"): (43.55, -96.73),
+    ("Fargo", "ND"): (46.88, -96.79),
+    ("Billings", "MT"): (45.78, -108.50),
+    ("Cheyenne", "WY"): (41.14, -104.82),
+}
+
+# Used when only the state is known
+STATE_CENTROIDS = {
+    "AL": (32.81, -86.79), "AK": (61.37, -152.40), "AZ": (33.73, -111.43), "AR": (34.97, -92.37),
+    "CA": (36.12, -119.68), "CO": (39.06, -105.31), "CT": (41.60, -72.76), "DE": (39.32, -75.51),
+    "DC": (38.90, -77.03), "FL": (27.77, -81.69), "GA": (33.04, -83.64), "HI": (21.09, -157.50),
+    "ID": (44.24, -114.48), "IL": (40.35, -88.99), "IN": (39.85, -86.26), "IA": (42.01, -93.21),
+    "KS": (38.53, -96.73), "KY": (37.67, -84.67), "LA": (31.17, -91.87), "ME": (44.69, -69.38),
+    "MD": (39.06, -76.80), "MA": (42.23, -71.53), "MI": (43.33, -84.54), "MN": (45.69, -93.90),
+    "MS": (32.74, -89.68), "MO": (38.46, -92.29), "MT": (46.92, -110.45), "NE": (41.13, -98.27),
+    "NV": (38.31, -117.06), "NH": (43.45, -71.56), "NJ": (40.30, -74.52), "NM": (34.84, -106.25),
+    "NY": (42.17, -74.95), "NC": (35.63, -79.81), "ND": (47.53, -99.78), "OH": (40.39, -82.76),
+    "OK": (35.57, -96.93), "OR": (44.57, -122.07), "PA": (40.59, -77.21), "RI": (41.68, -71.51),
+    "SC": (33.86, -80.95), "SD": (44.30, -99.44), "TN": (35.75, -86.69), "TX": (31.05, -97.56),
+    "UT": (40.15, -111.86), "VT": (44.05, -72.71), "VA": (37.77, -78.17), "WA": (47.40, -121.49),
+    "WV": (38.49, -80.95), "WI": (44.27, -89.62), "WY": (42.76, -107.30),
+}
+
+
+def _normalize_city(city: str) -> str:
+    city = re.sub(r"[.\s]+", " ", city).strip().lower()
+    return re.sub(r"^saint ", "st ", city)
+
+
+def _load_gazetteer() -> dict:
+    gazetteer = {(_normalize_city(city), state): coords for (city, state), coords in CITY_COORDINATES.items()}
+    path = os.getenv("GAZETTEER_PATH")
+    if path and os.path.exists(path):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                key = (_normalize_city(row["city"]), row["state"].strip().upper())
+                gazetteer[key] = (float(row["latitude"]), float(row["longitude"]))
+    return gazetteer
+
+
+GAZETTEER = _load_gazetteer()
+
+
+def geocode(location: Optional[str]) -> Optional[Tuple[float, float]]:
+    """Resolve "City, ST" (or just "ST") to coordinates, or None if unknown"""
+    if not location:
+        return None
+    parts = [part.strip() for part in location.split(",")]
+    state = parts[-1].upper()
+    if len(parts) >= 2:
+        coords = GAZETTEER.get((_normalize_city(parts[0]), state))
+        if coords:
+            return coords
+    return STATE_CENTROIDS.get(state)
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def _cell_size_degrees(precision: int) -> Tuple[float, float]:
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lon_bits)
+
+
+def cover_prefixes(latitude: float, longitude: float, radius_km: float) -> Optional[List[str]]:
+    """Geohash prefixes of the 3x3 cells around a point that together cover the radius.
+
+    Returns None when the radius is too large for any cell grid, meaning the
+    caller should scan everything.
+    """
+    cos_lat = max(math.cos(math.radians(min(abs(latitude) + 1, 89.0))), 0.01)
+    precision = None
+    for p in range(GEOHASH_PRECISION, 0, -1):
+        lat_deg, lon_deg = _cell_size_degrees(p)
+        # The neighbouring ring covers the circle once a cell is at least as big as the radius
+        if min(lat_deg * KM_PER_DEGREE, lon_deg * KM_PER_DEGREE * cos_lat) >= radius_km:
+            precision = p
+            break
+    if precision is None:
+        return None
+
+    lat_deg, lon_deg = _cell_size_degrees(precision)
+    prefixes = set()
+    for dlat in (-lat_deg, 0.0, lat_deg):
+        for dlon in (-lon_deg, 0.0, lon_deg):
+            lat = max(min(latitude + dlat, 89.9999), -89.9999)
+            lon = (longitude + dlon + 180.0) % 360.0 - 180.0
+            prefixes.add(geohash_encode(lat, lon, precision))
+    return sorted(prefixes)
+
+
+def prefix_range(prefix: str) -> Tuple[str, Optional[str]]:
+    """Half-open [low, high) string range holding every geohash that starts with prefix.
+
+    The upper bound is the next prefix in the base32 alphabet rather than a
+    sentinel character, so it sorts correctly under any collation.
+    """
+    chars = list(prefix)
+    while chars:
+        index = BASE32.index(chars[-1])
+        if index + 1 < len(BASE32):
+            chars[-1] = BASE32[index + 1]
+            return prefix, "".join(chars)
+        chars.pop()
+    return prefix, None
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
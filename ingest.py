@@ -0,0 +1,259 @@
+"""Streaming ingestion of clinician directory feeds.
+
+Feeds are read incrementally (CSV, JSON Lines or a JSON array of objects),
+validated row by row and upserted in batches keyed on license_number. Bad
+rows are reported and skipped rather than aborting the load, and clinician
+indexes are rebuilt once at the end. Used by the admin import endpoint and
+from the command line:
+
+    python ingest.py clinicians.csv
+    python ingest.py feed.json --chunk-size 5000
+"""
+import io
+import re
+import csv
+import json
+import time
+import argparse
+from typing import List, Optional
+
+from storage import Storage, create_storage
+
+CHUNK_SIZE = 2000
+MAX_REPORTED_ERRORS = 100
+
+REQUIRED_FIELDS = ("name", "specialty", "location", "license_number")
+CONDITION_CODE = re.compile(r"^F\d{2}(\.\d+)?$")
+TRUE_VALUES = {"true", "yes", "y", "1"}
+FALSE_VALUES = {"false", "no", "n", "0"}
+# Feeds are decoded with errors="replace", so bytes that are not UTF-8 arrive as this
+REPLACEMENT_CHARACTER = "\ufffd"
+
+
+def detect_format(filename: Optional[str]) -> str:
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    return "json"
+
+
+class MalformedRow(ValueError):
+    """Yielded in place of a feed row that could not be parsed, so it is reported
+    like any other bad row"""
+
+
+def iter_csv_rows(stream):
+    reader = csv.DictReader(stream)
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # The reader has consumed the bad line and carries on from the next one
+            yield MalformedRow(f"malformed CSV: {e}")
+            continue
+        yield row
+
+
+# Where the next row can start after a malformed one: a new line (JSON Lines, or an
+# array with one object per line) or "},{" (an array on one line)
+ROW_BOUNDARY = re.compile(r"(?:\n|\}\s*,)\s*(?=\{)")
+
+
+def iter_json_rows(stream, read_size: int = 65536, max_row_chars: int = 1_000_000):
+    """Yield objects from a JSON array or JSON Lines stream without loading it whole.
+    A row that does not parse is yielded as a MalformedRow and skipped up to the
+    next row boundary, so at most max_row_chars of it is ever buffered."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    skipping = False
+
+    while True:
+        if skipping:
+            boundary = ROW_BOUNDARY.search(buffer)
+            if boundary:
+                buffer = buffer[boundary.end():]
+                skipping = False
+            else:
+                # Keep only what could still be the start of a boundary
+                cut = max(buffer.rfind("\n"), buffer.rfind("}"))
+                buffer = buffer[cut:] if cut >= 0 else ""
+        if not skipping:
+            # Skip whitespace and array punctuation between objects
+            buffer = buffer.lstrip().lstrip("[,").lstrip()
+            if buffer.startswith("]"):
+                return
+            if buffer:
+                try:
+                    obj, end = decoder.raw_decode(buffer)
+                except ValueError as e:
+                    # A failure with the rest of its line still buffered is a bad row;
+                    # otherwise the row may just continue in the next chunk. Other
+                    # ValueErrors (such as an over-long number) are always bad rows.
+                    position = getattr(e, "pos", None)
+                    incomplete = (position is not None and "\n" not in buffer[position:]
+                                  and len(buffer) < max_row_chars)
+                    if eof or not incomplete:
+                        yield MalformedRow(f"malformed JSON: {getattr(e, 'msg', e)}")
+                        buffer = buffer[1:]
+                        skipping = True
+                        continue
+                else:
+                    yield obj
+                    buffer = buffer[end:]
+                    continue
+        if eof:
+            return
+        chunk = stream.read(read_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def _parse_bool(value, default: bool) -> bool:
+    if value is None or value == "":
+        return default
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE_VALUES:
+        return True
+    if text in FALSE_VALUES:
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+def _parse_codes(value) -> List[str]:
+    if value is None or value == "":
+        return []
+    if isinstance(value, str):
+        value = value.strip()
+        codes = json.loads(value) if value.startswith("[") else re.split(r"[;,|]", value)
+    else:
+        codes = value
+    return [str(code).strip() for code in codes if str(code).strip()]
+
+
+def validate_clinician(row: dict) -> dict:
+    """Normalize a feed row into clinician columns, raising ValueError listing every problem"""
+    errors = []
+    clean = {}
+
+    for field in REQUIRED_FIELDS:
+        value = row.get(field)
+        value = str(value).strip() if value is not None else ""
+        if not value:
+            errors.append(f"{field} is required")
+        clean[field] = value
+
+    for field in ("phone", "email", "website"):
+        value = row.get(field)
+        clean[field] = str(value).strip() if value not in (None, "") else None
+    if clean["email"] and "@" not in clean["email"]:
+        errors.append("email is not valid")
+
+    try:
+        codes = _parse_codes(row.get("specializes_in"))
+        bad_codes = [code for code in codes if not CONDITION_CODE.match(code)]
+        if bad_codes:
+            errors.append(f"unknown condition codes: {', '.join(bad_codes)}")
+        clean["specializes_in"] = json.dumps(codes)
+    except (ValueError, TypeError):
+        errors.append("specializes_in must be a list of condition codes")
+
+    try:
+        rating = float(row.get("rating") or 0.0)
+        if not 0.0 <= rating <= 5.0:
+            raise ValueError
+        clean["rating"] = rating
+    except (ValueError, TypeError):
+        errors.append("rating must be a number between 0 and 5")
+
+    try:
+        years = row.get("years_experience")
+        clean["years_experience"] = int(years) if years not in (None, "") else None
+        if clean["years_experience"] is not None and clean["years_experience"] < 0:
+            raise ValueError
+    except (ValueError, TypeError):
+        errors.append("years_experience must be a non-negative integer")
+
+    try:
+        clean["accepts_insurance"] = _parse_bool(row.get("accepts_insurance"), True)
+        clean["online_sessions"] = _parse_bool(row.get("online_sessions"), False)
+    except ValueError as e:
+        errors.append(str(e))
+
+    if errors:
+        raise ValueError("; ".join(errors))
+    return clean
+
+
+def ingest_clinicians(storage: Storage, stream, fmt: str = "csv", chunk_size: int = CHUNK_SIZE) -> dict:
+    """Validate and upsert a clinician feed from a text stream, returning a load report"""
+    started = time.monotonic()
+    rows = iter_csv_rows(stream) if fmt == "csv" else iter_json_rows(stream)
+
+    processed = upserted = rejected = 0
+    errors = []
+    batch = {}
+
+    for line_number, row in enumerate(rows, start=1):
+        processed += 1
+        try:
+            if isinstance(row, MalformedRow):
+                raise row
+            if not isinstance(row, dict):
+                raise ValueError("row is not an object")
+            if any(REPLACEMENT_CHARACTER in str(value) for value in row.values()):
+                raise ValueError("row is not valid UTF-8")
+            clinician = validate_clinician(row)
+        except ValueError as e:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                license_number = row.get("license_number") if isinstance(row, dict) else None
+                errors.append({"row": line_number, "license_number": license_number, "error": str(e)})
+            continue
+
+        # Within a batch the last row for a license wins, as it would across batches
+        batch[clinician["license_number"]] = clinician
+        if len(batch) >= chunk_size:
+            upserted += storage.upsert_clinicians(list(batch.values()))
+            batch = {}
+
+    if batch:
+        upserted += storage.upsert_clinicians(list(batch.values()))
+
+    # Rebuild once for the whole load rather than per batch
+    storage.rebuild_clinician_indexes()
+
+    return {
+        "processed": processed,
+        "upserted": upserted,
+        "rejected": rejected,
+        "errors": errors,
+        "elapsed_seconds": round(time.monotonic() - started, 3),
+    }
+
+
+def open_text(binary_stream):
+    """Wrap an uploaded binary file for text parsing (handles a UTF-8 BOM). Bytes that
+    are not UTF-8 are replaced rather than raised, so only their rows are rejected."""
+    return io.TextIOWrapper(binary_stream, encoding="utf-8-sig", errors="replace", newline="")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a clinician directory feed")
+    parser.add_argument("path", help="CSV, JSON array or JSON Lines file")
+    parser.add_argument("--format", choices=("csv", "json"), help="Defaults to the file extension")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    storage = create_storage()
+    storage.init_schema()
+    with open(args.path, encoding="utf-8-sig", errors="replace", newline="") as stream:
+        report = ingest_clinicians(storage, stream, args.format or detect_format(args.path), args.chunk_size)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
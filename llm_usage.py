@@ -0,0 +1,184 @@
+"""Token, cost and latency accounting for OpenAI analyses, and model routing.
+
+Every OpenAI call records its model, prompt and completion tokens, latency
+and cost, and the numbers are saved on the analysis_results row the call
+produced. LLMRouter picks the model and max_tokens for each call: max_tokens
+grows with the number of answers in the session, and the cheaper economy
+model takes over as the day's spend approaches OPENAI_DAILY_BUDGET_USD. Once
+the budget is spent, analyses use the local fallback until the next UTC day.
+
+Daily reports come from the /admin/llm_usage endpoint or the command line:
+
+    python llm_usage.py report --start-date 2025-01-01 --end-date 2025-01-31
+"""
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from storage import Storage, create_storage
+
+# USD per million tokens (prompt, completion); update when OpenAI pricing changes
+PRICES_PER_MILLION = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for routing decisions (about four characters per token)"""
+    return len(text) // 4 + 1
+
+
+def call_cost(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> Optional[float]:
+    if model not in PRICES_PER_MILLION or prompt_tokens is None:
+        return None
+    prompt_price, completion_price = PRICES_PER_MILLION[model]
+    return round((prompt_tokens * prompt_price + (completion_tokens or 0) * completion_price) / 1_000_000, 6)
+
+
+def today() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+class LLMRouter:
+    """Chooses the model and max_tokens for an analysis from session size and the daily budget"""
+
+    def __init__(self, spend_since: Callable[[str], float], primary_model: str, economy_model: str,
+                 daily_budget: Optional[float] = None, economy_fraction: float = 0.8,
+                 economy_prompt_tokens: int = 0, min_tokens: int = 400, tokens_per_answer: int = 40,
+                 max_tokens: int = 1000, refresh_seconds: float = 30.0):
+        self.spend_since = spend_since
+        self.primary_model = primary_model
+        self.economy_model = economy_model
+        self.daily_budget = daily_budget
+        self.economy_fraction = economy_fraction
+        self.economy_prompt_tokens = economy_prompt_tokens
+        self.min_tokens = min_tokens
+        self.tokens_per_answer = tokens_per_answer
+        self.max_tokens = max_tokens
+        self.refresh_seconds = refresh_seconds
+
+        self._lock = threading.Lock()
+        # Today's spend as last read from the database, plus this worker's calls since
+        self._day = None
+        self._spend = 0.0
+        self._read_at = 0.0
+        self._counters = {"calls": 0, "errors": 0, "truncated": 0, "routed_economy": 0, "budget_skipped": 0}
+        self._by_model = {}
+
+    def spend_today(self) -> float:
+        with self._lock:
+            day = today()
+            if day != self._day or time.monotonic() - self._read_at > self.refresh_seconds:
+                self._spend = self.spend_since(day)
+                self._day = day
+                self._read_at = time.monotonic()
+            return self._spend
+
+    def route(self, prompt: str, answers: int) -> Optional[dict]:
+        """{"model", "max_tokens", "reason"} for a call, or None when the budget is spent"""
+        prompt_tokens = estimate_tokens(prompt)
+        max_tokens = max(self.min_tokens, min(self.max_tokens, self.min_tokens + self.tokens_per_answer * answers))
+        model, reason = self.primary_model, "default"
+
+        if self.daily_budget:
+            spent = self.spend_today()
+            if spent >= self.daily_budget:
+                with self._lock:
+                    self._counters["budget_skipped"] += 1
+                return None
+            if spent >= self.daily_budget * self.economy_fraction:
+                model, reason = self.economy_model, "budget"
+        if model == self.primary_model and prompt_tokens <= self.economy_prompt_tokens:
+            model, reason = self.economy_model, "small_session"
+
+        if model != self.primary_model:
+            with self._lock:
+                self._counters["routed_economy"] += 1
+        return {"model": model, "max_tokens": max_tokens, "reason": reason}
+
+    def record(self, usage: dict, truncated: bool = False):
+        """Count a finished (or failed) call towards today's spend and the metrics"""
+        with self._lock:
+            self._counters["calls"] += 1
+            if usage.get("prompt_tokens") is None:
+                self._counters["errors"] += 1
+            if truncated:
+                self._counters["truncated"] += 1
+            if self._day == today():
+                self._spend += usage.get("cost_usd") or 0.0
+            model = self._by_model.setdefault(usage["model"], {"calls": 0, "tokens": 0, "cost_usd": 0.0})
+            model["calls"] += 1
+            model["tokens"] += (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+            model["cost_usd"] = round(model["cost_usd"] + (usage.get("cost_usd") or 0.0), 6)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "daily_budget_usd": self.daily_budget,
+                "spend_today_usd": round(self._spend, 4) if self._day == today() else None,
+                "by_model": {name: dict(stats) for name, stats in self._by_model.items()},
+                **self._counters,
+            }
+
+
+def _percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    if not ordered:
+        return None
+    return round(ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))], 1)
+
+
+def daily_report(storage: Storage, start_date: Optional[str] = None, end_date: Optional[str] = None) -> List[dict]:
+    """Calls, tokens, cost and latency percentiles per UTC day and model"""
+    groups: Dict[tuple, dict] = {}
+    for row in storage.iter_llm_usage(start_date, end_date):
+        key = (str(row["created_at"])[:10], row["llm_model"])
+        group = groups.setdefault(key, {"calls": 0, "failed": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                                        "cost_usd": 0.0, "latencies": []})
+        group["calls"] += 1
+        if row["prompt_tokens"] is None:
+            group["failed"] += 1
+        group["prompt_tokens"] += row["prompt_tokens"] or 0
+        group["completion_tokens"] += row["completion_tokens"] or 0
+        group["cost_usd"] += row["cost_usd"] or 0.0
+        if row["llm_latency_ms"] is not None:
+            group["latencies"].append(row["llm_latency_ms"])
+
+    report = []
+    for (day, model), group in sorted(groups.items()):
+        latencies = sorted(group.pop("latencies"))
+        report.append({
+            "day": day,
+            "model": model,
+            **group,
+            "cost_usd": round(group["cost_usd"], 4),
+            "latency_p50_ms": _percentile(latencies, 0.5),
+            "latency_p95_ms": _percentile(latencies, 0.95),
+            "latency_max_ms": round(latencies[-1], 1) if latencies else None,
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI usage reports")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Per-day calls, tokens, cost and latency")
+    report_parser.add_argument("--start-date", help="YYYY-MM-DD, inclusive")
+    report_parser.add_argument("--end-date", help="YYYY-MM-DD, inclusive")
+    args = parser.parse_args()
+
+    storage = create_storage()
+    storage.init_schema()
+    if args.command == "report":
+        for row in daily_report(storage, args.start_date, args.end_date):
+            sys.stdout.write(json.dumps(row) + "\n")
+
+
+if __name__ == "__main__":
+    main()
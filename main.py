@@ -1,15 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Depends, Query, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
-import sqlite3
 import json
+import base64
 from datetime import datetime
 import os
+import time
+import asyncio
+import anyio.to_thread
 from openai import OpenAI
 import re
 from dotenv import load_dotenv
 import uuid
+import secrets
+from storage import create_storage, IntegrityError, SQLiteStorage
+from retention import RetentionScheduler
+import export
+import ingest
+import geo
+from breaker import CircuitBreaker
+import rules
+from matcher import ClinicianMatcher
+from admission import AdmissionController, AdmissionMiddleware, Overloaded, Pool
+from writebehind import WriteBehindWriter
+from cache import LRUCache, CacheNamespace, create_cache_backend
+from compression import CompressionMiddleware
+import llm_usage
+from risk import RiskEvaluator
 
 load_dotenv()
 
@@ -17,12 +37,67 @@ load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY", "your-openai-api-key-here")
 client = OpenAI(api_key=api_key)
 
+# Calls to OpenAI go through a circuit breaker: during an outage analyses drop
+# straight to fallback_analysis, and timeouts follow observed p95 latency
+openai_breaker = CircuitBreaker(
+    "openai",
+    window_seconds=float(os.getenv("OPENAI_BREAKER_WINDOW_SECONDS", "60")),
+    min_calls=int(os.getenv("OPENAI_BREAKER_MIN_CALLS", "5")),
+    failure_rate=float(os.getenv("OPENAI_BREAKER_FAILURE_RATE", "0.5")),
+    slow_call_seconds=float(os.getenv("OPENAI_SLOW_CALL_SECONDS", "10")),
+    open_seconds=float(os.getenv("OPENAI_BREAKER_OPEN_SECONDS", "30")),
+    timeout_min=float(os.getenv("OPENAI_TIMEOUT_MIN_SECONDS", "2")),
+    timeout_max=float(os.getenv("OPENAI_TIMEOUT_MAX_SECONDS", "30")),
+)
+
 app = FastAPI(title="Enhanced Mental Health Assessment API")
 origins = [
     "http://localhost:3000",  # frontend dev server
     "https://your-production-frontend.com"  # optional
 ]
 
+# Admission control: analyses, bulk transfers and everything else get separate
+# concurrency limits and wait queues, and analyses yield to interactive calls
+def admission_pool(path: str) -> Optional[str]:
+    """Admission pool for a request path (None for health and metrics, which are never queued)"""
+    if path in ("/", "/metrics"):
+        return None
+    if path.startswith("/analyze_session"):
+        return "analysis"
+    if path.startswith(("/export", "/admin")):
+        return "bulk"
+    return "interactive"
+
+interactive_pool = Pool(
+    "interactive",
+    max_concurrent=int(os.getenv("INTERACTIVE_MAX_CONCURRENT", "64")),
+    max_queue=int(os.getenv("INTERACTIVE_MAX_QUEUE", "256")),
+    max_wait=float(os.getenv("INTERACTIVE_MAX_WAIT_SECONDS", "5")),
+)
+admission = AdmissionController(
+    {
+        "interactive": interactive_pool,
+        "analysis": Pool(
+            "analysis",
+            max_concurrent=int(os.getenv("ANALYSIS_MAX_CONCURRENT", "4")),
+            max_queue=int(os.getenv("ANALYSIS_MAX_QUEUE", "16")),
+            max_wait=float(os.getenv("ANALYSIS_MAX_WAIT_SECONDS", "15")),
+            yields_to=interactive_pool,
+        ),
+        "bulk": Pool(
+            "bulk",
+            max_concurrent=int(os.getenv("BULK_MAX_CONCURRENT", "2")),
+            max_queue=int(os.getenv("BULK_MAX_QUEUE", "4")),
+            max_wait=float(os.getenv("BULK_MAX_WAIT_SECONDS", "30")),
+        ),
+    },
+    classify=admission_pool,
+)
+
+# Compress JSON bodies above COMPRESSION_MIN_BYTES (brotli when installed, else gzip)
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_BYTES", "1024")))
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # Or ["*"] for testing
@@ -33,112 +108,22 @@ app.add_middleware(
 # CORS middleware
 
 
-DATABASE_URL = "enhanced_mental_health.db"
+# Storage backend (SQLite by default, PostgreSQL with STORAGE_BACKEND=postgres)
+storage = create_storage()
+
+# Threads for sync endpoints and run_in_threadpool calls; create_storage sizes the
+# PostgreSQL pools to match
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40"))
+
+@app.on_event("startup")
+async def size_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
 
 def init_db():
-    conn = sqlite3.connect(DATABASE_URL)
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            age INTEGER,
-            gender TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    #session table 
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sessions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            session_id TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Questions table for structured questions
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS questions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            question_type TEXT NOT NULL,
-            question_text TEXT NOT NULL,
-            options TEXT, -- JSON string for multiple choice
-            scale_min INTEGER,
-            scale_max INTEGER,
-            is_follow_up BOOLEAN DEFAULT FALSE,
-            parent_question_id INTEGER,
-            trigger_condition TEXT
-        )
-    ''')
-    
-    # Responses table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS responses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            question_id INTEGER,
-            response_value TEXT NOT NULL,
-            response_text TEXT,
-            day_number INTEGER,
-            session_id TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (question_id) REFERENCES questions (id)
-        )
-    ''')
-    
-    # Analysis results table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS analysis_results (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            session_id TEXT,
-            conditions TEXT, -- JSON string
-            clinicians TEXT, -- JSON string
-            overall_score INTEGER,
-            risk_level TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Real clinicians database
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS clinicians (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            specialty TEXT NOT NULL,
-            location TEXT NOT NULL,
-            phone TEXT,
-            email TEXT,
-            website TEXT,
-            license_number TEXT,
-            specializes_in TEXT, -- JSON string of condition codes
-            rating REAL DEFAULT 0.0,
-            years_experience INTEGER,
-            accepts_insurance BOOLEAN DEFAULT TRUE,
-            online_sessions BOOLEAN DEFAULT FALSE
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    storage.init_schema()
 
 # Initialize database and populate with structured questions
 def populate_questions():
-    conn = sqlite3.connect(DATABASE_URL)
-    cursor = conn.cursor()
-    
-    # Check if questions already exist
-    cursor.execute("SELECT COUNT(*) FROM questions")
-    if cursor.fetchone()[0] > 0:
-        conn.close()
-        return
-    
     questions_data = [
         # Mood Check
         {
@@ -259,36 +244,11 @@ def populate_questions():
         }
     ]
     
-    for q in questions_data:
-        cursor.execute('''
-            INSERT INTO questions (question_type, question_text, options, scale_min, scale_max, 
-                                 is_follow_up, parent_question_id, trigger_condition)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            q["question_type"],
-            q["question_text"],
-            q.get("options"),
-            q.get("scale_min"),
-            q.get("scale_max"),
-            q.get("is_follow_up", False),
-            q.get("parent_question_id"),
-            q.get("trigger_condition")
-        ))
-    
-    conn.commit()
-    conn.close()
+    # Only inserted when the questions table is empty
+    storage.seed_questions(questions_data)
 
 # Populate real clinicians database
 def populate_clinicians():
-    conn = sqlite3.connect(DATABASE_URL)
-    cursor = conn.cursor()
-    
-    # Check if clinicians already exist
-    cursor.execute("SELECT COUNT(*) FROM clinicians")
-    if cursor.fetchone()[0] > 0:
-        conn.close()
-        return
-    
     clinicians_data = [
         {
             "name": "Dr. Sarah Mitchell",
@@ -404,34 +364,85 @@ def populate_clinicians():
         }
     ]
     
-    for clinician in clinicians_data:
-        cursor.execute('''
-            INSERT INTO clinicians (name, specialty, location, phone, email, website, 
-                                  license_number, specializes_in, rating, years_experience, 
-                                  accepts_insurance, online_sessions)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            clinician["name"],
-            clinician["specialty"],
-            clinician["location"],
-            clinician["phone"],
-            clinician["email"],
-            clinician["website"],
-            clinician["license_number"],
-            clinician["specializes_in"],
-            clinician["rating"],
-            clinician["years_experience"],
-            clinician["accepts_insurance"],
-            clinician["online_sessions"]
-        ))
-    
-    conn.commit()
-    conn.close()
+    # Only inserted when the clinicians table is empty
+    storage.seed_clinicians(clinicians_data)
 
 # Initialize database with data
 init_db()
 populate_questions()
 populate_clinicians()
+storage.geocode_missing_clinicians()
+
+# Archive closed sessions and vacuum the live database in the background
+RETENTION_ENABLED = os.getenv("RETENTION_ENABLED", "true").lower() == "true"
+retention_scheduler = None
+
+@app.on_event("startup")
+def start_retention():
+    global retention_scheduler
+    if RETENTION_ENABLED and isinstance(storage, SQLiteStorage):
+        retention_scheduler = RetentionScheduler(storage)
+        retention_scheduler.start()
+
+@app.on_event("shutdown")
+def stop_retention():
+    if retention_scheduler:
+        retention_scheduler.stop()
+
+# Optional write-behind for submissions: acknowledged once journaled, group-committed
+# in the background. Replays any journal left behind by a crashed worker on startup.
+# Reads see queued answers only on the worker that journaled them, so with several
+# workers or nodes this needs requests routed sticky by session_id (see writebehind.py).
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "false").lower() == "true"
+response_writer = None
+
+@app.on_event("startup")
+def start_write_behind():
+    global response_writer
+    if WRITE_BEHIND:
+        response_writer = WriteBehindWriter(
+            storage,
+            os.getenv("WRITE_BEHIND_JOURNAL_DIR", "journal"),
+            flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_MS", "5")) / 1000,
+            max_batch=int(os.getenv("WRITE_BEHIND_MAX_BATCH", "500")),
+        )
+        response_writer.start()
+
+@app.on_event("shutdown")
+def stop_write_behind():
+    if response_writer:
+        response_writer.stop()
+
+# Cache for derived data: in-process by default, or shared by every worker and node
+# through Redis with CACHE_URL, where data changes are announced over pub/sub
+cache_backend = create_cache_backend(os.getenv("CACHE_URL"))
+
+@app.on_event("shutdown")
+def close_cache_backend():
+    cache_backend.close()
+
+question_cache = CacheNamespace(
+    "questions", cache_backend,
+    version=lambda: storage.get_version(storage.QUESTIONS_VERSION),
+    max_entries=1,
+    poll_seconds=float(os.getenv("QUESTIONS_VERSION_TTL_SECONDS", "5")),
+)
+
+def list_questions() -> List[dict]:
+    """All questions, served from the cache until they are reseeded"""
+    return question_cache.get_or_compute("all", storage.list_questions)
+
+# Streaming high-risk detection on every submitted answer; alerts go to the risk_alerts outbox
+risk_evaluator = RiskEvaluator(storage, questions=list_questions)
+
+def read_own_writes(user_id: int, session_id: str):
+    """Wait for this session's queued submissions to commit before reading it"""
+    if response_writer and response_writer.has_pending(user_id, session_id):
+        response_writer.wait_committed(user_id, session_id)
+
+def session_responses(user_id: int, session_id: str) -> List[dict]:
+    read_own_writes(user_id, session_id)
+    return storage.get_session_responses(user_id, session_id)
 
 # Pydantic models
 class UserRegister(BaseModel):
@@ -446,6 +457,8 @@ class ResponseSubmit(BaseModel):
     response_value: str
     response_text: Optional[str] = None
     session_id: str
+    # Optional client key; a retried submission with the same key is not applied twice
+    idempotency_key: Optional[str] = None
 
 class QuestionResponse(BaseModel):
     id: int
@@ -457,10 +470,33 @@ class QuestionResponse(BaseModel):
     is_follow_up: bool = False
 
 # Helper functions
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE_URL)
-    conn.row_factory = sqlite3.Row
-    return conn
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Guard for bulk data and admin endpoints, which need the X-Admin-Token header"""
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+def parse_date(value: Optional[str], name: str) -> Optional[str]:
+    """Validate an optional YYYY-MM-DD query parameter"""
+    if value is None:
+        return None
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be YYYY-MM-DD")
+    return value
+
+def parse_fields(value: Optional[str], allowed) -> Optional[List[str]]:
+    """Validate an optional comma-separated fields= projection"""
+    if not value:
+        return None
+    fields = list(dict.fromkeys(f.strip() for f in value.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in allowed]
+    if unknown or not fields:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown fields {', '.join(unknown)}, expected some of {', '.join(allowed)}")
+    return fields
 
 def should_show_follow_up(parent_response: str, trigger_condition: str) -> bool:
     """Determine if follow-up question should be shown based on trigger condition"""
@@ -484,70 +520,183 @@ def should_show_follow_up(parent_response: str, trigger_condition: str) -> bool:
 
 def get_questions_for_session(user_id: int, session_id: str) -> List[dict]:
     """Get all questions for a session, including follow-ups based on responses"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get all base questions (non-follow-ups)
-    cursor.execute("""
-        SELECT * FROM questions 
-        WHERE is_follow_up = FALSE 
-        ORDER BY id
-    """)
-    base_questions = cursor.fetchall()
+    all_questions = list_questions()
     
     # Get user's responses for this session
-    cursor.execute("""
-        SELECT question_id, response_value 
-        FROM responses 
-        WHERE user_id = ? AND session_id = ?
-    """, (user_id, session_id))
-    user_responses = {row[0]: row[1] for row in cursor.fetchall()}
+    user_responses = storage.get_session_answers(user_id, session_id)
+    return visible_questions(all_questions, user_responses)
+
+def visible_questions(all_questions: List[dict], user_responses: Dict[int, str]) -> List[dict]:
+    """Base questions in order, each followed by the follow-ups its answer triggers"""
+    follow_ups_by_parent = {}
+    for question in all_questions:
+        if question['is_follow_up']:
+            follow_ups_by_parent.setdefault(question['parent_question_id'], []).append(question)
     
     questions_to_show = []
     
-    for question in base_questions:
-        questions_to_show.append(dict(question))
+    # Walk the base questions (non-follow-ups) in order
+    for question in all_questions:
+        if question['is_follow_up']:
+            continue
+        questions_to_show.append(question)
         
         # Check if this question has follow-ups and if conditions are met
-        cursor.execute("""
-            SELECT * FROM questions 
-            WHERE parent_question_id = ? AND is_follow_up = TRUE
-        """, (question['id'],))
-        follow_ups = cursor.fetchall()
-        
-        for follow_up in follow_ups:
+        for follow_up in follow_ups_by_parent.get(question['id'], []):
             if question['id'] in user_responses:
                 parent_response = user_responses[question['id']]
                 if should_show_follow_up(parent_response, follow_up['trigger_condition']):
-                    questions_to_show.append(dict(follow_up))
+                    questions_to_show.append(follow_up)
     
-    conn.close()
     return questions_to_show
 
-def find_matching_clinicians(conditions: List[dict]) -> List[dict]:
-    """Find clinicians who specialize in the identified conditions"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    matching_clinicians = []
-    condition_codes = [c['code'] for c in conditions]
-    
-    cursor.execute("SELECT * FROM clinicians ORDER BY rating DESC")
-    all_clinicians = cursor.fetchall()
+DEFAULT_RADIUS_MILES = float(os.getenv("DEFAULT_RADIUS_MILES", "50"))
+
+def with_distance_miles(clinician: dict) -> dict:
+    """Replace the storage layer's distance_km with a rounded distance in miles"""
+    clinician['distance_miles'] = round(clinician.pop('distance_km') / geo.KM_PER_MILE, 1)
+    return clinician
+
+# Blended ranking weights: condition-code match, free-text similarity, rating and locality
+MATCH_WEIGHT_CODE = 1.0
+MATCH_WEIGHT_TEXT = 1.0
+MATCH_WEIGHT_RATING = 0.3
+MATCH_WEIGHT_LOCAL = 1.0
+# Clinicians without a matching code need at least this text similarity
+MIN_TEXT_SIMILARITY = float(os.getenv("MIN_TEXT_SIMILARITY", "0.15"))
+
+# Clinician data version, read at most once a second per worker (at once when another
+# worker announces an import); cached recommendations and the text index are rebuilt
+# whenever it moves on
+CLINICIAN_VERSION_TTL_SECONDS = float(os.getenv("CLINICIAN_VERSION_TTL_SECONDS", "1"))
+recommendation_cache = CacheNamespace(
+    "recommendations", cache_backend,
+    version=lambda: storage.get_version(storage.CLINICIANS_VERSION),
+    max_entries=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "256")),
+    poll_seconds=CLINICIAN_VERSION_TTL_SECONDS,
+)
+
+def clinician_version(refresh: bool = False) -> int:
+    """The clinician data version; refresh after changing clinicians to tell every worker"""
+    if refresh:
+        return recommendation_cache.invalidate()
+    return recommendation_cache.version()
+
+clinician_matcher = ClinicianMatcher(storage.list_clinicians, version=clinician_version)
+
+# How many clinicians matched only on free text are scored per request
+MAX_TEXT_ONLY_CANDIDATES = 25
+
+def session_free_text(responses: List[dict]) -> str:
+    """The free-text part of a session's answers (follow-up descriptions and the like)"""
+    return "\n".join(r['response_text'] for r in responses if r.get('response_text'))
+
+def locality_score(clinician: dict, radius_miles: float) -> float:
+    """Within the radius, nearer clinicians get more of the locality weight"""
+    if 'distance_miles' not in clinician or radius_miles <= 0:
+        return 0.0
+    return 0.5 + 0.5 * max(0.0, 1 - clinician['distance_miles'] / radius_miles)
+
+def base_match_score(clinician: dict, code_match: bool, radius_miles: float) -> float:
+    """Everything in the ranking except free-text similarity"""
+    return (MATCH_WEIGHT_CODE * code_match
+            + MATCH_WEIGHT_RATING * (clinician['rating'] or 0) / 5
+            + MATCH_WEIGHT_LOCAL * locality_score(clinician, radius_miles))
+
+def code_matched_clinicians(condition_codes: tuple, coords, radius_miles: float) -> List[dict]:
+    """Clinicians specializing in any of the codes, best base score first.
+
+    Only those that similarity could still lift into the top 5 are kept, since
+    text similarity adds at most MATCH_WEIGHT_TEXT to a score.
+    """
+    # Local clinicians (with distances) first, then everyone else
+    candidates = {}
+    if coords:
+        for clinician in storage.find_clinicians_near(coords[0], coords[1], radius_miles * geo.KM_PER_MILE):
+            candidates[clinician['id']] = with_distance_miles(clinician)
+    for clinician in storage.list_clinicians():
+        candidates.setdefault(clinician['id'], clinician)
     
-    for clinician in all_clinicians:
+    matched = []
+    for clinician in candidates.values():
         specializes_in = json.loads(clinician['specializes_in'])
         # Check if any of the clinician's specializations match our conditions
-        if any(code in specializes_in or code.split('.')[0] in specializes_in for code in condition_codes):
-            clinician_dict = dict(clinician)
-            clinician_dict['specializes_in'] = specializes_in
-            matching_clinicians.append(clinician_dict)
+        if not any(code in specializes_in or code.split('.')[0] in specializes_in for code in condition_codes):
+            continue
+        clinician['specializes_in'] = specializes_in
+        clinician['base_score'] = base_match_score(clinician, True, radius_miles)
+        matched.append(clinician)
     
-    conn.close()
-    return matching_clinicians[:5]  # Return top 5 matches
+    matched.sort(key=lambda c: c['base_score'], reverse=True)
+    if len(matched) > 5:
+        cutoff = matched[4]['base_score'] - MATCH_WEIGHT_TEXT
+        matched = [c for c in matched if c['base_score'] >= cutoff]
+    return matched
+
+def text_only_clinicians(similarities: Dict[int, float], exclude: set, coords, radius_miles: float) -> List[dict]:
+    """The most similar clinicians without a matching code, scored like code matches"""
+    ids = sorted((cid for cid, similarity in similarities.items()
+                  if similarity >= MIN_TEXT_SIMILARITY and cid not in exclude),
+                 key=lambda cid: similarities[cid], reverse=True)[:MAX_TEXT_ONLY_CANDIDATES]
+    
+    clinicians = []
+    for clinician in storage.get_clinicians_by_ids(ids):
+        if coords and clinician.get('latitude') is not None:
+            distance_km = geo.haversine_km(coords[0], coords[1], clinician['latitude'], clinician['longitude'])
+            if distance_km <= radius_miles * geo.KM_PER_MILE:
+                clinician['distance_km'] = distance_km
+                with_distance_miles(clinician)
+        clinician['specializes_in'] = json.loads(clinician['specializes_in'])
+        clinician['base_score'] = base_match_score(clinician, False, radius_miles)
+        clinicians.append(clinician)
+    return clinicians
+
+def find_matching_clinicians(conditions: List[dict], location: Optional[str] = None,
+                             radius_miles: float = DEFAULT_RADIUS_MILES,
+                             session_text: Optional[str] = None) -> List[dict]:
+    """Rank clinicians by condition match, similarity to the session's free text, rating and distance.
+
+    Code matches for a condition set are cached per clinician data version;
+    free-text similarity is per session and is blended in on each call.
+    """
+    condition_codes = tuple(sorted({c['code'].strip().upper() for c in conditions}))
+    coords = geo.geocode(location)
+    matched = recommendation_cache.get_or_compute(
+        (condition_codes, coords, radius_miles),
+        lambda: code_matched_clinicians(condition_codes, coords, radius_miles))
+    
+    similarities = clinician_matcher.similarities(session_text) if session_text else {}
+    candidates = [dict(c) for c in matched]
+    if similarities:
+        candidates += text_only_clinicians(similarities, {c['id'] for c in matched}, coords, radius_miles)
+    
+    for clinician in candidates:
+        similarity = similarities.get(clinician['id'], 0.0)
+        clinician['text_similarity'] = round(similarity, 3)
+        clinician['match_score'] = round(clinician.pop('base_score') + MATCH_WEIGHT_TEXT * similarity, 3)
+    
+    candidates.sort(key=lambda c: c['match_score'], reverse=True)
+    return candidates[:5]  # Return top 5 matches
+
+# Model and max_tokens per call follow session size and the daily budget, and
+# every call's tokens, latency and cost are saved with its analysis
+llm_router = llm_usage.LLMRouter(
+    storage.llm_spend_since,
+    primary_model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+    economy_model=os.getenv("OPENAI_ECONOMY_MODEL", "gpt-4o-mini"),
+    daily_budget=float(os.getenv("OPENAI_DAILY_BUDGET_USD", "0")) or None,
+    economy_fraction=float(os.getenv("OPENAI_ECONOMY_BUDGET_FRACTION", "0.8")),
+    economy_prompt_tokens=int(os.getenv("OPENAI_ECONOMY_PROMPT_TOKENS", "0")),
+    max_tokens=int(os.getenv("OPENAI_MAX_TOKENS", "1000")),
+)
 
 def analyze_responses_with_openai(responses: List[dict]) -> dict:
-    """Analyze responses using OpenAI for more accurate assessment"""
+    """Analyze responses using OpenAI for more accurate assessment.
+    
+    The returned analysis carries the call's accounting under "usage", which
+    storage saves in its own columns.
+    """
+    usage = {}
     try:
         # Prepare response text for analysis
         response_text = ""
@@ -607,25 +756,52 @@ Consider these ICD-10 codes:
 
 Be conservative with probability scores and focus on actionable insights."""
 
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=1000,
-            temperature=0.3
-        )
+        route = llm_router.route(prompt, len(responses))
+        if route is None:
+            # Today's OpenAI budget is spent
+            return fallback_analysis(responses)
+        usage["model"] = route["model"]
+        
+        # The breaker sets the timeout and handles failures, so the SDK does not retry
+        def request_analysis(timeout):
+            started = time.monotonic()
+            try:
+                return client.with_options(timeout=timeout, max_retries=0).chat.completions.create(
+                    model=route["model"],
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=route["max_tokens"],
+                    temperature=0.3
+                )
+            finally:
+                usage["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        
+        response = openai_breaker.call(request_analysis)
+        usage["prompt_tokens"] = response.usage.prompt_tokens
+        usage["completion_tokens"] = response.usage.completion_tokens
+        usage["cost_usd"] = llm_usage.call_cost(route["model"], usage["prompt_tokens"], usage["completion_tokens"])
+        llm_router.record(usage, truncated=response.choices[0].finish_reason == "length")
         
         # Parse JSON response
         result_text = response.choices[0].message.content.strip()
         json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
         
         if json_match:
-            return json.loads(json_match.group())
+            analysis = json.loads(json_match.group())
+            analysis['tier'] = rules.TIER_LLM
+            analysis['usage'] = usage
+            return analysis
         else:
             raise ValueError("Could not parse JSON from OpenAI response")
             
     except Exception as e:
         print(f"OpenAI analysis error: {e}")
-        return fallback_analysis(responses)
+        analysis = fallback_analysis(responses)
+        if "latency_ms" in usage:
+            # The call was made (and may have been billed) even though it failed
+            if "prompt_tokens" not in usage:
+                llm_router.record(usage)
+            analysis['usage'] = usage
+        return analysis
 
 def fallback_analysis(responses: List[dict]) -> dict:
     """Fallback analysis when OpenAI is unavailable"""
@@ -684,41 +860,115 @@ def fallback_analysis(responses: List[dict]) -> dict:
             "Practice daily self-care activities",
             "Maintain regular sleep schedule"
         ],
-        "overall_score": overall_score
+        "overall_score": overall_score,
+        "tier": rules.TIER_FALLBACK
     }
 
+# Bump PROMPT_VERSION when the OpenAI prompt changes; the batch re-analysis
+# pipeline redoes analyses saved under an older version
+PROMPT_VERSION = 1
+ANALYSIS_VERSION = f"prompt-{PROMPT_VERSION}.rules-{rules.RULES_VERSION}"
+
+tier_metrics = rules.TierMetrics()
+
+def analyze_responses_tiered(responses: List[dict]) -> dict:
+    """Analyze clear-cut sessions with the local rules and the rest with OpenAI"""
+    started = time.monotonic()
+    decision = rules.evaluate(responses)
+    if decision['tier'] == rules.TIER_RULES:
+        analysis = decision['analysis']
+    else:
+        analysis = analyze_responses_with_openai(responses)
+    tier_metrics.record(analysis['tier'], time.monotonic() - started)
+    return analysis
+
 # API Endpoints
 @app.get("/")
 async def root():
     return {"message": "Enhanced Mental Health Assessment API is running"}
 
+# Concurrent analyses of the same session share one run. Within a worker they
+# await the same future; across workers a lease row in analysis_locks lets one
+# worker analyze while the others wait for the row it saves.
+ANALYSIS_LOCK_TTL_SECONDS = float(os.getenv("ANALYSIS_LOCK_TTL_SECONDS", "120"))
+ANALYSIS_LOCK_POLL_SECONDS = float(os.getenv("ANALYSIS_LOCK_POLL_SECONDS", "0.25"))
+
+inflight_analyses: Dict[tuple, asyncio.Future] = {}
+
+def run_analysis(responses: List[dict], location: Optional[str], radius_miles: float):
+    analysis = analyze_responses_tiered(responses)
+    clinicians = find_matching_clinicians(analysis.get('conditions', []), location, radius_miles,
+                                          session_free_text(responses))
+    return analysis, clinicians
+
+def reuse_analysis(row: dict, responses: List[dict], location: Optional[str], radius_miles: float):
+    """Another worker's saved analysis of the session. The lease is per session, so that
+    worker may have matched clinicians for another location or radius; they are matched
+    again for this request rather than taken from the row."""
+    analysis = json.loads(row['conditions'])
+    clinicians = find_matching_clinicians(analysis.get('conditions', []), location, radius_miles,
+                                          session_free_text(responses))
+    return analysis, clinicians
+
+async def analyze_once(user_id: int, session_id: str, responses: List[dict],
+                       location: Optional[str], radius_miles: float):
+    """Analyze and save a session, or wait for another worker's analysis of it to be saved"""
+    owner = uuid.uuid4().hex
+    previous = await run_in_threadpool(storage.get_latest_analysis, user_id, session_id)
+    previous_id = previous['id'] if previous else None
+    
+    while True:
+        if await run_in_threadpool(storage.try_acquire_analysis_lock, user_id, session_id, owner,
+                                   ANALYSIS_LOCK_TTL_SECONDS):
+            try:
+                # Another worker may have saved its analysis and released the lease
+                # between our first read and taking it over
+                latest = await run_in_threadpool(storage.get_latest_analysis, user_id, session_id)
+                if latest and latest['id'] != previous_id:
+                    return await run_in_threadpool(reuse_analysis, latest, responses, location, radius_miles)
+                analysis, clinicians = await run_in_threadpool(run_analysis, responses, location, radius_miles)
+                # Fallback analyses are saved unversioned so the batch pipeline redoes them
+                version = ANALYSIS_VERSION if analysis.get('tier') != rules.TIER_FALLBACK else None
+                await run_in_threadpool(storage.insert_analysis, user_id, session_id, analysis, clinicians, version)
+                # Usage accounting is stored, not shown to users
+                analysis.pop('usage', None)
+                return analysis, clinicians
+            finally:
+                await run_in_threadpool(storage.release_analysis_lock, user_id, session_id, owner)
+        
+        # Another worker holds the lease; use its result once saved, or take over if the lease expires
+        await asyncio.sleep(ANALYSIS_LOCK_POLL_SECONDS)
+        latest = await run_in_threadpool(storage.get_latest_analysis, user_id, session_id)
+        if latest and latest['id'] != previous_id:
+            return await run_in_threadpool(reuse_analysis, latest, responses, location, radius_miles)
+
+async def analyze_session_single_flight(user_id: int, session_id: str, responses: List[dict],
+                                        location: Optional[str], radius_miles: float):
+    key = (user_id, session_id, (location or "").strip().lower(), radius_miles)
+    future = inflight_analyses.get(key)
+    if future is None:
+        future = asyncio.ensure_future(analyze_once(user_id, session_id, responses, location, radius_miles))
+        inflight_analyses[key] = future
+        future.add_done_callback(lambda _: inflight_analyses.pop(key, None))
+    # Shielded so a disconnecting client does not cancel the run the others are waiting on
+    return await asyncio.shield(future)
+
 import uuid
 from fastapi import FastAPI, HTTPException
 # Adjust as per your code
 
+# Endpoints that use storage are plain def, so FastAPI runs them in its threadpool:
+# write retries back off with time.sleep and SQLite waits out its busy timeout on
+# the calling thread, which must never be the event loop. The async ones (analysis
+# and the WebSocket channel) hand each storage call to run_in_threadpool instead.
 @app.post("/register_user")
-async def register_user(user: UserRegister):
-    conn = get_db_connection()
+def register_user(user: UserRegister):
     try:
-        cursor = conn.cursor()
-
-        # Insert into users table
-        cursor.execute(
-            "INSERT INTO users (name, email, age, gender) VALUES (?, ?, ?, ?)",
-            (user.name, user.email, user.age, user.gender)
-        )
-        user_id = cursor.lastrowid
-
         # Generate session_id using uuid4
         session_id = str(uuid.uuid4())
 
-        # Insert into sessions table
-        cursor.execute(
-            "INSERT INTO sessions (session_id, user_id) VALUES (?, ?)",
-            (session_id, user_id)
-        )
-
-        conn.commit()
+        # Insert the user and their first session
+        user_id = storage.register_user(user.name, user.email, user.age, user.gender, session_id)
 
         return {
             "user_id": user_id,
@@ -726,148 +976,422 @@ async def register_user(user: UserRegister):
             "message": "User registered and session started successfully"
         }
 
-    except sqlite3.IntegrityError:
+    except IntegrityError:
         raise HTTPException(status_code=400, detail="Email already exists")
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    finally:
-        conn.close()
-
 
 @app.get("/get_questions/{user_id}/{session_id}")
-async def get_questions(user_id: int, session_id: str):
+def get_questions(user_id: int, session_id: str):
     """Get all questions for a user session, including dynamic follow-ups"""
+    read_own_writes(user_id, session_id)
     questions = get_questions_for_session(user_id, session_id)
+    return {"questions": [format_question(q) for q in questions]}
+
+def format_question(q: dict) -> dict:
+    """A question row in the shape the client renders"""
+    question_data = {
+        "id": q["id"],
+        "question_type": q["question_type"],
+        "question_text": q["question_text"],
+        "is_follow_up": q["is_follow_up"]
+    }
     
-    # Convert to response format
-    formatted_questions = []
-    for q in questions:
-        question_data = {
-            "id": q["id"],
-            "question_type": q["question_type"],
-            "question_text": q["question_text"],
-            "is_follow_up": q["is_follow_up"]
-        }
-        
-        if q["options"]:
-            question_data["options"] = json.loads(q["options"])
-        if q["scale_min"] and q["scale_max"]:
-            question_data["scale_min"] = q["scale_min"]
-            question_data["scale_max"] = q["scale_max"]
-            
-        formatted_questions.append(question_data)
+    if q["options"]:
+        question_data["options"] = json.loads(q["options"])
+    if q["scale_min"] and q["scale_max"]:
+        question_data["scale_min"] = q["scale_min"]
+        question_data["scale_max"] = q["scale_max"]
     
-    return {"questions": formatted_questions}
+    return question_data
 
-@app.post("/submit_response")
-async def submit_response(response_data: ResponseSubmit):
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO responses (user_id, question_id, response_value, response_text, session_id)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
+# Users are never deleted, so each one seen is remembered rather than looked up per answer
+known_users = LRUCache("known_users", max_entries=int(os.getenv("KNOWN_USERS_CACHE_SIZE", "100000")))
+
+def validate_response(response_data: ResponseSubmit):
+    """Reject an answer that could never be saved, before it is acknowledged"""
+    if not any(q['id'] == response_data.question_id for q in list_questions()):
+        raise ValueError(f"Unknown question {response_data.question_id}")
+    found, _ = known_users.get(response_data.user_id)
+    if not found:
+        if not storage.user_exists(response_data.user_id):
+            raise ValueError(f"Unknown user {response_data.user_id}")
+        known_users.set(response_data.user_id, True)
+
+def save_response(response_data: ResponseSubmit):
+    """Store a response, through the write-behind journal when it is enabled, and
+    update the session's running risk state with it. Raises ValueError for an
+    answer to an unknown question or from an unknown user."""
+    validate_response(response_data)
+    if response_writer:
+        response_writer.submit(
             response_data.user_id,
             response_data.question_id,
             response_data.response_value,
             response_data.response_text,
-            response_data.session_id
-        ))
-        conn.commit()
-        return {"message": "Response submitted successfully"}
-    finally:
-        conn.close()
+            response_data.session_id,
+            response_data.idempotency_key
+        ).result()
+    elif not storage.insert_response(
+        response_data.user_id,
+        response_data.question_id,
+        response_data.response_value,
+        response_data.response_text,
+        response_data.session_id,
+        response_data.idempotency_key
+    ):
+        # A retry of a submission that was already applied
+        return
+    
+    risk_evaluator.evaluate(
+        response_data.user_id,
+        response_data.session_id,
+        response_data.question_id,
+        response_data.response_value,
+        response_data.response_text
+    )
+
+@app.post("/submit_response")
+def submit_response(response_data: ResponseSubmit):
+    try:
+        save_response(response_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"message": "Response submitted successfully"}
 
 @app.get("/analyze_session/{user_id}/{session_id}")
-async def analyze_session(user_id: int, session_id: str):
+async def analyze_session(user_id: int, session_id: str, location: Optional[str] = None,
+                          radius_miles: float = DEFAULT_RADIUS_MILES):
     """Analyze all responses for a session and provide recommendations"""
-    conn = get_db_connection()
+    # Get all responses with question details
+    responses = await run_in_threadpool(session_responses, user_id, session_id)
+    
+    if not responses:
+        raise HTTPException(status_code=404, detail="No responses found for this session")
+    
+    # Perform analysis, find matching clinicians and save the results,
+    # once for any number of concurrent requests for this session
+    analysis, clinicians = await analyze_session_single_flight(user_id, session_id, responses,
+                                                               location, radius_miles)
+    
+    return {
+        "analysis": analysis,
+        "clinicians": clinicians,
+        "session_id": session_id,
+        "total_responses": len(responses)
+    }
+
+# WebSocket assessment channel: one connection per session carries every answer,
+# and each answer is acknowledged with the updated question list in one frame
+class AnswerFrame(BaseModel):
+    question_id: int
+    response_value: str
+    response_text: Optional[str] = None
+    idempotency_key: Optional[str] = None
+
+class AnalyzeFrame(BaseModel):
+    location: Optional[str] = None
+    radius_miles: float = DEFAULT_RADIUS_MILES
+
+def questions_frame(visible: List[dict], answers: Dict[int, str], answered: Optional[int] = None,
+                    previously_visible: Optional[set] = None) -> dict:
+    """The question list with the next question to ask and any follow-ups the last answer triggered"""
+    ids = [q['id'] for q in visible]
+    if answered in ids:
+        # The question right after the one just answered, which is where its follow-ups go
+        position = ids.index(answered) + 1
+    else:
+        position = next((i for i, qid in enumerate(ids) if qid not in answers), len(ids))
+    return {
+        "type": "questions",
+        "questions": [format_question(q) for q in visible],
+        "answered": [qid for qid in ids if qid in answers],
+        "next_question": format_question(visible[position]) if position < len(visible) else None,
+        "follow_ups": [format_question(q) for q in visible
+                       if previously_visible is not None and q['id'] not in previously_visible],
+    }
+
+async def analyze_over_channel(user_id: int, session_id: str, frame: AnalyzeFrame) -> dict:
+    """Run an analysis requested over the channel, holding an analysis admission slot like the HTTP route"""
+    pool = admission.pools["analysis"]
     try:
-        cursor = conn.cursor()
-        
-        # Get all responses with question details
-        cursor.execute("""
-            SELECT r.*, q.question_type, q.question_text
-            FROM responses r
-            JOIN questions q ON r.question_id = q.id
-            WHERE r.user_id = ? AND r.session_id = ?
-        """, (user_id, session_id))
-        
-        responses = [dict(row) for row in cursor.fetchall()]
-        
+        await pool.acquire()
+    except Overloaded as e:
+        return {"type": "busy", "retry_after": e.retry_after}
+    started = time.monotonic()
+    try:
+        responses = await run_in_threadpool(session_responses, user_id, session_id)
         if not responses:
-            raise HTTPException(status_code=404, detail="No responses found for this session")
-        
-        # Perform analysis
-        analysis = analyze_responses_with_openai(responses)
-        
-        # Find matching clinicians
-        conditions = analysis.get('conditions', [])
-        clinicians = find_matching_clinicians(conditions)
-        
-        # Save analysis results
-        cursor.execute("""
-            INSERT INTO analysis_results (user_id, session_id, conditions, clinicians, 
-                                        overall_score, risk_level)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            user_id,
-            session_id,
-            json.dumps(analysis),
-            json.dumps(clinicians),
-            analysis.get('overall_score', 50),
-            analysis.get('risk_level', 'Moderate')
-        ))
-        conn.commit()
-        
+            return {"type": "error", "detail": "No responses found for this session"}
+        analysis, clinicians = await analyze_session_single_flight(user_id, session_id, responses,
+                                                                   frame.location, frame.radius_miles)
         return {
+            "type": "analysis",
             "analysis": analysis,
             "clinicians": clinicians,
             "session_id": session_id,
             "total_responses": len(responses)
         }
-        
     finally:
-        conn.close()
+        admission.release(pool, time.monotonic() - started)
+
+@app.websocket("/ws/assessment/{user_id}/{session_id}")
+async def assessment_channel(websocket: WebSocket, user_id: int, session_id: str):
+    """The question flow over one connection.
+    
+    The server sends the current question list on connect. The client sends
+    {"type": "answer", "question_id", "response_value", "response_text"} and gets
+    back one "questions" frame with the next question and newly triggered
+    follow-ups; {"type": "analyze", "location", "radius_miles"} is answered with
+    an "analysis" frame. Bad frames get an "error" frame and the connection stays open.
+    """
+    await websocket.accept()
+    await run_in_threadpool(read_own_writes, user_id, session_id)
+    # The question graph and this session's answers are loaded once per connection
+    questions = await run_in_threadpool(list_questions)
+    answers = await run_in_threadpool(storage.get_session_answers, user_id, session_id)
+    visible = visible_questions(questions, answers)
+    await websocket.send_json(questions_frame(visible, answers))
+    
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                if not isinstance(message, dict):
+                    raise ValueError("Expected a JSON object")
+                kind = message.pop("type", None)
+                if kind == "answer":
+                    answer = AnswerFrame(**message)
+                    # Raises ValueError for an unknown question or user
+                    await run_in_threadpool(save_response, ResponseSubmit(user_id=user_id, session_id=session_id,
+                                                                          **answer.model_dump()))
+                    answers[answer.question_id] = answer.response_value
+                    previously_visible = {q['id'] for q in visible}
+                    visible = visible_questions(questions, answers)
+                    reply = questions_frame(visible, answers, answer.question_id, previously_visible)
+                elif kind == "analyze":
+                    reply = await analyze_over_channel(user_id, session_id, AnalyzeFrame(**message))
+                else:
+                    raise ValueError('Expected a frame of type "answer" or "analyze"')
+            except (ValueError, TypeError) as e:
+                # Covers malformed JSON and pydantic validation errors
+                reply = {"type": "error", "detail": str(e)}
+            await websocket.send_json(reply)
+    except WebSocketDisconnect:
+        pass
+
+def stored_analysis(row: dict) -> dict:
+    """An analysis_results row in the shape /analyze_session returns"""
+    result = {
+        "analysis": json.loads(row['conditions']),
+        "session_id": row['session_id'],
+        "analysis_id": row['id'],
+        "analysis_version": row['analysis_version'],
+        "created_at": str(row['created_at']),
+    }
+    if 'clinicians' in row:
+        result["clinicians"] = json.loads(row['clinicians'])
+    return result
+
+def encode_cursor(*key) -> str:
+    """Opaque pagination cursor for a keyset position"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor: str, size: int) -> tuple:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        key = None
+    if not isinstance(key, list) or len(key) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(key)
+
+@app.get("/analysis/{user_id}/{session_id}/latest")
+def latest_analysis(user_id: int, session_id: str):
+    """The most recent stored analysis of a session, without re-running it"""
+    row = storage.get_latest_analysis(user_id, session_id)
+    if not row:
+        raise HTTPException(status_code=404, detail="No analysis found for this session")
+    return stored_analysis(row)
+
+@app.get("/analysis_history/{user_id}")
+def analysis_history(user_id: int, cursor: Optional[str] = None, limit: int = 20):
+    """A user's stored analyses, newest first; pass next_cursor back to get the next page"""
+    limit = max(1, min(limit, 100))
+    before = decode_cursor(cursor, 2) if cursor else None
+    rows = storage.get_analysis_history(user_id, before=before, limit=limit)
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor(str(rows[-1]['created_at']), rows[-1]['id'])
+    return {"analyses": [stored_analysis(row) for row in rows], "next_cursor": next_cursor}
 
 @app.get("/get_session_responses/{user_id}/{session_id}")
-async def get_session_responses(user_id: int, session_id: str):
-    """Get all responses for a specific session"""
-    conn = get_db_connection()
+def get_session_responses(user_id: int, session_id: str, fields: Optional[str] = None):
+    """Get all responses for a specific session, optionally only some fields of each"""
+    selected = parse_fields(fields, list(storage.RESPONSE_FIELDS))
+    read_own_writes(user_id, session_id)
+    responses = storage.get_session_responses(user_id, session_id, fields=selected)
+    return {"responses": responses}
+
+def response_history_body(rows, limit: int):
+    """Encode history rows into one JSON object as they stream in, ending with the next cursor"""
+    count = 0
+    last = None
+    more = False
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT r.*, q.question_text, q.question_type
-            FROM responses r
-            JOIN questions q ON r.question_id = q.id
-            WHERE r.user_id = ? AND r.session_id = ?
-            ORDER BY r.created_at
-        """, (user_id, session_id))
-        
-        responses = [dict(row) for row in cursor.fetchall()]
-        return {"responses": responses}
+        yield '{"responses": ['
+        for row in rows:
+            if count == limit:
+                # The extra row only tells us there is another page
+                more = True
+                break
+            yield ("," if count else "") + json.dumps(row, default=str)
+            count += 1
+            last = row
     finally:
-        conn.close()
+        rows.close()
+    next_cursor = encode_cursor(str(last['created_at']), last['id']) if more else None
+    yield f'], "next_cursor": {json.dumps(next_cursor)}}}'
+
+@app.get("/response_history/{user_id}")
+def response_history(user_id: int, cursor: Optional[str] = None, limit: int = 500,
+                     question_type: Optional[str] = None, start_date: Optional[str] = None,
+                     end_date: Optional[str] = None, fields: Optional[str] = None):
+    """A user's responses across all sessions, oldest first, streamed a page at a time;
+    pass next_cursor back to get the next page"""
+    limit = max(1, min(limit, 5000))
+    selected = parse_fields(fields, list(storage.RESPONSE_FIELDS))
+    rows = storage.iter_response_history(
+        user_id,
+        after=decode_cursor(cursor, 2) if cursor else None,
+        question_type=question_type,
+        start_date=parse_date(start_date, "start_date"),
+        end_date=parse_date(end_date, "end_date"),
+        limit=limit + 1,
+        fields=selected
+    )
+    return StreamingResponse(response_history_body(rows, limit), media_type="application/json")
 
 @app.get("/get_clinicians")
-async def get_all_clinicians():
-    """Get all clinicians in the database"""
-    conn = get_db_connection()
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM clinicians ORDER BY rating DESC")
-        clinicians = [dict(row) for row in cursor.fetchall()]
-        
-        # Parse specializes_in JSON for each clinician
-        for clinician in clinicians:
+def get_all_clinicians(location: Optional[str] = None, radius_miles: float = DEFAULT_RADIUS_MILES,
+                       limit: Optional[int] = Query(None, ge=1, le=100), fields: Optional[str] = None):
+    """Get all clinicians in the database, or the nearest ones to a "City, ST" location,
+    optionally only some fields of each (distance_miles comes with any location search)"""
+    selected = parse_fields(fields, storage.CLINICIAN_FIELDS + ("distance_miles",))
+    columns = None
+    if selected:
+        columns = [f for f in selected if f != "distance_miles"] or ["id"]
+    if location:
+        coords = geo.geocode(location)
+        if not coords:
+            raise HTTPException(status_code=400, detail='Unknown location, expected "City, ST"')
+        clinicians = storage.find_clinicians_near(coords[0], coords[1], radius_miles * geo.KM_PER_MILE,
+                                                  limit=limit, fields=columns)
+        clinicians = [with_distance_miles(c) for c in clinicians]
+    else:
+        clinicians = storage.list_clinicians(fields=columns)[:limit]
+    
+    # Parse specializes_in JSON for each clinician
+    for clinician in clinicians:
+        if 'specializes_in' in clinician:
             clinician['specializes_in'] = json.loads(clinician['specializes_in'])
-        
-        return {"clinicians": clinicians}
-    finally:
-        conn.close()
+    
+    return {"clinicians": clinicians}
+
+@app.get("/search/clinicians")
+def search_clinicians(q: str, limit: int = Query(20, ge=1, le=100)):
+    """Ranked full-text search over clinician name, specialty and location, with highlights"""
+    clinicians = storage.search_clinicians(q, limit=limit)
+    
+    for clinician in clinicians:
+        clinician['specializes_in'] = json.loads(clinician['specializes_in'])
+    
+    return {"clinicians": clinicians}
+
+@app.get("/search/responses/{user_id}")
+def search_responses(user_id: int, q: str, session_id: Optional[str] = None,
+                     limit: int = Query(20, ge=1, le=100)):
+    """Ranked full-text search over a user's free-text answers, with highlighted snippets"""
+    results = storage.search_responses(user_id, q, session_id=session_id, limit=limit)
+    return {"responses": results}
+
+@app.get("/export/{dataset}", dependencies=[Depends(require_admin)])
+def export_data(dataset: str, format: str = "ndjson", start_date: Optional[str] = None,
+                end_date: Optional[str] = None, user_id: Optional[int] = None):
+    """Stream responses (joined with questions) or analysis results as NDJSON, CSV or Parquet"""
+    if dataset not in export.DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset, expected one of {', '.join(export.DATASETS)}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format, expected one of {', '.join(export.FORMATS)}")
+    
+    stream = export.export_stream(
+        storage, dataset, format,
+        start_date=parse_date(start_date, "start_date"),
+        end_date=parse_date(end_date, "end_date"),
+        user_id=user_id
+    )
+    return StreamingResponse(
+        stream,
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{format}"'}
+    )
+
+@app.post("/admin/clinicians/import", dependencies=[Depends(require_admin)])
+def import_clinicians(file: UploadFile = File(...), format: Optional[str] = None):
+    """Upsert a CSV or JSON clinician feed by license number and report rejected rows"""
+    fmt = format or ingest.detect_format(file.filename)
+    if fmt not in ("csv", "json"):
+        raise HTTPException(status_code=400, detail="format must be csv or json")
+    
+    # The upload is spooled to disk, so the feed is parsed as a stream
+    report = ingest.ingest_clinicians(storage, ingest.open_text(file.file), fmt)
+    clinician_version(refresh=True)
+    clinician_matcher.invalidate()
+    return report
+
+@app.get("/admin/llm_usage", dependencies=[Depends(require_admin)])
+def llm_usage_report(start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """OpenAI calls, tokens, cost and latency percentiles per UTC day and model"""
+    report = llm_usage.daily_report(storage, parse_date(start_date, "start_date"), parse_date(end_date, "end_date"))
+    return {"days": report}
+
+@app.get("/admin/risk_alerts", dependencies=[Depends(require_admin)])
+def risk_alerts(after_id: int = 0, include_delivered: bool = False, limit: int = Query(100, ge=1, le=1000)):
+    """Alerts raised by the streaming risk rules, oldest first; pass the last id
+    seen as after_id to page, and acknowledge handled alerts to drop them"""
+    rows = storage.list_risk_alerts(after_id, undelivered_only=not include_delivered, limit=limit)
+    alerts = [{**row, "signals": json.loads(row['signals']),
+               "created_at": str(row['created_at']),
+               "delivered_at": str(row['delivered_at']) if row['delivered_at'] else None} for row in rows]
+    return {"alerts": alerts, "next_after_id": alerts[-1]["id"] if len(alerts) == limit else None}
+
+class AlertAcknowledgement(BaseModel):
+    alert_ids: List[int]
+
+@app.post("/admin/risk_alerts/ack", dependencies=[Depends(require_admin)])
+def acknowledge_risk_alerts(ack: AlertAcknowledgement):
+    """Mark alerts as delivered so they leave the outbox"""
+    return {"delivered": storage.mark_risk_alerts_delivered(ack.alert_ids)}
+
+@app.get("/metrics")
+async def metrics():
+    """Operational metrics for this worker"""
+    return {
+        "openai": openai_breaker.snapshot(),
+        "analysis_tiers": tier_metrics.snapshot(),
+        "llm": llm_router.snapshot(),
+        "risk": risk_evaluator.snapshot(),
+        "clinician_matcher": clinician_matcher.snapshot(),
+        "recommendation_cache": recommendation_cache.snapshot(),
+        "question_cache": question_cache.snapshot(),
+        "cache_backend": cache_backend.snapshot(),
+        "admission": admission.snapshot(),
+        "write_behind": response_writer.snapshot() if response_writer else None,
+        "storage": storage.pool_stats(),
+    }
+
 @app.get("/get_disease_code")
 async def get_disease_code():
     """Return a list of ICD-10 mental health condition codes and their descriptions"""
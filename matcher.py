@@ -0,0 +1,177 @@
+"""Local TF-IDF matching of session free text to clinician specialties.
+
+Each clinician gets a profile document from their specialty and the
+conditions they treat (expanded into everyday words through CODE_TERMS).
+Profiles are vectorized once into an L2-normalized TF-IDF matrix; a
+session's free-text answers are vectorized with the same vocabulary and
+scored against every clinician with a single matrix-vector product. Nothing
+leaves the process.
+
+The matrix is sparse (CSR): a profile uses a few dozen of the vocabulary's
+terms, so it holds about 8 bytes per distinct term in each profile (a float32
+weight and an int32 column) plus 4 bytes per clinician, rather than
+clinicians x vocabulary floats. 100k clinicians with 30 terms each take about
+25 MB; a query adds one float per vocabulary term and one per clinician.
+"""
+import re
+import json
+import time
+import threading
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+# Everyday words for each ICD-10 category, so profiles share vocabulary
+# with the way people describe their own difficulties
+CODE_TERMS = {
+    "F31": "bipolar mood swings mania manic highs lows",
+    "F32": "depression depressed low mood sad sadness hopeless empty tired motivation crying worthless",
+    "F33": "recurrent depression depressed low mood hopeless relapse",
+    "F34": "persistent low mood dysthymia chronic sadness",
+    "F40": "phobia fear afraid avoid avoidance social anxiety panic crowds",
+    "F41": "anxiety anxious worry worried nervous panic restless tense overthinking racing thoughts",
+    "F42": "obsessive compulsive ocd intrusive thoughts rituals checking counting",
+    "F43": "stress stressed trauma traumatic ptsd grief loss adjustment overwhelmed burnout work job",
+    "F44": "dissociation dissociative numb detached memory trauma",
+    "F50": "eating food body image weight binge purge diet appetite",
+}
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "been", "but", "by", "can", "do", "for", "from", "had",
+    "has", "have", "i", "in", "is", "it", "its", "just", "me", "my", "of", "on", "or", "so", "that",
+    "the", "this", "to", "was", "we", "were", "with", "you", "your", "am", "about", "today", "really",
+}
+
+_SUFFIXES = ("ing", "ness", "ed", "es", "ly", "s")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with stop words removed and common suffixes stripped"""
+    tokens = []
+    for word in re.findall(r"[a-z]+", (text or "").lower()):
+        if word in STOP_WORDS or len(word) < 3:
+            continue
+        for suffix in _SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+                word = word[:-len(suffix)]
+                break
+        tokens.append(word)
+    return tokens
+
+
+def clinician_profile(clinician: dict) -> str:
+    codes = clinician.get("specializes_in") or "[]"
+    if isinstance(codes, str):
+        codes = json.loads(codes)
+    terms = [CODE_TERMS.get(code.split(".")[0], "") for code in codes]
+    return " ".join([clinician.get("specialty") or "", *terms])
+
+
+class ClinicianMatcher:
+    """Precomputed clinician TF-IDF matrix, rebuilt when the clinician data version changes"""
+
+    def __init__(self, load_clinicians, version):
+        self.load_clinicians = load_clinicians
+        self.version = version
+        self._lock = threading.Lock()
+        self._built_version = None
+        self._stale = True
+        # (clinician ids, normalized TF-IDF matrix, vocabulary, idf), swapped as a whole on rebuild
+        self._index = (np.zeros(0, dtype=np.int64), sparse.csr_matrix((0, 0), dtype=np.float32), {},
+                       np.zeros(0, dtype=np.float32))
+        self._build_ms = 0.0
+        self._queries = 0
+        self._query_ms_total = 0.0
+        self._query_ms_last = 0.0
+
+    def invalidate(self):
+        """Rebuild the matrix on the next query, e.g. after a clinician import"""
+        self._stale = True
+
+    def _build(self):
+        started = time.perf_counter()
+        clinicians = self.load_clinicians()
+        documents = [tokenize(clinician_profile(c)) for c in clinicians]
+
+        vocabulary = {}
+        for tokens in documents:
+            for token in tokens:
+                vocabulary.setdefault(token, len(vocabulary))
+
+        data, columns, indptr = [], [], [0]
+        for tokens in documents:
+            for token, count in Counter(tokens).items():
+                columns.append(vocabulary[token])
+                data.append(count)
+            indptr.append(len(columns))
+        matrix = sparse.csr_matrix((np.array(data, dtype=np.float32), np.array(columns, dtype=np.int32),
+                                    np.array(indptr, dtype=np.int32)),
+                                   shape=(len(documents), len(vocabulary)))
+
+        # Smoothed IDF and sublinear term frequency, rows normalized so dot products are cosines.
+        # Only the stored (nonzero) entries are touched, so the matrix never becomes dense.
+        document_frequency = np.bincount(matrix.indices, minlength=len(vocabulary))
+        idf = (np.log((1 + len(documents)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix.data = np.log1p(matrix.data) * idf[matrix.indices]
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        matrix.data /= np.repeat(np.where(norms == 0, 1, norms), np.diff(matrix.indptr)).astype(np.float32)
+
+        self._index = (np.array([c["id"] for c in clinicians], dtype=np.int64), matrix, vocabulary, idf)
+        self._stale = False
+        self._build_ms = (time.perf_counter() - started) * 1000
+
+    def _ensure_built(self):
+        version = self.version()
+        with self._lock:
+            if self._stale or version != self._built_version:
+                self._build()
+                self._built_version = version
+
+    @staticmethod
+    def _vectorize(text: str, vocabulary: Dict[str, int], idf: np.ndarray) -> Optional[np.ndarray]:
+        vector = np.zeros(len(vocabulary), dtype=np.float32)
+        for token in tokenize(text):
+            index = vocabulary.get(token)
+            if index is not None:
+                vector[index] += 1
+        vector = np.log1p(vector) * idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def similarities(self, text: str) -> Dict[int, float]:
+        """Cosine similarity of the text to every clinician, by clinician id (empty if nothing matches)"""
+        self._ensure_built()
+        started = time.perf_counter()
+        ids, matrix, vocabulary, idf = self._index
+        vector = self._vectorize(text, vocabulary, idf) if text else None
+        if vector is None or not len(ids):
+            scores = {}
+        else:
+            sims = matrix @ vector
+            nonzero = np.flatnonzero(sims > 0)
+            scores = dict(zip(ids[nonzero].tolist(), sims[nonzero].tolist()))
+        self._record_query(started)
+        return scores
+
+    def _record_query(self, started: float):
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._queries += 1
+            self._query_ms_total += elapsed
+            self._query_ms_last = elapsed
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "version": self._built_version,
+                "clinicians": len(self._index[0]),
+                "vocabulary": len(self._index[2]),
+                "matrix_bytes": int(self._index[1].data.nbytes + self._index[1].indices.nbytes
+                                    + self._index[1].indptr.nbytes),
+                "build_ms": round(self._build_ms, 2),
+                "queries": self._queries,
+                "last_query_ms": round(self._query_ms_last, 3),
+                "mean_query_ms": round(self._query_ms_total / self._queries, 3) if self._queries else None,
+            }
@@ -0,0 +1,141 @@
+"""Batch re-analysis of sessions with no current analysis.
+
+Finds idle sessions that were never analyzed, or whose latest analysis was
+produced by an older prompt or rule version (or fell back because OpenAI
+was unavailable) or predates a changed answer, and analyzes them in batches:
+
+- every session in a batch is scored by the local rules first, and only
+  the ones the rules cannot settle go to OpenAI, a bounded number at a time;
+- each batch's results are saved in one transaction together with a
+  checkpoint, so an interrupted run resumes where it stopped;
+- sessions that still fall back are left for the next run.
+
+Meant to run nightly, e.g. from cron:
+
+    python reanalyze.py
+    python reanalyze.py --concurrency 8 --batch-size 500
+    python reanalyze.py --restart
+"""
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import rules
+from storage import Storage
+
+CHECKPOINT_NAME = "reanalyze"
+BATCH_SIZE = 200
+CONCURRENCY = 4
+# Sessions with a response in the last IDLE_MINUTES may still be in progress
+IDLE_MINUTES = 30
+
+
+def run(storage: Storage, analyze_llm, match_clinicians, version: str, batch_size: int = BATCH_SIZE,
+        concurrency: int = CONCURRENCY, idle_minutes: int = IDLE_MINUTES, limit: int = None,
+        restart: bool = False) -> dict:
+    """Analyze every session lacking a current analysis, returning a throughput report.
+
+    analyze_llm(responses) returns an LLM analysis (tier "llm", or "fallback"
+    when OpenAI is unavailable); match_clinicians(conditions, session_text)
+    returns the clinicians to save with it.
+    """
+    started = time.monotonic()
+    idle_before = (datetime.utcnow() - timedelta(minutes=idle_minutes)).strftime("%Y-%m-%d %H:%M:%S")
+
+    checkpoint = None if restart else storage.get_checkpoint(CHECKPOINT_NAME)
+    if checkpoint and checkpoint.get("version") != version:
+        checkpoint = None
+    after = tuple(checkpoint["after"]) if checkpoint else None
+
+    counts = {"processed": 0, "rules": 0, "llm": 0, "deferred": 0}
+
+    def analyze(responses):
+        analysis = analyze_llm(responses)
+        return analysis, match_clinicians(analysis.get("conditions", []), session_text(responses))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while limit is None or counts["processed"] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - counts["processed"])
+            sessions = storage.find_sessions_to_analyze(version, idle_before, after=after, limit=size)
+            if not sessions:
+                break
+            keys = [(s["user_id"], s["session_id"]) for s in sessions]
+            responses = storage.get_responses_for_sessions(keys)
+
+            # Rules pass over the whole batch, then OpenAI for what is left
+            results = []
+            needs_llm = []
+            for key in keys:
+                decision = rules.evaluate(responses[key])
+                if decision["tier"] == rules.TIER_RULES:
+                    analysis = decision["analysis"]
+                    clinicians = match_clinicians(analysis["conditions"], session_text(responses[key]))
+                    results.append((*key, analysis, clinicians, version))
+                    counts["rules"] += 1
+                else:
+                    needs_llm.append(key)
+
+            for key, (analysis, clinicians) in zip(needs_llm, pool.map(lambda k: analyze(responses[k]), needs_llm)):
+                if analysis.get("tier") == rules.TIER_FALLBACK:
+                    counts["deferred"] += 1
+                    continue
+                results.append((*key, analysis, clinicians, version))
+                counts["llm"] += 1
+
+            after = keys[-1]
+            counts["processed"] += len(keys)
+            storage.insert_analyses(results, checkpoint=(CHECKPOINT_NAME, {"version": version, "after": after}))
+
+    finished = limit is None or counts["processed"] < limit
+    if finished:
+        # A full pass is complete; the next run starts from the beginning
+        storage.save_checkpoint(CHECKPOINT_NAME, None)
+
+    elapsed = time.monotonic() - started
+    return {
+        "version": version,
+        "resumed_after": list(checkpoint["after"]) if checkpoint else None,
+        "complete": finished,
+        **counts,
+        "llm_calls_saved": counts["rules"],
+        "sessions_per_second": round(counts["processed"] / elapsed, 1) if elapsed else None,
+        "elapsed_seconds": round(elapsed, 3),
+    }
+
+
+def session_text(responses) -> str:
+    return "\n".join(r["response_text"] for r in responses if r.get("response_text"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze sessions with no current analysis")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="Concurrent OpenAI calls")
+    parser.add_argument("--idle-minutes", type=int, default=IDLE_MINUTES,
+                        help="Skip sessions with responses newer than this")
+    parser.add_argument("--limit", type=int, help="Stop after this many sessions (resumable)")
+    parser.add_argument("--restart", action="store_true", help="Ignore any saved checkpoint")
+    args = parser.parse_args()
+
+    # The analysis and matching functions live with the API
+    import main as api
+    api.init_db()
+
+    report = run(
+        api.storage,
+        api.analyze_responses_with_openai,
+        lambda conditions, text: api.find_matching_clinicians(conditions, session_text=text),
+        api.ANALYSIS_VERSION,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        idle_minutes=args.idle_minutes,
+        limit=args.limit,
+        restart=args.restart,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Retention for the SQLite backend.
+
+Closed sessions (no responses or analyses for ARCHIVE_AFTER_DAYS) are moved
+from the live database into monthly archive files, and freed pages are handed
+back with incremental vacuum. get_session_responses still finds archived
+sessions through the storage fallback lookup.
+
+Runs on a background thread inside the API, or by hand:
+
+    python retention.py archive [--days N]
+    python retention.py vacuum [--pages N]
+"""
+import os
+import argparse
+import threading
+
+from storage import SQLiteStorage, create_storage
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+VACUUM_PAGES = int(os.getenv("VACUUM_PAGES", "1000"))
+
+
+def archive_closed_sessions(storage: SQLiteStorage, max_age_days: int = ARCHIVE_AFTER_DAYS,
+                            batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Archive closed sessions in batches so the write lock is only held briefly"""
+    total = 0
+    while True:
+        sessions = storage.find_closed_sessions(max_age_days, limit=batch_size)
+        if not sessions:
+            return total
+        total += storage.archive_sessions(sessions)
+
+
+def run_retention(storage: SQLiteStorage):
+    """One retention pass: archive closed sessions, then reclaim free pages"""
+    archived = archive_closed_sessions(storage)
+    storage.incremental_vacuum(VACUUM_PAGES)
+    return archived
+
+
+class RetentionScheduler:
+    """Background thread that runs a retention pass every interval seconds"""
+
+    def __init__(self, storage: SQLiteStorage, interval: int = RETENTION_INTERVAL_SECONDS):
+        self.storage = storage
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                archived = run_retention(self.storage)
+                if archived:
+                    print(f"Retention: archived {archived} sessions")
+            except Exception as e:
+                # Another worker may be running the same pass; try again next interval
+                print(f"Retention error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive closed sessions and vacuum the live database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = subparsers.add_parser("archive", help="Move closed sessions into monthly archive files")
+    archive_parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS,
+                                help="Archive sessions with no activity for this many days")
+
+    vacuum_parser = subparsers.add_parser("vacuum", help="Run incremental vacuum on the live database")
+    vacuum_parser.add_argument("--pages", type=int, default=0, help="Pages to free (0 frees all)")
+
+    args = parser.parse_args()
+    storage = create_storage()
+    if not isinstance(storage, SQLiteStorage):
+        parser.error("Retention only applies to the SQLite backend")
+    storage.init_schema()
+
+    if args.command == "archive":
+        print(f"Archived {archive_closed_sessions(storage, args.days)} sessions")
+    elif args.command == "vacuum":
+        storage.incremental_vacuum(args.pages)
+        print("Incremental vacuum complete")
+
+
+if __name__ == "__main__":
+    main()
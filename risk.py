@@ -0,0 +1,102 @@
+"""Streaming high-risk detection for answers as they are submitted.
+
+Each answer is matched on its own against the SIGNALS table, using the
+same rule format as rules.py. The signals every answered question raises
+are kept per session in session_risk_signals, so an answer costs one
+indexed read of that session's signals. It costs a write only when it
+changes its question's signals, and it never rescans the session's
+responses. When the change completes one of the ALERT_RULES, an alert is
+written to the risk_alerts outbox in the same transaction. Each rule
+alerts once per session, and the outbox is served by
+/admin/risk_alerts.
+"""
+import threading
+from typing import Callable, Dict, List, Optional
+
+import rules
+
+# Signals a single answer can raise; same matching as rules.RULES
+SIGNALS = [
+    {"signal": "very_low_mood", "question_type": "mood_scale", "at_most": 3},
+    {"signal": "extreme_stress", "question_type": "stress_scale", "at_least": 9},
+    {"signal": "no_sleep", "question_type": "sleep_quality", "equals": ("Didn't sleep",)},
+    {"signal": "negative_thoughts", "question_type": "negative_thoughts", "equals": ("Yes",)},
+    {"signal": "isolated", "question_type": "support_system", "equals": ("I don't have a support system",)},
+    {"signal": "crisis_language", "question_type": "*", "text_contains": rules.CRISIS_TERMS},
+]
+
+# An alert fires once a session holds every signal in all_of
+ALERT_RULES = [
+    {"rule": "crisis_language", "severity": "critical", "all_of": ("crisis_language",)},
+    {"rule": "negative_thoughts_low_mood", "severity": "high", "all_of": ("negative_thoughts", "very_low_mood")},
+    {"rule": "negative_thoughts_isolated", "severity": "high", "all_of": ("negative_thoughts", "isolated")},
+    {"rule": "low_mood_extreme_stress", "severity": "high", "all_of": ("very_low_mood", "extreme_stress")},
+    {"rule": "low_mood_no_sleep", "severity": "elevated", "all_of": ("very_low_mood", "no_sleep")},
+]
+
+# Indexes so an answer only looks at the signals and rules it can affect
+_SIGNALS_BY_TYPE: Dict[str, List[dict]] = {}
+for _signal in SIGNALS:
+    _SIGNALS_BY_TYPE.setdefault(_signal["question_type"], []).append(_signal)
+_RULES_BY_SIGNAL: Dict[str, List[dict]] = {}
+for _rule in ALERT_RULES:
+    for _name in _rule["all_of"]:
+        _RULES_BY_SIGNAL.setdefault(_name, []).append(_rule)
+
+
+def answer_signals(question_type: Optional[str], response_value: str, response_text: Optional[str] = None) -> List[str]:
+    """The signals one answer raises, sorted"""
+    response = {"question_type": question_type, "response_value": response_value, "response_text": response_text}
+    candidates = _SIGNALS_BY_TYPE.get(question_type, []) + _SIGNALS_BY_TYPE.get("*", [])
+    return sorted({signal["signal"] for signal in candidates if rules.matches(signal, response)})
+
+
+def completed_alerts(session_signals: Dict[int, List[str]], new_signals: List[str]) -> List[dict]:
+    """Alert rules that involve one of new_signals and are met by the session's signals"""
+    active = {name for signals in session_signals.values() for name in signals}
+    alerts = {}
+    for name in new_signals:
+        for rule in _RULES_BY_SIGNAL.get(name, []):
+            if rule["rule"] not in alerts and active.issuperset(rule["all_of"]):
+                alerts[rule["rule"]] = {"rule": rule["rule"], "severity": rule["severity"], "signals": list(rule["all_of"])}
+    return list(alerts.values())
+
+
+class RiskEvaluator:
+    """Updates a session's running risk state with each answer"""
+
+    def __init__(self, storage, questions: Optional[Callable[[], List[dict]]] = None):
+        self.storage = storage
+        # Where question types come from: main passes its versioned question cache,
+        # so an edited or reseeded question is picked up without a restart
+        self.questions = questions or storage.list_questions
+        self._lock = threading.Lock()
+        self._stats = {"answers": 0, "state_writes": 0, "alerts": 0}
+
+    def _question_type(self, question_id: int) -> Optional[str]:
+        return next((q["question_type"] for q in self.questions() if q["id"] == question_id), None)
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def evaluate(self, user_id: int, session_id: str, question_id: int, response_value: str,
+                 response_text: Optional[str] = None) -> List[dict]:
+        """Record the answer's signals and return any alerts it raised"""
+        self._count("answers")
+        signals = answer_signals(self._question_type(question_id), response_value, response_text)
+        current = self.storage.get_risk_signals(user_id, session_id)
+        if current.get(question_id, []) == signals:
+            return []
+
+        self._count("state_writes")
+        alerts = self.storage.save_risk_signals(
+            user_id, session_id, question_id, signals,
+            lambda session_signals: completed_alerts(session_signals, signals),
+        )
+        self._count("alerts", len(alerts))
+        return alerts
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,329 @@
+"""Local rule engine for tiered session analysis.
+
+Sessions are scored against the declarative RULES table below. Each rule
+matches one kind of answer and contributes evidence towards conditions,
+protective weight against them, and an adjustment to the 0-100 wellbeing
+score. The result carries a confidence value: sessions that are clear-cut
+and not high risk are analyzed locally, while ambiguous or high-risk ones
+go on to the LLM.
+
+The same engine can be checked offline against the LLM analyses already
+stored in analysis_results:
+
+    python rules.py evaluate
+    python rules.py evaluate --min-confidence 0.8 --limit 500
+"""
+import os
+import re
+import json
+import time
+import argparse
+import threading
+from collections import defaultdict
+from typing import List, Optional
+
+from storage import create_storage
+
+TIER_RULES = "rules"
+TIER_LLM = "llm"
+TIER_FALLBACK = "fallback"
+
+# Bump when RULES or the scoring below change, so stored analyses are redone
+RULES_VERSION = 1
+
+MIN_CONFIDENCE = float(os.getenv("RULES_MIN_CONFIDENCE", "0.75"))
+
+CONDITIONS = {
+    "F32.1": "Major Depressive Episode, Moderate",
+    "F41.1": "Generalized Anxiety Disorder",
+    "F43": "Reaction to Severe Stress and Adjustment Disorders",
+}
+
+# Free-text phrases that always send a session to the LLM
+CRISIS_TERMS = (
+    "suicide", "suicidal", "kill myself", "end my life", "want to die", "self harm", "self-harm",
+    "hurt myself", "cutting myself", "no reason to live", "better off dead",
+)
+
+# A rule matches on question_type plus one of at_most / at_least / between
+# (numeric answers), equals (choice answers) or text_contains (free text),
+# and may add:
+#   evidence    points per condition code
+#   protective  points against any condition
+#   score       adjustment to the wellbeing score (starts at 100)
+#   high_risk   send the session to the LLM regardless of confidence
+RULES = [
+    {"question_type": "mood_scale", "at_most": 2, "evidence": {"F32.1": 3}, "score": -30, "high_risk": True},
+    {"question_type": "mood_scale", "between": (3, 4), "evidence": {"F32.1": 2}, "score": -15},
+    {"question_type": "mood_scale", "between": (5, 6), "evidence": {"F32.1": 1}, "score": -5},
+    {"question_type": "mood_scale", "at_least": 7, "protective": 2},
+    {"question_type": "stress_scale", "at_least": 9, "evidence": {"F41.1": 2, "F43": 2}, "score": -20},
+    {"question_type": "stress_scale", "between": (7, 8), "evidence": {"F41.1": 2, "F43": 1}, "score": -10},
+    {"question_type": "stress_scale", "between": (5, 6), "evidence": {"F41.1": 1}, "score": -5},
+    {"question_type": "stress_scale", "at_most": 4, "protective": 2},
+    {"question_type": "sleep_quality", "equals": ("Poorly",), "evidence": {"F32.1": 1, "F41.1": 1}, "score": -5},
+    {"question_type": "sleep_quality", "equals": ("Didn't sleep",), "evidence": {"F32.1": 2, "F41.1": 1}, "score": -10},
+    {"question_type": "sleep_quality", "equals": ("Very well", "Okay"), "protective": 1},
+    {"question_type": "energy_level", "equals": ("Low",), "evidence": {"F32.1": 1}, "score": -5},
+    {"question_type": "energy_level", "equals": ("Extremely low",), "evidence": {"F32.1": 2}, "score": -10},
+    {"question_type": "energy_level", "equals": ("High", "Moderate"), "protective": 1},
+    {"question_type": "negative_thoughts", "equals": ("Yes",), "evidence": {"F32.1": 1, "F41.1": 1}, "score": -20,
+     "high_risk": True},
+    {"question_type": "negative_thoughts", "equals": ("No",), "protective": 1},
+    {"question_type": "social_interaction", "equals": ("I avoided interactions",), "evidence": {"F32.1": 1}, "score": -5},
+    {"question_type": "social_interaction", "equals": ("Yes",), "protective": 1},
+    {"question_type": "daily_activity", "equals": ("No",), "evidence": {"F32.1": 1}, "score": -5},
+    {"question_type": "daily_activity", "equals": ("Yes",), "protective": 1},
+    {"question_type": "support_system", "equals": ("Disconnected", "I don't have a support system"),
+     "evidence": {"F32.1": 1}, "score": -5},
+    {"question_type": "support_system", "equals": ("Very connected", "Somewhat connected"), "protective": 1},
+    {"question_type": "*", "text_contains": CRISIS_TERMS, "score": -30, "high_risk": True},
+]
+
+# Answers the rules depend on; a session missing them is less certain
+CORE_QUESTION_TYPES = ("mood_scale", "stress_scale", "sleep_quality", "energy_level", "negative_thoughts")
+
+# Free text the rules cannot read lowers confidence, down to this factor
+LONG_TEXT_CHARS = 40
+MIN_TEXT_FACTOR = 0.6
+
+RECOMMENDATIONS = {
+    "F32.1": "Schedule small, enjoyable activities and notice how your mood responds",
+    "F41.1": "Try a daily relaxation practice such as slow breathing or a short walk",
+    "F43": "Identify your biggest current stressor and one step that would ease it",
+}
+
+
+def matches(rule: dict, response: dict) -> bool:
+    if rule["question_type"] not in ("*", response.get("question_type")):
+        return False
+    value = (response.get("response_value") or "").strip()
+
+    if "text_contains" in rule:
+        text = f"{value} {response.get('response_text') or ''}".lower()
+        return any(term in text for term in rule["text_contains"])
+    if "equals" in rule:
+        return value in rule["equals"]
+
+    try:
+        number = int(value)
+    except ValueError:
+        return False
+    if "at_most" in rule:
+        return number <= rule["at_most"]
+    if "at_least" in rule:
+        return number >= rule["at_least"]
+    low, high = rule["between"]
+    return low <= number <= high
+
+
+def _risk_level(score: int) -> str:
+    # Same bands as fallback_analysis
+    return "Low" if score > 70 else "Moderate" if score > 40 else "High"
+
+
+def evaluate(responses: List[dict], min_confidence: float = MIN_CONFIDENCE) -> dict:
+    """Score a session with the rules.
+
+    Returns a decision with the tier that should analyze it ("rules" or
+    "llm"), the confidence, any high-risk rule that fired, and the rule-based
+    analysis in the same shape as the LLM's.
+    """
+    evidence = defaultdict(int)
+    protective = 0
+    score = 100
+    high_risk = []
+    answered = set()
+    long_texts = 0
+
+    for response in responses:
+        answered.add(response.get("question_type"))
+        if len((response.get("response_text") or "").strip()) >= LONG_TEXT_CHARS:
+            long_texts += 1
+        for rule in RULES:
+            if not matches(rule, response):
+                continue
+            for code, points in rule.get("evidence", {}).items():
+                evidence[code] += points
+            protective += rule.get("protective", 0)
+            score += rule.get("score", 0)
+            if rule.get("high_risk"):
+                high_risk.append(response.get("question_type"))
+
+    score = max(10, min(100, score))
+    risk_level = _risk_level(score)
+
+    # Confidence: how much of the core picture we have, how one-sided the
+    # evidence is, and how much unread free text there is
+    concern = sum(evidence.values())
+    coverage = len(answered.intersection(CORE_QUESTION_TYPES)) / len(CORE_QUESTION_TYPES)
+    lean = abs(concern - protective) / (concern + protective) if concern + protective else 0.0
+    text_factor = max(MIN_TEXT_FACTOR, 0.9 ** long_texts)
+    confidence = round(coverage * (0.5 + 0.5 * lean) * text_factor, 3)
+
+    conditions = [
+        {
+            "code": code,
+            "name": CONDITIONS[code],
+            "probability": min(20 + points * 12, 85),
+            "reasoning": "Rule-based: answers consistent with this condition",
+        }
+        for code, points in sorted(evidence.items(), key=lambda item: -item[1])
+        if points >= 2
+    ]
+
+    recommendations = [RECOMMENDATIONS[c["code"]] for c in conditions]
+    recommendations.append("Consider speaking with a mental health professional" if conditions
+                           else "Keep up the routines that are working for you")
+
+    if high_risk or risk_level == "High" or confidence < min_confidence:
+        tier = TIER_LLM
+    else:
+        tier = TIER_RULES
+
+    return {
+        "tier": tier,
+        "confidence": confidence,
+        "high_risk": high_risk,
+        "analysis": {
+            "conditions": conditions,
+            "overall_assessment": (
+                "Responses show a consistent pattern of concern. Professional evaluation recommended."
+                if conditions else "Responses indicate generally good wellbeing today."
+            ),
+            "risk_level": risk_level,
+            "recommendations": recommendations,
+            "overall_score": score,
+            "tier": TIER_RULES,
+            "confidence": confidence,
+        },
+    }
+
+
+class TierMetrics:
+    """Per-tier counts and latency for the analyses run by this worker"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers = defaultdict(lambda: {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+
+    def record(self, tier: str, seconds: float):
+        with self._lock:
+            stats = self._tiers[tier]
+            stats["count"] += 1
+            stats["total_seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = sum(stats["count"] for stats in self._tiers.values())
+            return {
+                tier: {
+                    "count": stats["count"],
+                    "share": round(stats["count"] / total, 3),
+                    "mean_seconds": round(stats["total_seconds"] / stats["count"], 3),
+                    "max_seconds": round(stats["max_seconds"], 3),
+                }
+                for tier, stats in self._tiers.items()
+            }
+
+
+def _is_llm_analysis(analysis: dict) -> bool:
+    tier = analysis.get("tier")
+    if tier:
+        return tier == TIER_LLM
+    # Rows saved before tiering: anything but fallback_analysis came from the LLM
+    return not analysis.get("overall_assessment", "").startswith("Assessment based on response patterns")
+
+
+def _parse_score(value) -> Optional[float]:
+    """The LLM's overall_score as a number, e.g. from 85, "85" or "85%"; None for "high" or missing"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"-?\d+(?:\.\d+)?", str(value or ""))
+    return float(match.group()) if match else None
+
+
+def _condition_groups(analysis: dict) -> set:
+    return {c.get("code", "").split(".")[0] for c in analysis.get("conditions", [])}
+
+
+def evaluate_stored(storage, min_confidence: float = MIN_CONFIDENCE, limit: int = None) -> dict:
+    """Compare tier decisions with the LLM analyses stored in analysis_results.
+
+    For every stored LLM analysis, re-run the rules on the session's answers.
+    Sessions the rules would have kept are checked for agreement with the
+    LLM; missed_high_risk counts sessions kept locally that the LLM rated High.
+    mean_score_difference skips analyses whose overall_score is not a number.
+    """
+    evaluated = kept_local = risk_agree = condition_agree = missed_high_risk = scored = 0
+    score_diff = 0
+    confusion = defaultdict(int)
+
+    for row in storage.iter_export("analyses"):
+        if limit is not None and evaluated >= limit:
+            break
+        try:
+            llm = json.loads(row["conditions"])
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(llm, dict) or not _is_llm_analysis(llm):
+            continue
+        responses = storage.get_session_responses(row["user_id"], row["session_id"])
+        if not responses:
+            continue
+
+        evaluated += 1
+        decision = evaluate(responses, min_confidence)
+        if decision["tier"] != TIER_RULES:
+            continue
+
+        kept_local += 1
+        local = decision["analysis"]
+        confusion[f"{local['risk_level']}->{llm.get('risk_level')}"] += 1
+        risk_agree += local["risk_level"] == llm.get("risk_level")
+        condition_agree += _condition_groups(local) == _condition_groups(llm)
+        missed_high_risk += llm.get("risk_level") == "High"
+        llm_score = _parse_score(llm.get("overall_score"))
+        if llm_score is not None:
+            scored += 1
+            score_diff += abs(local["overall_score"] - llm_score)
+
+    def rate(count):
+        return round(count / kept_local, 3) if kept_local else None
+
+    return {
+        "min_confidence": min_confidence,
+        "evaluated": evaluated,
+        "kept_local": kept_local,
+        "local_share": round(kept_local / evaluated, 3) if evaluated else None,
+        "risk_level_agreement": rate(risk_agree),
+        "condition_agreement": rate(condition_agree),
+        "mean_score_difference": round(score_diff / scored, 1) if scored else None,
+        "missed_high_risk": missed_high_risk,
+        "risk_level_confusion": dict(confusion),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the local analysis rules")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="Compare rule decisions with stored LLM analyses")
+    evaluate_parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE)
+    evaluate_parser.add_argument("--limit", type=int, help="Stop after this many LLM analyses")
+
+    args = parser.parse_args()
+    storage = create_storage()
+    storage.init_schema()
+
+    started = time.monotonic()
+    report = evaluate_stored(storage, args.min_confidence, args.limit)
+    report["elapsed_seconds"] = round(time.monotonic() - started, 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
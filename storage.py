@@ -0,0 +1,2016 @@
+"""Storage backends for the mental health assessment API.
+
+All SQL for the users, sessions, questions, responses, analysis_results and
+clinicians tables lives here, behind the Storage repository. Two drivers are
+available: SQLite (the default, a single local file) and PostgreSQL (a pooled
+shared database, so several API nodes can run against the same data).
+
+The backend is chosen with the STORAGE_BACKEND environment variable
+("sqlite" or "postgres").
+"""
+import os
+import re
+import json
+import time
+import random
+import queue
+import sqlite3
+import threading
+import uuid
+import functools
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any
+
+import geo
+
+
+class IntegrityError(Exception):
+    """Raised when a write violates a unique or foreign key constraint"""
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled database connection frees up within the pool timeout"""
+
+
+class Storage(ABC):
+    """Repository over the assessment tables, shared by every driver.
+
+    Queries are written with "?" placeholders and portable SQL; drivers
+    translate placeholders and provide connections, transactions and DDL.
+    """
+
+    placeholder = "?"
+
+    def __init__(self, write_retries: int = 5, retry_delay: float = 0.05):
+        self.write_retries = write_retries
+        self.retry_delay = retry_delay
+
+    # Driver hooks
+    @contextmanager
+    @abstractmethod
+    def read(self):
+        """Yield a cursor for read-only queries"""
+        raise NotImplementedError
+
+    @contextmanager
+    def stream(self):
+        """Yield a cursor that fetches rows incrementally, for large scans"""
+        with self.read() as cursor:
+            yield cursor
+
+    @abstractmethod
+    def _run_transaction(self, operation):
+        """Run operation(cursor) inside a single committed transaction"""
+        raise NotImplementedError
+
+    def _is_retryable(self, error: Exception) -> bool:
+        """Check whether a failed transaction can safely be retried"""
+        return False
+
+    @abstractmethod
+    def _is_integrity_error(self, error: Exception) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def init_schema(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def pool_stats(self) -> dict:
+        """Connection pool statistics for the metrics endpoint"""
+        return {}
+
+    # Shared helpers
+    def sql(self, query: str) -> str:
+        """Translate a "?"-style query to the driver's placeholder style"""
+        if self.placeholder == "?":
+            return query
+        return query.replace("?", self.placeholder)
+
+    def execute(self, cursor, query: str, params=()):
+        cursor.execute(self.sql(query), params)
+        return cursor
+
+    def executemany(self, cursor, query: str, rows):
+        cursor.executemany(self.sql(query), rows)
+        return cursor
+
+    def write(self, operation):
+        """Run operation(cursor) in a write transaction, retrying with backoff on contention"""
+        for attempt in range(self.write_retries + 1):
+            try:
+                return self._run_transaction(operation)
+            except Exception as e:
+                if self._is_integrity_error(e):
+                    raise IntegrityError(str(e)) from e
+                if not self._is_retryable(e) or attempt == self.write_retries:
+                    raise
+
+            delay = self.retry_delay * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay))
+
+    # Seed data
+    def seed_questions(self, questions: List[dict]):
+        """Insert the structured questions if the table is empty"""
+        def insert(cursor):
+            self.execute(cursor, "SELECT COUNT(*) AS n FROM questions")
+            if cursor.fetchone()["n"] > 0:
+                return
+            for q in questions:
+                self.execute(cursor, '''
+                    INSERT INTO questions (question_type, question_text, options, scale_min, scale_max,
+                                         is_follow_up, parent_question_id, trigger_condition)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    q["question_type"],
+                    q["question_text"],
+                    q.get("options"),
+                    q.get("scale_min"),
+                    q.get("scale_max"),
+                    q.get("is_follow_up", False),
+                    q.get("parent_question_id"),
+                    q.get("trigger_condition")
+                ))
+            self._sync_question_options(cursor)
+            self._bump_version(cursor, self.QUESTIONS_VERSION)
+        self.write(insert)
+        self._answer_codes = None
+
+    def seed_clinicians(self, clinicians: List[dict]):
+        """Insert the clinician directory if the table is empty"""
+        def insert(cursor):
+            self.execute(cursor, "SELECT COUNT(*) AS n FROM clinicians")
+            if cursor.fetchone()["n"] > 0:
+                return
+            columns = self.CLINICIAN_COLUMNS + self.CLINICIAN_GEO_COLUMNS
+            self.executemany(cursor, f"""
+                INSERT INTO clinicians ({", ".join(columns)})
+                VALUES ({", ".join("?" for _ in columns)})
+            """, [self._clinician_row(c) for c in clinicians])
+            self._bump_version(cursor, self.CLINICIANS_VERSION)
+        self.write(insert)
+
+    # Users and sessions
+    def register_user(self, name: str, email: str, age: int, gender: str, session_id: str) -> int:
+        """Create a user and their first session, returning the new user id"""
+        def insert(cursor):
+            self.execute(cursor,
+                "INSERT INTO users (name, email, age, gender) VALUES (?, ?, ?, ?) RETURNING id",
+                (name, email, age, gender)
+            )
+            user_id = cursor.fetchone()["id"]
+            self.execute(cursor,
+                "INSERT INTO sessions (session_id, user_id) VALUES (?, ?)",
+                (self._session_key(session_id), user_id)
+            )
+            return user_id
+        return self.write(insert)
+
+    def user_exists(self, user_id: int) -> bool:
+        with self.read() as cursor:
+            self.execute(cursor, "SELECT 1 AS found FROM users WHERE id = ?", (user_id,))
+            return cursor.fetchone() is not None
+
+    # Questions
+    def list_questions(self) -> List[dict]:
+        """All questions, base and follow-up, ordered by id"""
+        with self.read() as cursor:
+            self.execute(cursor, "SELECT * FROM questions ORDER BY id")
+            return [dict(row) for row in cursor.fetchall()]
+
+    # Compact answers: a choice is stored as its index in questions.options and a
+    # scale answer as an integer, both in value_code with response_value left
+    # empty; anything else keeps its text. question_options is the index -> text
+    # lookup reads decode with, so option lists must only ever be appended to.
+    RESPONSE_VALUE = "COALESCE(o.option_value, CAST(r.value_code AS TEXT), r.response_value)"
+    RESPONSE_VALUE_JOIN = "LEFT JOIN question_options o ON o.question_id = r.question_id AND o.option_index = r.value_code"
+
+    _answer_codes = None
+
+    def _sync_question_options(self, cursor):
+        """Fill question_options from questions.options (first occurrence of each option wins)"""
+        self.execute(cursor, "SELECT id, options FROM questions WHERE options IS NOT NULL")
+        rows = []
+        for question in cursor.fetchall():
+            seen = set()
+            for index, option in enumerate(json.loads(question["options"])):
+                if option not in seen:
+                    seen.add(option)
+                    rows.append((question["id"], index, option))
+        if rows:
+            self.executemany(cursor, """
+                INSERT INTO question_options (question_id, option_index, option_value) VALUES (?, ?, ?)
+                ON CONFLICT (question_id, option_index) DO NOTHING
+            """, rows)
+
+    def _encode_answer(self, question_id: int, response_value: str) -> tuple:
+        """(value_code, response_value) to store for an answer"""
+        codes = self._answer_codes
+        if codes is None or question_id not in codes:
+            with self.read() as cursor:
+                self.execute(cursor, "SELECT id, options, scale_min FROM questions")
+                codes = {}
+                for q in cursor.fetchall():
+                    if q["options"]:
+                        options = json.loads(q["options"])
+                        codes[q["id"]] = {option: options.index(option) for option in options}
+                    else:
+                        codes[q["id"]] = "scale" if q["scale_min"] is not None else None
+            self._answer_codes = codes
+
+        kind = codes.get(question_id)
+        if isinstance(kind, dict) and response_value in kind:
+            return kind[response_value], ""
+        if kind == "scale" and re.fullmatch(r"0|-?[1-9][0-9]{0,8}", response_value or ""):
+            return int(response_value), ""
+        return None, response_value
+
+    # Canonical integer text, so a scale answer converts to value_code and back unchanged
+    CANONICAL_INTEGER = "CAST(CAST({column} AS INTEGER) AS TEXT) = {column}"
+
+    def _compact_responses(self, cursor):
+        """Migration to compact answers: re-encode stored choice and scale answers"""
+        cursor.execute("""
+            UPDATE responses SET value_code = (
+                SELECT o.option_index FROM question_options o
+                WHERE o.question_id = responses.question_id AND o.option_value = responses.response_value
+            )
+            WHERE value_code IS NULL AND question_id IN (SELECT question_id FROM question_options)
+        """)
+        cursor.execute(f"""
+            UPDATE responses SET value_code = CAST(response_value AS INTEGER)
+            WHERE value_code IS NULL
+              AND question_id IN (SELECT id FROM questions WHERE options IS NULL AND scale_min IS NOT NULL)
+              AND {self.CANONICAL_INTEGER.format(column="response_value")}
+        """)
+        cursor.execute("UPDATE responses SET response_value = '' WHERE value_code IS NOT NULL AND response_value <> ''")
+
+    def _session_key(self, session_id: Optional[str]):
+        """How a session id is stored; drivers may store UUIDs in a compact form"""
+        return session_id
+
+    # Responses
+    def get_session_answers(self, user_id: int, session_id: str) -> Dict[int, str]:
+        """Map of question_id -> response_value for a session"""
+        with self.read() as cursor:
+            self.execute(cursor, f"""
+                SELECT r.question_id, {self.RESPONSE_VALUE} AS response_value
+                FROM responses r
+                {self.RESPONSE_VALUE_JOIN}
+                WHERE r.user_id = ? AND r.session_id = ?
+            """, (user_id, self._session_key(session_id)))
+            return {row["question_id"]: row["response_value"] for row in cursor.fetchall()}
+
+    # One row per answer: answering a question again replaces the earlier answer, and
+    # only a changed answer touches the row. It keeps its created_at, which orders the
+    # session and history pages, and records the change in updated_at
+    UPSERT_RESPONSE = """
+        INSERT INTO responses (user_id, question_id, value_code, response_value, response_text, session_id, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, {created_at})
+        ON CONFLICT (user_id, session_id, question_id) DO UPDATE
+        SET value_code = excluded.value_code, response_value = excluded.response_value,
+            response_text = excluded.response_text, updated_at = excluded.created_at
+        WHERE COALESCE(responses.value_code, -1) <> COALESCE(excluded.value_code, -1)
+           OR responses.response_value <> excluded.response_value
+           OR COALESCE(responses.response_text, '') <> COALESCE(excluded.response_text, '')
+    """
+
+    # How long a client idempotency key is remembered
+    SUBMISSION_KEY_TTL_HOURS = 24
+
+    def _claim_submission_key(self, cursor, user_id: int, idempotency_key: Optional[str]) -> bool:
+        """Record a client idempotency key, returning False if it was already used"""
+        if not idempotency_key:
+            return True
+        expired = (datetime.utcnow() - timedelta(hours=self.SUBMISSION_KEY_TTL_HOURS)).strftime("%Y-%m-%d %H:%M:%S")
+        self.execute(cursor, "DELETE FROM submission_keys WHERE user_id = ? AND created_at < ?", (user_id, expired))
+        self.execute(cursor, """
+            INSERT INTO submission_keys (user_id, idempotency_key) VALUES (?, ?)
+            ON CONFLICT (user_id, idempotency_key) DO NOTHING
+        """, (user_id, idempotency_key))
+        return cursor.rowcount == 1
+
+    def insert_response(self, user_id: int, question_id: int, response_value: str,
+                        response_text: Optional[str], session_id: str,
+                        idempotency_key: Optional[str] = None) -> bool:
+        """Save an answer, replacing any earlier answer to the question. Returns False,
+        writing nothing, when idempotency_key was already used by this user."""
+        def insert(cursor):
+            if not self._claim_submission_key(cursor, user_id, idempotency_key):
+                return False
+            self.execute(cursor, self.UPSERT_RESPONSE.format(created_at="CURRENT_TIMESTAMP"),
+                         (user_id, question_id, *self._encode_answer(question_id, response_value), response_text,
+                          self._session_key(session_id)))
+            return True
+        return self.write(insert)
+
+    def insert_responses(self, responses: List[dict], checkpoint: Optional[tuple] = None):
+        """Save many answers (keeping their created_at) in one transaction, together
+        with an optional (name, state) checkpoint; rows whose idempotency_key was
+        already used are skipped"""
+        def insert(cursor):
+            rows = [
+                (r["user_id"], r["question_id"], *self._encode_answer(r["question_id"], r["response_value"]),
+                 r["response_text"], self._session_key(r["session_id"]), r["created_at"])
+                for r in responses
+                if self._claim_submission_key(cursor, r["user_id"], r.get("idempotency_key"))
+            ]
+            self.executemany(cursor, self.UPSERT_RESPONSE.format(created_at="?"), rows)
+            if checkpoint:
+                self._save_checkpoint(cursor, *checkpoint)
+        self.write(insert)
+
+    def dead_letter_responses(self, failures: List[tuple], checkpoint: Optional[tuple] = None):
+        """Set aside (record, error) pairs for queued answers that could not be saved,
+        together with an optional (name, state) checkpoint moving past them"""
+        def insert(cursor):
+            self.executemany(cursor, "INSERT INTO response_dead_letters (record, error) VALUES (?, ?)",
+                             [(json.dumps(record), error) for record, error in failures])
+            if checkpoint:
+                self._save_checkpoint(cursor, *checkpoint)
+        self.write(insert)
+
+    def _dedupe_responses(self, cursor):
+        """Migration to one row per answer: keep the newest of any repeated answers,
+        then enforce it with a unique index (which also serves session lookups)"""
+        cursor.execute("""
+            DELETE FROM responses
+            WHERE session_id IS NOT NULL AND id NOT IN (
+                SELECT MAX(id) FROM responses WHERE session_id IS NOT NULL
+                GROUP BY user_id, session_id, question_id
+            )
+        """)
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_responses_answer ON responses (user_id, session_id, question_id)")
+        cursor.execute("DROP INDEX IF EXISTS idx_responses_session")
+
+    # Fields list endpoints can select with fields=, and the SQL for each
+    RESPONSE_FIELDS = {
+        "id": "r.id", "user_id": "r.user_id", "session_id": "r.session_id", "question_id": "r.question_id",
+        "question_type": "q.question_type", "question_text": "q.question_text",
+        "response_value": RESPONSE_VALUE, "response_text": "r.response_text", "created_at": "r.created_at",
+        "day_number": "r.day_number",
+    }
+
+    @staticmethod
+    def _select_list(available: Dict[str, str], fields) -> str:
+        return ", ".join(f"{available[name]} AS {name}" for name in fields)
+
+    def _response_select(self, fields: Optional[List[str]]) -> str:
+        return self._select_list(self.RESPONSE_FIELDS, fields or self.RESPONSE_FIELDS)
+
+    def get_session_responses(self, user_id: int, session_id: str, fields: Optional[List[str]] = None) -> List[dict]:
+        """All responses for a session joined with their question text and type,
+        or just the given RESPONSE_FIELDS"""
+        with self.read() as cursor:
+            self.execute(cursor, f"""
+                SELECT {self._response_select(fields)}
+                FROM responses r
+                JOIN questions q ON r.question_id = q.id
+                {self.RESPONSE_VALUE_JOIN}
+                WHERE r.user_id = ? AND r.session_id = ?
+                ORDER BY r.created_at, r.id
+            """, (user_id, self._session_key(session_id)))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def iter_response_history(self, user_id: int, after: Optional[tuple] = None,
+                              question_type: Optional[str] = None, start_date: Optional[str] = None,
+                              end_date: Optional[str] = None, limit: Optional[int] = None,
+                              fields: Optional[List[str]] = None, batch_size: int = 500):
+        """Yield a user's responses across sessions, joined with their question, in
+        (created_at, id) order starting after the given key, from a streaming cursor.
+        A fields selection always includes id and created_at, which the keyset needs."""
+        conditions, params = self._date_range("r.created_at", start_date, end_date)
+        conditions.insert(0, "r.user_id = ?")
+        params.insert(0, user_id)
+        if after:
+            conditions.append("(r.created_at, r.id) > (?, ?)")
+            params.extend(after)
+        if question_type:
+            conditions.append("q.question_type = ?")
+            params.append(question_type)
+        if fields is None:
+            fields = ("id", "session_id", "question_id", "question_type", "question_text",
+                      "response_value", "response_text", "created_at")
+        else:
+            fields = ["id", "created_at"] + [f for f in fields if f not in ("id", "created_at")]
+        query = f"""
+            SELECT {self._select_list(self.RESPONSE_FIELDS, fields)}
+            FROM responses r
+            JOIN questions q ON r.question_id = q.id
+            {self.RESPONSE_VALUE_JOIN}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY r.created_at, r.id
+        """
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self.stream() as cursor:
+            self.execute(cursor, query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+
+    # Analysis results
+    INSERT_ANALYSIS = """
+        INSERT INTO analysis_results (user_id, session_id, conditions, clinicians,
+                                    overall_score, risk_level, analysis_version,
+                                    llm_model, prompt_tokens, completion_tokens, llm_latency_ms, cost_usd)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    def _analysis_row(self, user_id: int, session_id: str, analysis: dict, clinicians: List[dict],
+                      version: Optional[str]) -> tuple:
+        # OpenAI usage travels with the analysis but is stored in its own columns
+        analysis = dict(analysis)
+        usage = analysis.pop('usage', None) or {}
+        return (
+            user_id,
+            self._session_key(session_id),
+            json.dumps(analysis),
+            json.dumps(clinicians),
+            analysis.get('overall_score', 50),
+            analysis.get('risk_level', 'Moderate'),
+            version,
+            usage.get('model'),
+            usage.get('prompt_tokens'),
+            usage.get('completion_tokens'),
+            usage.get('latency_ms'),
+            usage.get('cost_usd')
+        )
+
+    def insert_analysis(self, user_id: int, session_id: str, analysis: dict, clinicians: List[dict],
+                        version: Optional[str] = None):
+        def insert(cursor):
+            self.execute(cursor, self.INSERT_ANALYSIS,
+                         self._analysis_row(user_id, session_id, analysis, clinicians, version))
+        self.write(insert)
+
+    def insert_analyses(self, results: List[tuple], checkpoint: Optional[tuple] = None):
+        """Save (user_id, session_id, analysis, clinicians, version) tuples in one transaction,
+        together with an optional (name, state) pipeline checkpoint"""
+        def insert(cursor):
+            if results:
+                self.executemany(cursor, self.INSERT_ANALYSIS, [self._analysis_row(*r) for r in results])
+            if checkpoint:
+                self._save_checkpoint(cursor, *checkpoint)
+        self.write(insert)
+
+    def get_latest_analysis(self, user_id: int, session_id: str) -> Optional[dict]:
+        """Most recent analysis row for a session, with conditions and clinicians still JSON-encoded"""
+        with self.read() as cursor:
+            self.execute(cursor, """
+                SELECT * FROM analysis_results
+                WHERE user_id = ? AND session_id = ?
+                ORDER BY id DESC
+                LIMIT 1
+            """, (user_id, self._session_key(session_id)))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+
+    def get_analysis_history(self, user_id: int, before: Optional[tuple] = None, limit: int = 20) -> List[dict]:
+        """A user's analyses, newest first, starting after the (created_at, id) key of
+        the previous page; conditions are still JSON-encoded and clinicians are left out"""
+        before_clause = "AND (created_at, id) < (?, ?)" if before else ""
+        with self.read() as cursor:
+            self.execute(cursor, f"""
+                SELECT id, session_id, conditions, overall_score, risk_level, analysis_version, created_at
+                FROM analysis_results
+                WHERE user_id = ? {before_clause}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            """, (user_id, *(before or ()), limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    # OpenAI usage
+    def llm_spend_since(self, since: str) -> float:
+        """Total recorded OpenAI cost of analyses saved since the given timestamp"""
+        with self.read() as cursor:
+            self.execute(cursor, "SELECT SUM(cost_usd) AS cost FROM analysis_results WHERE created_at >= ?", (since,))
+            return cursor.fetchone()["cost"] or 0.0
+
+    def iter_llm_usage(self, start_date: Optional[str] = None, end_date: Optional[str] = None):
+        """Yield the OpenAI usage of each analysis that made a call, oldest first, from a streaming cursor"""
+        conditions, params = self._date_range("created_at", start_date, end_date)
+        conditions.insert(0, "llm_model IS NOT NULL")
+        with self.stream() as cursor:
+            self.execute(cursor, f"""
+                SELECT created_at, llm_model, prompt_tokens, completion_tokens, llm_latency_ms, cost_usd
+                FROM analysis_results
+                WHERE {" AND ".join(conditions)}
+                ORDER BY created_at
+            """, params)
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+
+    # When an answer last changed: updated_at is only set once it is edited
+    RESPONSE_CHANGED_AT = "COALESCE(r.updated_at, r.created_at)"
+
+    # Batch re-analysis
+    def find_sessions_to_analyze(self, version: str, idle_before: str, after: Optional[tuple] = None,
+                                 limit: int = 200) -> List[dict]:
+        """Sessions idle since idle_before with no analysis at this version made after
+        their last answer changed, in (user_id, session_id) order starting after the given key"""
+        after = after or (0, "")
+        with self.read() as cursor:
+            self.execute(cursor, f"""
+                SELECT s.user_id, s.session_id
+                FROM (
+                    SELECT r.user_id, r.session_id, MAX({self.RESPONSE_CHANGED_AT}) AS changed_at
+                    FROM responses r
+                    WHERE (r.user_id, r.session_id) > (?, ?)
+                    GROUP BY r.user_id, r.session_id
+                ) s
+                WHERE s.changed_at < ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM analysis_results a
+                      WHERE a.user_id = s.user_id AND a.session_id = s.session_id
+                        AND a.analysis_version = ? AND a.created_at > s.changed_at
+                  )
+                ORDER BY s.user_id, s.session_id
+                LIMIT ?
+            """, (after[0], self._session_key(after[1]), idle_before, version, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_responses_for_sessions(self, sessions: List[tuple]) -> Dict[tuple, List[dict]]:
+        """Responses for many (user_id, session_id) sessions in one query, grouped by session"""
+        grouped = {tuple(key): [] for key in sessions}
+        if not sessions:
+            return grouped
+        match = " OR ".join(["(r.user_id = ? AND r.session_id = ?)"] * len(sessions))
+        with self.read() as cursor:
+            self.execute(cursor, f"""
+                SELECT {self._response_select(None)}
+                FROM responses r
+                JOIN questions q ON r.question_id = q.id
+                {self.RESPONSE_VALUE_JOIN}
+                WHERE {match}
+                ORDER BY r.user_id, r.session_id, r.created_at, r.id
+            """, [value for user_id, session_id in sessions for value in (user_id, self._session_key(session_id))])
+            for row in cursor.fetchall():
+                grouped[(row["user_id"], row["session_id"])].append(dict(row))
+        return grouped
+
+    def get_checkpoint(self, name: str) -> Optional[dict]:
+        with self.read() as cursor:
+            self.execute(cursor, "SELECT state FROM pipeline_checkpoints WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            return json.loads(row["state"]) if row else None
+
+    def save_checkpoint(self, name: str, state: Optional[dict]):
+        """Record a pipeline's progress, or clear it with state None"""
+        self.write(lambda cursor: self._save_checkpoint(cursor, name, state))
+
+    def _save_checkpoint(self, cursor, name: str, state: Optional[dict]):
+        if state is None:
+            self.execute(cursor, "DELETE FROM pipeline_checkpoints WHERE name = ?", (name,))
+            return
+        self.execute(cursor, """
+            INSERT INTO pipeline_checkpoints (name, state, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT (name) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+        """, (name, json.dumps(state)))
+
+    # Analysis locks
+    def try_acquire_analysis_lock(self, user_id: int, session_id: str, owner: str, ttl_seconds: float) -> bool:
+        """Take the session's analysis lease unless another owner holds an unexpired one"""
+        now = time.time()
+
+        def acquire(cursor):
+            self.execute(cursor, """
+                INSERT INTO analysis_locks (user_id, session_id, owner, expires_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, session_id) DO UPDATE
+                SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE analysis_locks.expires_at < ?
+            """, (user_id, self._session_key(session_id), owner, now + ttl_seconds, now))
+            self.execute(cursor, "SELECT owner FROM analysis_locks WHERE user_id = ? AND session_id = ?",
+                         (user_id, self._session_key(session_id)))
+            row = cursor.fetchone()
+            return row is not None and row["owner"] == owner
+        return self.write(acquire)
+
+    def release_analysis_lock(self, user_id: int, session_id: str, owner: str):
+        def release(cursor):
+            self.execute(cursor, "DELETE FROM analysis_locks WHERE user_id = ? AND session_id = ? AND owner = ?",
+                         (user_id, self._session_key(session_id), owner))
+        self.write(release)
+
+    # Risk signals and alerts
+    def get_risk_signals(self, user_id: int, session_id: str) -> Dict[int, List[str]]:
+        """The risk signals each answered question currently raises in a session (see risk.py)"""
+        with self.read() as cursor:
+            self.execute(cursor, "SELECT question_id, signals FROM session_risk_signals WHERE user_id = ? AND session_id = ?",
+                         (user_id, self._session_key(session_id)))
+            return {row["question_id"]: json.loads(row["signals"]) for row in cursor.fetchall()}
+
+    def save_risk_signals(self, user_id: int, session_id: str, question_id: int, signals: List[str],
+                          alerts_for) -> List[dict]:
+        """Replace one question's signals and, in the same transaction, add to the
+        outbox every alert alerts_for(session_signals) returns that the session has
+        not raised before. Returns the alerts added."""
+        session_key = self._session_key(session_id)
+
+        def save(cursor):
+            if signals:
+                self.execute(cursor, """
+                    INSERT INTO session_risk_signals (user_id, session_id, question_id, signals)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (user_id, session_id, question_id) DO UPDATE SET signals = excluded.signals
+                """, (user_id, session_key, question_id, json.dumps(signals)))
+            else:
+                self.execute(cursor, "DELETE FROM session_risk_signals WHERE user_id = ? AND session_id = ? AND question_id = ?",
+                             (user_id, session_key, question_id))
+            self.execute(cursor, "SELECT question_id, signals FROM session_risk_signals WHERE user_id = ? AND session_id = ?",
+                         (user_id, session_key))
+            session_signals = {row["question_id"]: json.loads(row["signals"]) for row in cursor.fetchall()}
+
+            added = []
+            for alert in alerts_for(session_signals):
+                self.execute(cursor, """
+                    INSERT INTO risk_alerts (user_id, session_id, rule, severity, signals)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (user_id, session_id, rule) DO NOTHING
+                    RETURNING id, created_at
+                """, (user_id, session_key, alert["rule"], alert["severity"], json.dumps(alert["signals"])))
+                row = cursor.fetchone()
+                if row:
+                    added.append({"id": row["id"], "user_id": user_id, "session_id": session_id,
+                                  **alert, "created_at": row["created_at"]})
+            return added
+        return self.write(save)
+
+    def list_risk_alerts(self, after_id: int = 0, undelivered_only: bool = True, limit: int = 100) -> List[dict]:
+        """Outbox alerts in the order they were raised, starting after after_id,
+        with signals still JSON-encoded"""
+        undelivered_clause = "AND delivered_at IS NULL" if undelivered_only else ""
+        with self.read() as cursor:
+            self.execute(cursor, f"""
+                SELECT * FROM risk_alerts
+                WHERE id > ? {undelivered_clause}
+                ORDER BY id
+                LIMIT ?
+            """, (after_id, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def mark_risk_alerts_delivered(self, alert_ids: List[int]) -> int:
+        """Take alerts out of the outbox once a consumer has handled them"""
+        if not alert_ids:
+            return 0
+
+        def mark(cursor):
+            placeholders = ", ".join("?" for _ in alert_ids)
+            self.execute(cursor, f"""
+                UPDATE risk_alerts SET delivered_at = CURRENT_TIMESTAMP
+                WHERE id IN ({placeholders}) AND delivered_at IS NULL
+            """, list(alert_ids))
+            return cursor.rowcount
+        return self.write(mark)
+
+    # Clinicians
+    def list_clinicians(self, fields: Optional[List[str]] = None) -> List[dict]:
+        """All clinicians ordered by rating (or just the given CLINICIAN_FIELDS of each),
+        with specializes_in still JSON-encoded"""
+        with self.read() as cursor:
+            self.execute(cursor, f"SELECT {self._clinician_select(fields)} FROM clinicians ORDER BY rating DESC")
+            return [dict(row) for row in cursor.fetchall()]
+
+    def get_clinicians_by_ids(self, ids: List[int]) -> List[dict]:
+        """The given clinicians, in no particular order, with specializes_in still JSON-encoded"""
+        if not ids:
+            return []
+        with self.read() as cursor:
+            placeholders = ", ".join("?" for _ in ids)
+            self.execute(cursor, f"SELECT * FROM clinicians WHERE id IN ({placeholders})", tuple(ids))
+            return [dict(row) for row in cursor.fetchall()]
+
+    CLINICIAN_COLUMNS = ("name", "specialty", "location", "phone", "email", "website", "license_number",
+                         "specializes_in", "rating", "years_experience", "accepts_insurance", "online_sessions")
+    CLINICIAN_GEO_COLUMNS = ("latitude", "longitude", "geohash")
+    CLINICIAN_FIELDS = ("id",) + CLINICIAN_COLUMNS + CLINICIAN_GEO_COLUMNS
+
+    def _clinician_select(self, fields: Optional[List[str]]) -> str:
+        if not fields:
+            return "*"
+        return self._select_list({name: name for name in self.CLINICIAN_FIELDS}, fields)
+
+    def _clinician_row(self, clinician: dict) -> tuple:
+        """Column values for a clinician, geocoding its location from the offline gazetteer"""
+        coords = geo.geocode(clinician["location"])
+        location = (coords[0], coords[1], geo.geohash_encode(*coords)) if coords else (None, None, None)
+        return tuple(clinician[column] for column in self.CLINICIAN_COLUMNS) + location
+
+    def upsert_clinicians(self, clinicians: List[dict]) -> int:
+        """Insert or update a batch of clinicians keyed on license_number, in one transaction"""
+        all_columns = self.CLINICIAN_COLUMNS + self.CLINICIAN_GEO_COLUMNS
+        columns = ", ".join(all_columns)
+        placeholders = ", ".join("?" for _ in all_columns)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in all_columns if c != "license_number")
+        query = f"""
+            INSERT INTO clinicians ({columns}) VALUES ({placeholders})
+            ON CONFLICT (license_number) DO UPDATE SET {updates}
+        """
+        rows = [self._clinician_row(c) for c in clinicians]
+
+        def upsert(cursor):
+            self.executemany(cursor, query, rows)
+            self._bump_version(cursor, self.CLINICIANS_VERSION)
+        self.write(upsert)
+        return len(rows)
+
+    def geocode_missing_clinicians(self):
+        """Fill in coordinates for clinicians stored before geocoding existed"""
+        with self.read() as cursor:
+            self.execute(cursor, "SELECT id, location FROM clinicians WHERE geohash IS NULL")
+            missing = cursor.fetchall()
+
+        updates = []
+        for row in missing:
+            coords = geo.geocode(row["location"])
+            if coords:
+                updates.append((coords[0], coords[1], geo.geohash_encode(*coords), row["id"]))
+        if updates:
+            def update(cursor):
+                self.executemany(
+                    cursor, "UPDATE clinicians SET latitude = ?, longitude = ?, geohash = ? WHERE id = ?", updates
+                )
+                self._bump_version(cursor, self.CLINICIANS_VERSION)
+            self.write(update)
+
+    def find_clinicians_near(self, latitude: float, longitude: float, radius_km: float,
+                             limit: Optional[int] = None, fields: Optional[List[str]] = None) -> List[dict]:
+        """Clinicians within radius_km (or just the given CLINICIAN_FIELDS of each),
+        nearest first, with distance_km set on each.
+
+        With a limit the search starts small and widens, so the nearest few in a
+        dense area come from a handful of index ranges rather than the whole radius.
+        """
+        # Distance and ordering need these whatever the caller asked for
+        needed = ("latitude", "longitude", "rating")
+        columns = list(fields) + [c for c in needed if c not in fields] if fields else None
+        search_km = min(radius_km, 10.0) if limit else radius_km
+        while True:
+            nearby = self._clinicians_within(latitude, longitude, search_km, columns)
+            if search_km >= radius_km or len(nearby) >= limit:
+                break
+            search_km = min(search_km * 4, radius_km)
+        nearby = nearby[:limit] if limit else nearby
+        if fields:
+            extra = [c for c in needed if c not in fields]
+            for clinician in nearby:
+                for column in extra:
+                    del clinician[column]
+        return nearby
+
+    def _clinicians_within(self, latitude: float, longitude: float, radius_km: float,
+                           columns: Optional[List[str]] = None) -> List[dict]:
+        query = f"SELECT {self._clinician_select(columns)} FROM clinicians WHERE geohash IS NOT NULL"
+        params = []
+        prefixes = geo.cover_prefixes(latitude, longitude, radius_km)
+        if prefixes is not None:
+            # One index range scan per covering cell
+            ranges = []
+            for low, high in map(geo.prefix_range, prefixes):
+                if high is None:
+                    ranges.append("geohash >= ?")
+                    params.append(low)
+                else:
+                    ranges.append("(geohash >= ? AND geohash < ?)")
+                    params.extend([low, high])
+            query += " AND (" + " OR ".join(ranges) + ")"
+
+        with self.read() as cursor:
+            self.execute(cursor, query, params)
+            candidates = [dict(row) for row in cursor.fetchall()]
+
+        nearby = []
+        for clinician in candidates:
+            distance = geo.haversine_km(latitude, longitude, clinician["latitude"], clinician["longitude"])
+            if distance <= radius_km:
+                clinician["distance_km"] = distance
+                nearby.append(clinician)
+        nearby.sort(key=lambda c: (c["distance_km"], -(c["rating"] or 0)))
+        return nearby
+
+    def rebuild_clinician_indexes(self):
+        """Refresh planner statistics after a bulk clinician load"""
+        def rebuild(cursor):
+            cursor.execute("ANALYZE clinicians")
+            self._bump_version(cursor, self.CLINICIANS_VERSION)
+        self.write(rebuild)
+
+    # Data versions, bumped in the same transaction as the change so caches
+    # in every worker can tell when their copy is stale
+    CLINICIANS_VERSION = "clinicians"
+    QUESTIONS_VERSION = "questions"
+
+    def _bump_version(self, cursor, name: str):
+        self.execute(cursor, """
+            INSERT INTO data_versions (name, version) VALUES (?, 1)
+            ON CONFLICT (name) DO UPDATE SET version = data_versions.version + 1
+        """, (name,))
+
+    def get_version(self, name: str) -> int:
+        with self.read() as cursor:
+            self.execute(cursor, "SELECT version FROM data_versions WHERE name = ?", (name,))
+            row = cursor.fetchone()
+            return row["version"] if row else 0
+
+    # Full-text search
+    HIGHLIGHT_START = "<mark>"
+    HIGHLIGHT_END = "</mark>"
+
+    @staticmethod
+    def search_terms(query: str) -> List[str]:
+        """Plain word tokens from user input, so search syntax in it is never interpreted"""
+        return re.findall(r"\w+", query.lower())
+
+    @abstractmethod
+    def search_clinicians(self, query: str, limit: int = 20) -> List[dict]:
+        """Clinicians matching query on name, specialty or location, best match first, with highlights"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def search_responses(self, user_id: int, query: str, session_id: Optional[str] = None,
+                         limit: int = 20) -> List[dict]:
+        """A user's free-text answers matching query, best match first, with a highlighted snippet"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _date_range(column: str, start_date: Optional[str], end_date: Optional[str]) -> tuple:
+        """WHERE conditions and params for an optional YYYY-MM-DD date range"""
+        conditions, params = [], []
+        if start_date:
+            conditions.append(f"{column} >= ?")
+            params.append(start_date)
+        if end_date:
+            # end_date is inclusive of the whole day
+            conditions.append(f"{column} < ?")
+            params.append((datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d"))
+        return conditions, params
+
+    # Bulk export
+    EXPORT_QUERIES = {
+        "responses": ("""
+            SELECT r.id, r.user_id, r.session_id, r.question_id, q.question_type, q.question_text,
+                   {response_value} AS response_value, r.response_text, r.created_at
+            FROM responses r
+            JOIN questions q ON r.question_id = q.id
+            {response_value_join}
+        """, "r"),
+        "analyses": ("""
+            SELECT a.id, a.user_id, a.session_id, a.overall_score, a.risk_level,
+                   a.conditions, a.clinicians, a.analysis_version, a.llm_model, a.prompt_tokens,
+                   a.completion_tokens, a.llm_latency_ms, a.cost_usd, a.created_at
+            FROM analysis_results a
+        """, "a"),
+    }
+
+    def iter_export(self, dataset: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                    user_id: Optional[int] = None, batch_size: int = 1000):
+        """Yield export rows one at a time from a streaming cursor, in id order"""
+        query, alias = self.EXPORT_QUERIES[dataset]
+        query = query.format(response_value=self.RESPONSE_VALUE, response_value_join=self.RESPONSE_VALUE_JOIN)
+        conditions, params = self._date_range(f"{alias}.created_at", start_date, end_date)
+        if user_id is not None:
+            conditions.append(f"{alias}.user_id = ?")
+            params.append(user_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += f" ORDER BY {alias}.id"
+
+        with self.stream() as cursor:
+            self.execute(cursor, query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+
+
+@functools.lru_cache(maxsize=256)
+def _column_names(description) -> tuple:
+    return tuple(column[0] for column in description)
+
+
+def _sqlite_row(cursor, row) -> dict:
+    """Row factory returning dicts, with session ids stored as UUID bytes turned back into text"""
+    values = dict(zip(_column_names(cursor.description), row))
+    session_id = values.get("session_id")
+    if isinstance(session_id, bytes):
+        values["session_id"] = str(uuid.UUID(bytes=session_id))
+    return values
+
+
+class SQLiteStorage(Storage):
+    """Single-file SQLite driver.
+
+    The database runs in WAL mode so readers never wait on a writer, and
+    writers take the lock up front with BEGIN IMMEDIATE so the busy timeout
+    applies when several workers write at once.
+
+    Reads are served from a pool of query_only connections (up to
+    read_pool_size, reused across requests), so they scale with threads and
+    never queue behind a write. All writes in the process, archival
+    included, go through one dedicated connection, one transaction at a
+    time, so they contend for the file lock only with other processes. The
+    one exception is init_schema, which runs on its own connection before
+    the API serves anything. The writer blocks its calling thread, so it
+    must never be called from the event loop.
+
+    Closed sessions can be moved out of the live file into monthly archive
+    databases under archive_dir; reads fall back to them transparently.
+
+    Session ids in canonical UUID form are stored as their 16 bytes (SQLite
+    keeps a blob as-is in a TEXT column) and come back as text from every
+    query through the row factory.
+    """
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000, synchronous: str = "NORMAL",
+                 archive_dir: str = "archive", read_pool_size: int = 16, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self.archive_dir = archive_dir
+        self.read_pool_size = read_pool_size
+
+        self._readers = queue.LifoQueue()
+        self._readers_open = 0
+        self._readers_lock = threading.Lock()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._writes = 0
+        self._writer_wait_seconds = 0.0
+
+    def connect(self, check_same_thread: bool = True):
+        """Open a SQLite connection with the busy timeout and sync level applied"""
+        # URI mode lets archive files be attached read-only with ?mode=ro
+        conn = sqlite3.connect(f"file:{self.path}", uri=True, timeout=self.busy_timeout_ms / 1000,
+                               check_same_thread=check_same_thread)
+        conn.row_factory = _sqlite_row
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+        conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return conn
+
+    def _connect_reader(self):
+        # Pooled connections move between threads, but only one uses them at a time
+        conn = self.connect(check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _acquire_reader(self):
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._readers_lock:
+            grow = self._readers_open < self.read_pool_size
+            if grow:
+                self._readers_open += 1
+        if grow:
+            try:
+                return self._connect_reader()
+            except Exception:
+                with self._readers_lock:
+                    self._readers_open -= 1
+                raise
+        return self._readers.get()
+
+    @contextmanager
+    def read(self):
+        conn = self._acquire_reader()
+        cursor = conn.cursor()
+        try:
+            yield cursor
+        finally:
+            # Closing the cursor ends its statement, releasing the WAL snapshot
+            cursor.close()
+            self._readers.put(conn)
+
+    @contextmanager
+    def stream(self):
+        # Long exports get their own connection rather than holding a pooled one;
+        # the response iterates it from threadpool threads
+        conn = self.connect(check_same_thread=False)
+        conn.execute("PRAGMA query_only = ON")
+        try:
+            yield conn.cursor()
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _writer_connection(self):
+        """The process's one write connection, held exclusively (callers manage transactions)"""
+        waited = time.monotonic()
+        with self._writer_lock:
+            self._writer_wait_seconds += time.monotonic() - waited
+            self._writes += 1
+            if self._writer is None:
+                self._writer = self.connect(check_same_thread=False)
+                self._writer.isolation_level = None
+            yield self._writer
+
+    def _run_transaction(self, operation):
+        with self._writer_connection() as conn:
+            try:
+                # Take the write lock up front so the busy timeout applies to it
+                conn.execute("BEGIN IMMEDIATE")
+                result = operation(conn.cursor())
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+            with self._readers_lock:
+                self._readers_open -= 1
+
+    def pool_stats(self) -> dict:
+        return {
+            "read_pool_size": self.read_pool_size,
+            "readers_open": self._readers_open,
+            "readers_idle": self._readers.qsize(),
+            "writes": self._writes,
+            "mean_writer_wait_ms": round(self._writer_wait_seconds / self._writes * 1000, 3) if self._writes else None,
+        }
+
+    def _is_retryable(self, error: Exception) -> bool:
+        message = str(error).lower()
+        return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+    def _is_integrity_error(self, error: Exception) -> bool:
+        return isinstance(error, sqlite3.IntegrityError)
+
+    def _session_key(self, session_id: Optional[str]):
+        try:
+            parsed = uuid.UUID(session_id)
+        except (TypeError, ValueError, AttributeError):
+            return session_id
+        # Only the canonical form, so the id reads back exactly as it was written
+        return parsed.bytes if str(parsed) == session_id else session_id
+
+    # Every table keyed by session, for the move to UUID bytes
+    SESSION_TABLES = ("sessions", "responses", "analysis_results", "analysis_locks",
+                      "session_risk_signals", "risk_alerts", "archived_sessions")
+
+    def _compact_session_ids(self, conn, schema: str = "main", tables=SESSION_TABLES):
+        """Migration rewriting text UUID session ids as bytes"""
+        conn.create_function("session_key", 1, self._session_key, deterministic=True)
+        for table in tables:
+            conn.execute(f"UPDATE {schema}.{table} SET session_id = session_key(session_id) WHERE typeof(session_id) = 'text'")
+
+    def _compact_archives(self, conn):
+        """Bring archive files written before compact encoding in line with the live tables"""
+        if not os.path.isdir(self.archive_dir):
+            return
+        for name in sorted(os.listdir(self.archive_dir)):
+            if not name.endswith(".db"):
+                continue
+            conn.execute("ATTACH DATABASE ? AS archive", (os.path.join(self.archive_dir, name),))
+            try:
+                tables = {row["name"] for row in conn.execute("SELECT name FROM archive.sqlite_master WHERE type = 'table'")}
+                if "responses" in tables:
+                    columns = {row["name"] for row in conn.execute("PRAGMA archive.table_info(responses)")}
+                    if "value_code" not in columns:
+                        conn.execute("ALTER TABLE archive.responses ADD COLUMN value_code INTEGER")
+                self._compact_session_ids(conn, "archive", [t for t in self.ARCHIVED_TABLES if t in tables])
+                conn.commit()
+            finally:
+                conn.execute("DETACH DATABASE archive")
+
+    def init_schema(self):
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        # WAL is persistent in the database file, so setting it once is enough
+        cursor.execute("PRAGMA journal_mode = WAL")
+
+        # Incremental auto-vacuum lets the retention job hand freed pages back
+        # in small steps. Existing files need one full VACUUM to switch over.
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()["auto_vacuum"] != 2:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
+
+        # Users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                age INTEGER,
+                gender TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        #session table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                session_id TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+        # Questions table for structured questions
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS questions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question_type TEXT NOT NULL,
+                question_text TEXT NOT NULL,
+                options TEXT, -- JSON string for multiple choice
+                scale_min INTEGER,
+                scale_max INTEGER,
+                is_follow_up BOOLEAN DEFAULT FALSE,
+                parent_question_id INTEGER,
+                trigger_condition TEXT
+            )
+        ''')
+        # Option index -> text for compactly stored choice answers
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS question_options (
+                question_id INTEGER NOT NULL,
+                option_index INTEGER NOT NULL,
+                option_value TEXT NOT NULL,
+                PRIMARY KEY (question_id, option_index)
+            )
+        ''')
+        self._sync_question_options(cursor)
+
+        # Responses table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                question_id INTEGER,
+                response_value TEXT NOT NULL,
+                response_text TEXT,
+                day_number INTEGER,
+                session_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id),
+                FOREIGN KEY (question_id) REFERENCES questions (id)
+            )
+        ''')
+
+        # Analysis results table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                session_id TEXT,
+                conditions TEXT, -- JSON string
+                clinicians TEXT, -- JSON string
+                overall_score INTEGER,
+                risk_level TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+
+        # Real clinicians database
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS clinicians (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                specialty TEXT NOT NULL,
+                location TEXT NOT NULL,
+                phone TEXT,
+                email TEXT,
+                website TEXT,
+                license_number TEXT,
+                specializes_in TEXT, -- JSON string of condition codes
+                rating REAL DEFAULT 0.0,
+                years_experience INTEGER,
+                accepts_insurance BOOLEAN DEFAULT TRUE,
+                online_sessions BOOLEAN DEFAULT FALSE
+            )
+        ''')
+
+        # Clinician feeds are upserted by license number
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clinicians_license ON clinicians (license_number)")
+
+        # Coordinates geocoded from the location, indexed by geohash for radius search
+        for column, declaration in (("latitude", "REAL"), ("longitude", "REAL"), ("geohash", "TEXT")):
+            self._add_column(cursor, "clinicians", column, declaration)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_clinicians_geohash ON clinicians (geohash)")
+
+        # Full-text indexes over clinicians and free-text answers, kept in sync by triggers
+        self._create_search_indexes(cursor)
+
+        # Per-session analysis leases shared by every worker on this database
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analysis_locks (
+                user_id INTEGER NOT NULL,
+                session_id TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL, -- unix time
+                PRIMARY KEY (user_id, session_id)
+            )
+        ''')
+
+        # Running risk state per session and the outbox of alerts it raised (see risk.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS session_risk_signals (
+                user_id INTEGER NOT NULL,
+                session_id TEXT NOT NULL,
+                question_id INTEGER NOT NULL,
+                signals TEXT NOT NULL, -- JSON list
+                PRIMARY KEY (user_id, session_id, question_id)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS risk_alerts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                session_id TEXT NOT NULL,
+                rule TEXT NOT NULL,
+                severity TEXT NOT NULL,
+                signals TEXT, -- JSON list
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                delivered_at TIMESTAMP,
+                UNIQUE (user_id, session_id, rule)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_risk_alerts_undelivered ON risk_alerts (id) WHERE delivered_at IS NULL")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_results_session ON analysis_results (user_id, session_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_results_user_created ON analysis_results (user_id, created_at, id)")
+
+        # Prompt and rule version that produced each analysis, for batch re-analysis
+        self._add_column(cursor, "analysis_results", "analysis_version", "TEXT")
+        # OpenAI model, tokens, latency and cost behind each analysis (see llm_usage.py)
+        for column, declaration in (("llm_model", "TEXT"), ("prompt_tokens", "INTEGER"), ("completion_tokens", "INTEGER"),
+                                    ("llm_latency_ms", "REAL"), ("cost_usd", "REAL")):
+            self._add_column(cursor, "analysis_results", column, declaration)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_results_created ON analysis_results (created_at)")
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_responses_answer'")
+        if cursor.fetchone() is None:
+            self._dedupe_responses(cursor)
+        # Choice and scale answers stored as integers (see Storage.RESPONSE_VALUE)
+        compact = "value_code" not in {row["name"] for row in cursor.execute("PRAGMA table_info(responses)").fetchall()}
+        self._add_column(cursor, "responses", "value_code", "INTEGER")
+        # When a replaced answer last changed (see Storage.UPSERT_RESPONSE)
+        self._add_column(cursor, "responses", "updated_at", "TIMESTAMP")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_responses_user_created ON responses (user_id, created_at, id)")
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS submission_keys (
+                user_id INTEGER NOT NULL,
+                idempotency_key TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, idempotency_key)
+            )
+        ''')
+        # Queued submissions the write-behind writer could not save (see writebehind.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS response_dead_letters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                record TEXT NOT NULL, -- the journal record as JSON
+                error TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+                name TEXT PRIMARY KEY,
+                state TEXT, -- JSON string
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS data_versions (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+        # Catalog of sessions moved to monthly archive files
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archived_sessions (
+                user_id INTEGER NOT NULL,
+                session_id TEXT NOT NULL,
+                archive_month TEXT NOT NULL, -- YYYY_MM of the session's last response
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, session_id)
+            )
+        ''')
+
+        # One-time move of existing data to the compact encoding; the pages it
+        # frees are handed back by retention's incremental vacuum
+        if compact:
+            self._compact_responses(cursor)
+            self._compact_session_ids(conn)
+        conn.commit()
+        if compact:
+            self._compact_archives(conn)
+        conn.close()
+
+    def _create_search_indexes(self, cursor):
+        existing = {row["name"] for row in cursor.execute(
+            "SELECT name FROM sqlite_master WHERE name IN ('clinicians_fts', 'responses_fts')"
+        ).fetchall()}
+
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS clinicians_fts USING fts5(
+                name, specialty, location,
+                content='clinicians', content_rowid='id', tokenize='porter unicode61'
+            )
+        """)
+        cursor.executescript("""
+            CREATE TRIGGER IF NOT EXISTS clinicians_fts_insert AFTER INSERT ON clinicians BEGIN
+                INSERT INTO clinicians_fts (rowid, name, specialty, location)
+                VALUES (new.id, new.name, new.specialty, new.location);
+            END;
+            CREATE TRIGGER IF NOT EXISTS clinicians_fts_delete AFTER DELETE ON clinicians BEGIN
+                INSERT INTO clinicians_fts (clinicians_fts, rowid, name, specialty, location)
+                VALUES ('delete', old.id, old.name, old.specialty, old.location);
+            END;
+            CREATE TRIGGER IF NOT EXISTS clinicians_fts_update AFTER UPDATE OF name, specialty, location ON clinicians BEGIN
+                INSERT INTO clinicians_fts (clinicians_fts, rowid, name, specialty, location)
+                VALUES ('delete', old.id, old.name, old.specialty, old.location);
+                INSERT INTO clinicians_fts (rowid, name, specialty, location)
+                VALUES (new.id, new.name, new.specialty, new.location);
+            END;
+        """)
+
+        # Only answers with free text are indexed, so every trigger checks for it
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS responses_fts USING fts5(
+                response_text,
+                content='responses', content_rowid='id', tokenize='porter unicode61'
+            )
+        """)
+        cursor.executescript("""
+            CREATE TRIGGER IF NOT EXISTS responses_fts_insert AFTER INSERT ON responses
+            WHEN new.response_text <> '' BEGIN
+                INSERT INTO responses_fts (rowid, response_text) VALUES (new.id, new.response_text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS responses_fts_delete AFTER DELETE ON responses
+            WHEN old.response_text <> '' BEGIN
+                INSERT INTO responses_fts (responses_fts, rowid, response_text)
+                VALUES ('delete', old.id, old.response_text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS responses_fts_update AFTER UPDATE OF response_text ON responses BEGIN
+                -- One trigger, so the old entry is always removed before the new one is added
+                INSERT INTO responses_fts (responses_fts, rowid, response_text)
+                SELECT 'delete', old.id, old.response_text WHERE old.response_text <> '';
+                INSERT INTO responses_fts (rowid, response_text)
+                SELECT new.id, new.response_text WHERE new.response_text <> '';
+            END;
+        """)
+
+        # Index rows that existed before the search tables did
+        if "clinicians_fts" not in existing:
+            cursor.execute("INSERT INTO clinicians_fts (clinicians_fts) VALUES ('rebuild')")
+        if "responses_fts" not in existing:
+            cursor.execute("""
+                INSERT INTO responses_fts (rowid, response_text)
+                SELECT id, response_text FROM responses WHERE response_text <> ''
+            """)
+
+    def _match_expression(self, query: str) -> Optional[str]:
+        """FTS5 query where every word must match and the last one may be a prefix"""
+        terms = self.search_terms(query)
+        if not terms:
+            return None
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += "*"
+        return " ".join(quoted)
+
+    def search_clinicians(self, query: str, limit: int = 20) -> List[dict]:
+        match = self._match_expression(query)
+        if not match:
+            return []
+        mark = (self.HIGHLIGHT_START, self.HIGHLIGHT_END)
+        with self.read() as cursor:
+            cursor.execute("""
+                SELECT c.*,
+                       highlight(clinicians_fts, 0, ?, ?) AS name_highlight,
+                       highlight(clinicians_fts, 1, ?, ?) AS specialty_highlight,
+                       highlight(clinicians_fts, 2, ?, ?) AS location_highlight,
+                       bm25(clinicians_fts, 10.0, 5.0, 2.0) AS rank
+                FROM clinicians_fts
+                JOIN clinicians c ON c.id = clinicians_fts.rowid
+                WHERE clinicians_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+            """, mark * 3 + (match, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def search_responses(self, user_id: int, query: str, session_id: Optional[str] = None,
+                         limit: int = 20) -> List[dict]:
+        match = self._match_expression(query)
+        if not match:
+            return []
+        sql = """
+            SELECT r.id, r.session_id, r.question_id, q.question_type, q.question_text,
+                   r.response_text, r.created_at,
+                   snippet(responses_fts, 0, ?, ?, '...', 24) AS snippet,
+                   bm25(responses_fts) AS rank
+            FROM responses_fts
+            JOIN responses r ON r.id = responses_fts.rowid
+            JOIN questions q ON q.id = r.question_id
+            WHERE responses_fts MATCH ? AND r.user_id = ?
+        """
+        params = [self.HIGHLIGHT_START, self.HIGHLIGHT_END, match, user_id]
+        if session_id:
+            sql += " AND r.session_id = ?"
+            params.append(self._session_key(session_id))
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        with self.read() as cursor:
+            cursor.execute(sql, params)
+            return [dict(row) for row in cursor.fetchall()]
+
+    def _add_column(self, cursor, table: str, column: str, declaration: str):
+        """ALTER TABLE ADD COLUMN, skipped when the column already exists"""
+        existing = {row["name"] for row in cursor.execute(f"PRAGMA table_info({table})").fetchall()}
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+    # Archival
+    ARCHIVED_TABLES = ("responses", "analysis_results")
+
+    def archive_path(self, month: str) -> str:
+        return os.path.join(self.archive_dir, f"archive_{month}.db")
+
+    def get_session_responses(self, user_id: int, session_id: str, fields: Optional[List[str]] = None) -> List[dict]:
+        responses = super().get_session_responses(user_id, session_id, fields)
+        if responses:
+            return responses
+        return self._get_archived_session_responses(user_id, session_id, fields)
+
+    def _get_archived_session_responses(self, user_id: int, session_id: str,
+                                        fields: Optional[List[str]] = None) -> List[dict]:
+        """Look up a session in its monthly archive, attached read-only"""
+        with self.read() as cursor:
+            session_key = self._session_key(session_id)
+            cursor.execute(
+                "SELECT archive_month FROM archived_sessions WHERE user_id = ? AND session_id = ?",
+                (user_id, session_key)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return []
+
+            path = self.archive_path(row["archive_month"])
+            if not os.path.exists(path):
+                return []
+
+            cursor.execute("ATTACH DATABASE ? AS archive", (f"file:{path}?mode=ro",))
+            try:
+                cursor.execute(f"""
+                    SELECT {self._response_select(fields)}
+                    FROM archive.responses r
+                    JOIN main.questions q ON r.question_id = q.id
+                    LEFT JOIN main.question_options o ON o.question_id = r.question_id AND o.option_index = r.value_code
+                    WHERE r.user_id = ? AND r.session_id = ?
+                    ORDER BY r.created_at, r.id
+                """, (user_id, session_key))
+                return [dict(row) for row in cursor.fetchall()]
+            finally:
+                cursor.execute("DETACH DATABASE archive")
+
+    def find_closed_sessions(self, max_age_days: int, limit: int = 1000) -> List[dict]:
+        """Sessions whose last response and analysis are older than max_age_days.
+        Legacy answers without a session id stay in the live database: archival
+        moves rows by (user_id, session_id), which never matches NULL."""
+        cutoff = (datetime.utcnow() - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S")
+        with self.read() as cursor:
+            cursor.execute(f"""
+                SELECT r.user_id, r.session_id,
+                       strftime('%Y_%m', MAX(r.created_at)) AS archive_month
+                FROM responses r
+                WHERE r.session_id IS NOT NULL
+                GROUP BY r.user_id, r.session_id
+                HAVING MAX({self.RESPONSE_CHANGED_AT}) < ?
+                   AND NOT EXISTS (
+                       SELECT 1 FROM analysis_results a
+                       WHERE a.user_id = r.user_id AND a.session_id = r.session_id
+                         AND a.created_at >= ?
+                   )
+                LIMIT ?
+            """, (cutoff, cutoff, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def archive_sessions(self, sessions: List[dict]) -> int:
+        """Move the given sessions' responses and analyses into their monthly archive files"""
+        by_month = {}
+        for session in sessions:
+            by_month.setdefault(session["archive_month"], []).append(
+                (session["user_id"], self._session_key(session["session_id"]))
+            )
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        archived = 0
+        for month, keys in sorted(by_month.items()):
+            self._archive_month(month, keys)
+            archived += len(keys)
+        return archived
+
+    def _archive_month(self, month: str, keys: List[tuple]):
+        # Runs on the writer connection like every other write, so it queues behind
+        # (and holds up) this process's writes instead of racing them for the file lock
+        with self._writer_connection() as conn:
+            # ATTACH is not allowed inside a transaction, so attach first
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_path(month),))
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (user_id INTEGER, session_id TEXT)")
+                conn.execute("DELETE FROM archive_batch")
+                conn.executemany("INSERT INTO archive_batch VALUES (?, ?)", keys)
+
+                for table in self.ARCHIVED_TABLES:
+                    # Archive tables mirror the live columns; ids are kept, so a rerun after
+                    # a partial failure skips rows that were already copied
+                    conn.execute(f"CREATE TABLE IF NOT EXISTS archive.{table} AS SELECT * FROM main.{table} WHERE 0")
+                    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS archive.idx_{table}_id ON {table} (id)")
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{table}_session ON {table} (user_id, session_id)")
+                    # Archive files created before a live column was added get it now
+                    live = [row["name"] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+                    archived = {row["name"] for row in conn.execute(f"PRAGMA archive.table_info({table})")}
+                    for column in live:
+                        if column not in archived:
+                            conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column}")
+                    columns = ", ".join(live)
+                    conn.execute(f"""
+                        INSERT OR IGNORE INTO archive.{table} ({columns})
+                        SELECT {columns} FROM main.{table}
+                        WHERE (user_id, session_id) IN (SELECT user_id, session_id FROM archive_batch)
+                    """)
+                    conn.execute(f"""
+                        DELETE FROM main.{table}
+                        WHERE (user_id, session_id) IN (SELECT user_id, session_id FROM archive_batch)
+                    """)
+
+                # Archived sessions are closed, so their running risk state is no longer needed
+                conn.execute("""
+                    DELETE FROM main.session_risk_signals
+                    WHERE (user_id, session_id) IN (SELECT user_id, session_id FROM archive_batch)
+                """)
+                conn.execute("""
+                    INSERT OR REPLACE INTO archived_sessions (user_id, session_id, archive_month)
+                    SELECT user_id, session_id, ? FROM archive_batch
+                """, (month,))
+                conn.execute("COMMIT")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.execute("DETACH DATABASE archive")
+
+    def incremental_vacuum(self, pages: int = 0):
+        """Return up to pages free pages to the filesystem (0 means all of them)"""
+        # Each step of the pragma frees one page, but execute() steps a statement
+        # without result columns only once; executescript runs it to completion
+        with self._writer_connection() as conn:
+            try:
+                conn.executescript(f"BEGIN IMMEDIATE; PRAGMA incremental_vacuum({int(pages)}); COMMIT;")
+            except Exception:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+
+
+class _BlockingPool:
+    """A psycopg2 ThreadedConnectionPool whose callers wait for a free connection.
+
+    psycopg2's getconn() raises PoolError the moment every connection is in
+    use; a semaphore with one slot per connection makes callers queue for up
+    to timeout seconds instead.
+    """
+
+    def __init__(self, pool, max_connections: int, timeout: float):
+        self._pool = pool
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.waits = 0
+
+    def getconn(self):
+        if not self._slots.acquire(blocking=False):
+            self.waits += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                raise PoolTimeout(f"No database connection free within {self.timeout}s")
+        try:
+            return self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn):
+        try:
+            self._pool.putconn(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class PostgresStorage(Storage):
+    """Pooled PostgreSQL driver for running several API nodes against one database.
+
+    Connections come from thread-safe psycopg2 pools, so the synchronous
+    endpoint code can share them across the server's worker threads. A
+    thread that finds every connection of a pool in use waits up to
+    pool_timeout seconds for one rather than failing. Reads
+    use their own pool of read-only sessions (optionally on a replica via
+    read_dsn, which should be synchronous for read-your-writes), so they
+    never wait for a connection held by a writer.
+    """
+
+    placeholder = "%s"
+
+    # SQLSTATEs for serialization failures and deadlocks, which are safe to retry
+    RETRYABLE_CODES = ("40001", "40P01")
+
+    def __init__(self, dsn: str, min_connections: int = 1, max_connections: int = 10,
+                 read_dsn: Optional[str] = None, read_max_connections: Optional[int] = None,
+                 pool_timeout: float = 30.0, **kwargs):
+        super().__init__(**kwargs)
+        import psycopg2
+        import psycopg2.extras
+        import psycopg2.pool
+
+        self._psycopg2 = psycopg2
+        self._pool = _BlockingPool(psycopg2.pool.ThreadedConnectionPool(
+            min_connections, max_connections, dsn,
+            cursor_factory=psycopg2.extras.RealDictCursor
+        ), max_connections, pool_timeout)
+        read_max_connections = read_max_connections or max_connections
+        self._read_pool = _BlockingPool(psycopg2.pool.ThreadedConnectionPool(
+            min_connections, read_max_connections, read_dsn or dsn,
+            cursor_factory=psycopg2.extras.RealDictCursor
+        ), read_max_connections, pool_timeout)
+
+    def executemany(self, cursor, query: str, rows):
+        # psycopg2's executemany is one round-trip per row; execute_batch pages them
+        self._psycopg2.extras.execute_batch(cursor, self.sql(query), rows, page_size=1000)
+        return cursor
+
+    @contextmanager
+    def _connection(self):
+        conn = self._pool.getconn()
+        try:
+            yield conn
+        finally:
+            self._pool.putconn(conn)
+
+    @contextmanager
+    def _read_connection(self):
+        conn = self._read_pool.getconn()
+        try:
+            conn.set_session(readonly=True)
+            yield conn
+        finally:
+            self._read_pool.putconn(conn)
+
+    @contextmanager
+    def read(self):
+        with self._read_connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    yield cursor
+            finally:
+                # End the implicit read transaction before the connection goes back to the pool
+                conn.rollback()
+
+    @contextmanager
+    def stream(self):
+        # A named cursor keeps the result set on the server and fetches it in chunks
+        with self._read_connection() as conn:
+            try:
+                with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+                    cursor.itersize = 2000
+                    yield cursor
+            finally:
+                conn.rollback()
+
+    def _run_transaction(self, operation):
+        with self._connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    result = operation(cursor)
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _is_retryable(self, error: Exception) -> bool:
+        return getattr(error, "pgcode", None) in self.RETRYABLE_CODES
+
+    def _is_integrity_error(self, error: Exception) -> bool:
+        return isinstance(error, self._psycopg2.IntegrityError)
+
+    # A failed integer cast is an error in PostgreSQL, so match the text instead
+    CANONICAL_INTEGER = "{column} ~ '^(0|-?[1-9][0-9]{{0,8}})$'"
+
+    def close(self):
+        self._pool.closeall()
+        self._read_pool.closeall()
+
+    def pool_stats(self) -> dict:
+        return {
+            "max_connections": self._pool.max_connections,
+            "read_max_connections": self._read_pool.max_connections,
+            "write_waits": self._pool.waits,
+            "read_waits": self._read_pool.waits,
+        }
+
+    def init_schema(self):
+        def create(cursor):
+            # Serialize schema creation when several nodes start at once
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext('init_schema'))")
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    email TEXT UNIQUE NOT NULL,
+                    age INTEGER,
+                    gender TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER REFERENCES users (id),
+                    session_id TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS questions (
+                    id SERIAL PRIMARY KEY,
+                    question_type TEXT NOT NULL,
+                    question_text TEXT NOT NULL,
+                    options TEXT, -- JSON string for multiple choice
+                    scale_min INTEGER,
+                    scale_max INTEGER,
+                    is_follow_up BOOLEAN DEFAULT FALSE,
+                    parent_question_id INTEGER,
+                    trigger_condition TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS question_options (
+                    question_id INTEGER NOT NULL,
+                    option_index INTEGER NOT NULL,
+                    option_value TEXT NOT NULL,
+                    PRIMARY KEY (question_id, option_index)
+                )
+            ''')
+            self._sync_question_options(cursor)
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER REFERENCES users (id),
+                    question_id INTEGER REFERENCES questions (id),
+                    response_value TEXT NOT NULL,
+                    response_text TEXT,
+                    day_number INTEGER,
+                    session_id TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS analysis_results (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER REFERENCES users (id),
+                    session_id TEXT,
+                    conditions TEXT, -- JSON string
+                    clinicians TEXT, -- JSON string
+                    overall_score INTEGER,
+                    risk_level TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS clinicians (
+                    id SERIAL PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    specialty TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    phone TEXT,
+                    email TEXT,
+                    website TEXT,
+                    license_number TEXT,
+                    specializes_in TEXT, -- JSON string of condition codes
+                    rating REAL DEFAULT 0.0,
+                    years_experience INTEGER,
+                    accepts_insurance BOOLEAN DEFAULT TRUE,
+                    online_sessions BOOLEAN DEFAULT FALSE
+                )
+            ''')
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_clinicians_license ON clinicians (license_number)")
+            cursor.execute("ALTER TABLE clinicians ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION")
+            cursor.execute("ALTER TABLE clinicians ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION")
+            cursor.execute("ALTER TABLE clinicians ADD COLUMN IF NOT EXISTS geohash TEXT")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_clinicians_geohash ON clinicians (geohash)")
+            # Expression indexes for full-text search; queries must use the same expressions
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_clinicians_search ON clinicians USING GIN ({self.CLINICIAN_DOCUMENT})")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_responses_search ON responses USING GIN ({self.RESPONSE_DOCUMENT})")
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS analysis_locks (
+                    user_id INTEGER NOT NULL,
+                    session_id TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    expires_at DOUBLE PRECISION NOT NULL, -- unix time
+                    PRIMARY KEY (user_id, session_id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS session_risk_signals (
+                    user_id INTEGER NOT NULL,
+                    session_id TEXT NOT NULL,
+                    question_id INTEGER NOT NULL,
+                    signals TEXT NOT NULL, -- JSON list
+                    PRIMARY KEY (user_id, session_id, question_id)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS risk_alerts (
+                    id SERIAL PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    session_id TEXT NOT NULL,
+                    rule TEXT NOT NULL,
+                    severity TEXT NOT NULL,
+                    signals TEXT, -- JSON list
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    delivered_at TIMESTAMP,
+                    UNIQUE (user_id, session_id, rule)
+                )
+            ''')
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_risk_alerts_undelivered ON risk_alerts (id) WHERE delivered_at IS NULL")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_results_session ON analysis_results (user_id, session_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_results_user_created ON analysis_results (user_id, created_at, id)")
+            cursor.execute("ALTER TABLE analysis_results ADD COLUMN IF NOT EXISTS analysis_version TEXT")
+            # OpenAI model, tokens, latency and cost behind each analysis (see llm_usage.py)
+            for column, declaration in (("llm_model", "TEXT"), ("prompt_tokens", "INTEGER"), ("completion_tokens", "INTEGER"),
+                                        ("llm_latency_ms", "DOUBLE PRECISION"), ("cost_usd", "DOUBLE PRECISION")):
+                cursor.execute(f"ALTER TABLE analysis_results ADD COLUMN IF NOT EXISTS {column} {declaration}")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_analysis_results_created ON analysis_results (created_at)")
+            cursor.execute("SELECT 1 FROM pg_indexes WHERE indexname = 'idx_responses_answer'")
+            if cursor.fetchone() is None:
+                self._dedupe_responses(cursor)
+            cursor.execute("""
+                SELECT 1 FROM information_schema.columns WHERE table_name = 'responses' AND column_name = 'value_code'
+            """)
+            if cursor.fetchone() is None:
+                cursor.execute("ALTER TABLE responses ADD COLUMN value_code INTEGER")
+                self._compact_responses(cursor)
+            cursor.execute("ALTER TABLE responses ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_responses_user_created ON responses (user_id, created_at, id)")
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS submission_keys (
+                    user_id INTEGER NOT NULL,
+                    idempotency_key TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, idempotency_key)
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS response_dead_letters (
+                    id SERIAL PRIMARY KEY,
+                    record TEXT NOT NULL, -- the journal record as JSON
+                    error TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+                    name TEXT PRIMARY KEY,
+                    state TEXT, -- JSON string
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS data_versions (
+                    name TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+        self.write(create)
+
+    # Full-text search
+    CLINICIAN_DOCUMENT = (
+        "(setweight(to_tsvector('english', name), 'A') || "
+        "setweight(to_tsvector('english', specialty), 'B') || "
+        "setweight(to_tsvector('english', location), 'C'))"
+    )
+    RESPONSE_DOCUMENT = "to_tsvector('english', coalesce(response_text, ''))"
+
+    def _tsquery(self, query: str) -> Optional[str]:
+        """tsquery where every word must match and the last one may be a prefix"""
+        terms = self.search_terms(query)
+        if not terms:
+            return None
+        return " & ".join(terms) + ":*"
+
+    def _headline_options(self, whole: bool) -> str:
+        options = f"StartSel={self.HIGHLIGHT_START}, StopSel={self.HIGHLIGHT_END}"
+        return options + (", HighlightAll=true" if whole else ", MaxWords=24, MinWords=8")
+
+    def search_clinicians(self, query: str, limit: int = 20) -> List[dict]:
+        tsquery = self._tsquery(query)
+        if not tsquery:
+            return []
+        whole = self._headline_options(True)
+        with self.read() as cursor:
+            self.execute(cursor, f"""
+                SELECT c.*,
+                       ts_headline('english', c.name, q, ?) AS name_highlight,
+                       ts_headline('english', c.specialty, q, ?) AS specialty_highlight,
+                       ts_headline('english', c.location, q, ?) AS location_highlight,
+                       ts_rank({self.CLINICIAN_DOCUMENT}, q) AS rank
+                FROM clinicians c, to_tsquery('english', ?) q
+                WHERE {self.CLINICIAN_DOCUMENT} @@ q
+                ORDER BY rank DESC
+                LIMIT ?
+            """, (whole, whole, whole, tsquery, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def search_responses(self, user_id: int, query: str, session_id: Optional[str] = None,
+                         limit: int = 20) -> List[dict]:
+        tsquery = self._tsquery(query)
+        if not tsquery:
+            return []
+        sql = f"""
+            SELECT r.id, r.session_id, r.question_id, q.question_type, q.question_text,
+                   r.response_text, r.created_at,
+                   ts_headline('english', r.response_text, tq, ?) AS snippet,
+                   ts_rank({self.RESPONSE_DOCUMENT}, tq) AS rank
+            FROM responses r
+            JOIN questions q ON q.id = r.question_id,
+                 to_tsquery('english', ?) tq
+            WHERE {self.RESPONSE_DOCUMENT} @@ tq AND r.user_id = ?
+        """
+        params = [self._headline_options(False), tsquery, user_id]
+        if session_id:
+            sql += " AND r.session_id = ?"
+            params.append(self._session_key(session_id))
+        sql += " ORDER BY rank DESC LIMIT ?"
+        params.append(limit)
+        with self.read() as cursor:
+            self.execute(cursor, sql, params)
+            return [dict(row) for row in cursor.fetchall()]
+
+
+def create_storage() -> Storage:
+    """Build the storage backend selected by STORAGE_BACKEND"""
+    backend = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+    retry_options = {
+        "write_retries": int(os.getenv("DB_WRITE_RETRIES", "5")),
+        "retry_delay": float(os.getenv("DB_WRITE_RETRY_DELAY", "0.05")),
+    }
+
+    if backend == "sqlite":
+        return SQLiteStorage(
+            os.getenv("SQLITE_PATH", "enhanced_mental_health.db"),
+            busy_timeout_ms=int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+            synchronous=os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+            archive_dir=os.getenv("ARCHIVE_DIR", "archive"),
+            read_pool_size=int(os.getenv("SQLITE_READ_POOL_SIZE", str(2 * (os.cpu_count() or 4)))),
+            **retry_options
+        )
+    if backend in ("postgres", "postgresql"):
+        # A threadpool thread can hold a write and a read connection at once (encoding
+        # an answer reads the questions mid-transaction), so pools as large as the API's
+        # threadpool never make a thread wait. Smaller pools, to stay under the server's
+        # max_connections with several workers, queue callers for up to pool_timeout.
+        threads = os.getenv("THREADPOOL_SIZE", "40")
+        return PostgresStorage(
+            os.getenv("POSTGRES_DSN", "postgresql://localhost/mental_health"),
+            min_connections=int(os.getenv("POSTGRES_POOL_MIN", "1")),
+            max_connections=int(os.getenv("POSTGRES_POOL_MAX", threads)),
+            read_dsn=os.getenv("POSTGRES_READ_DSN"),
+            read_max_connections=int(os.getenv("POSTGRES_READ_POOL_MAX", threads)),
+            pool_timeout=float(os.getenv("POSTGRES_POOL_TIMEOUT_SECONDS", "30")),
+            **retry_options
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
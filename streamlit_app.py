@@ -6,6 +6,11 @@ from dotenv import load_dotenv
 import os
 import uuid
 
+try:
+    from websockets.sync.client import connect as websocket_connect
+except ImportError:
+    websocket_connect = None
+
 load_dotenv()
 
 # Configure the page
@@ -18,6 +23,14 @@ st.set_page_config(
 # FastAPI backend URL
 API_BASE_URL = "https://healthcare-demo-q5ce.onrender.com"
 
+# Answers go over one WebSocket per assessment when possible
+WS_BASE_URL = API_BASE_URL.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+
+# Only the fields each page renders are requested from the list endpoints
+SESSION_RESPONSE_FIELDS = ["question_type", "question_text", "response_value", "response_text", "created_at"]
+CLINICIAN_LIST_FIELDS = ["name", "specialty", "location", "distance_miles", "rating", "years_experience",
+                         "phone", "email", "website", "accepts_insurance", "online_sessions"]
+
 # Initialize session state
 if 'user_id' not in st.session_state:
     st.session_state.user_id = None
@@ -82,12 +95,70 @@ def submit_response(user_id, question_id, response_value, response_text, session
         st.error(f"Error submitting response: {str(e)}")
         return None
 
-def analyze_session(user_id, session_id):
+def close_channel():
+    """Close the current assessment's WebSocket, if one is open"""
+    channel = st.session_state.pop('channel', None)
+    st.session_state.pop('channel_session_id', None)
+    if channel:
+        try:
+            channel.close()
+        except Exception:
+            pass
+
+def assessment_channel(user_id, session_id):
+    """The open WebSocket for this assessment, connecting on first use (None if unavailable)"""
+    if st.session_state.get('channel_session_id') == session_id:
+        return st.session_state.channel
+    close_channel()
+    if websocket_connect is None:
+        return None
+    try:
+        channel = websocket_connect(f"{WS_BASE_URL}/ws/assessment/{user_id}/{session_id}", open_timeout=5)
+        # The server starts with the current question list
+        channel.recv(timeout=10)
+    except Exception:
+        return None
+    st.session_state.channel = channel
+    st.session_state.channel_session_id = session_id
+    return channel
+
+def answer_question(user_id, question_id, response_value, response_text, session_id):
+    """Submit an answer and return the refreshed question list, in one WebSocket frame
+    when the channel is up and with two HTTP requests otherwise"""
+    channel = assessment_channel(user_id, session_id)
+    if channel:
+        try:
+            channel.send(json.dumps({
+                "type": "answer",
+                "question_id": question_id,
+                "response_value": response_value,
+                "response_text": response_text
+            }))
+            reply = json.loads(channel.recv(timeout=30))
+            if reply['type'] == "questions":
+                return reply['questions']
+            st.error(f"Error submitting response: {reply.get('detail', 'Unknown error')}")
+            return None
+        except Exception:
+            # Dropped connection; the HTTP path below takes over
+            close_channel()
+    
+    if not submit_response(user_id, question_id, response_value, response_text, session_id):
+        return None
+    questions_data = get_questions_for_session(user_id, session_id)
+    return questions_data['questions'] if questions_data else None
+
+def analyze_session(user_id, session_id, location=None):
     """Analyze session responses"""
     try:
-        response = requests.get(f"{API_BASE_URL}/analyze_session/{user_id}/{session_id}")
+        params = {"location": location} if location else {}
+        response = requests.get(f"{API_BASE_URL}/analyze_session/{user_id}/{session_id}", params=params)
         if response.status_code == 200:
             return response.json()
+        elif response.status_code == 503:
+            retry_after = response.headers.get("Retry-After", "a few")
+            st.warning(f"Analysis is busy right now. Please try again in {retry_after} seconds.")
+            return None
         else:
             st.error(f"Error analyzing session: {response.json().get('detail', 'Unknown error')}")
             return None
@@ -95,10 +166,34 @@ def analyze_session(user_id, session_id):
         st.error(f"Error analyzing session: {str(e)}")
         return None
 
-def get_session_responses(user_id, session_id):
-    """Get session responses"""
+def get_latest_analysis(user_id, session_id):
+    """Latest stored analysis of a session, or None if it has not been analyzed"""
     try:
-        response = requests.get(f"{API_BASE_URL}/get_session_responses/{user_id}/{session_id}")
+        response = requests.get(f"{API_BASE_URL}/analysis/{user_id}/{session_id}/latest")
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except Exception as e:
+        st.error(f"Error loading analysis: {str(e)}")
+        return None
+
+def get_analysis_history(user_id, cursor=None):
+    """One page of a user's stored analyses, newest first"""
+    try:
+        params = {"cursor": cursor} if cursor else {}
+        response = requests.get(f"{API_BASE_URL}/analysis_history/{user_id}", params=params)
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except Exception as e:
+        st.error(f"Error loading analysis history: {str(e)}")
+        return None
+
+def get_session_responses(user_id, session_id, fields=None):
+    """Get session responses, optionally only the listed fields of each"""
+    try:
+        params = {"fields": ",".join(fields)} if fields else {}
+        response = requests.get(f"{API_BASE_URL}/get_session_responses/{user_id}/{session_id}", params=params)
         if response.status_code == 200:
             return response.json()
         else:
@@ -107,6 +202,21 @@ def get_session_responses(user_id, session_id):
         st.error(f"Error getting responses: {str(e)}")
         return None
 
+def search_api(path, params):
+    """Call a search endpoint, returning the parsed JSON or None"""
+    try:
+        response = requests.get(f"{API_BASE_URL}{path}", params=params)
+        if response.status_code == 200:
+            return response.json()
+        st.error(f"Search failed: {response.json().get('detail', 'Unknown error')}")
+    except Exception as e:
+        st.error(f"Error searching: {str(e)}")
+    return None
+
+def highlighted(text):
+    """Render the API's <mark> highlights as bold markdown"""
+    return (text or "").replace("<mark>", "**").replace("</mark>", "**")
+
 def start_new_session():
     """Start a new assessment session"""
     session_id = str(uuid.uuid4())
@@ -173,6 +283,114 @@ def display_assessment_progress():
         st.progress(progress)
         st.write(f"Question {st.session_state.current_question_index + 1} of {len(st.session_state.current_questions)}")
 
+def render_analysis(analysis_result):
+    """Show an analysis with its conditions, recommendations and clinicians"""
+    analysis = analysis_result.get('analysis', {})
+
+    # Overall Assessment
+    col1, col2 = st.columns(2)
+    with col1:
+        overall_score = analysis.get('overall_score', 50)
+        st.metric("Overall Wellbeing Score", f"{overall_score}/100")
+    
+        # Score interpretation
+        if overall_score >= 80:
+            st.success("Excellent mental health indicators")
+        elif overall_score >= 60:
+            st.info("Good overall mental health")
+        elif overall_score >= 40:
+            st.warning("Some areas may need attention")
+        else:
+            st.error("Consider seeking professional support")
+
+    with col2:
+        risk_level = analysis.get('risk_level', 'Moderate')
+        st.metric("Risk Level", risk_level)
+    
+        risk_colors = {
+            'Low': 'success',
+            'Moderate': 'warning',
+            'High': 'error'
+        }
+        if risk_level in risk_colors:
+            getattr(st, risk_colors[risk_level])(f"Current risk level: {risk_level}")
+
+    st.write("---")
+
+    # Overall Assessment Text
+    if analysis.get('overall_assessment'):
+        st.subheader("Professional Assessment Summary")
+        st.info(analysis['overall_assessment'])
+
+    # Conditions Identified
+    conditions = analysis.get('conditions', [])
+    if conditions:
+        st.subheader("Areas of Focus Identified")
+    
+        for condition in conditions:
+            with st.container():
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    st.write(f"**{condition['name']}** ({condition['code']})")
+                    if condition.get('reasoning'):
+                        st.caption(condition['reasoning'])
+                with col2:
+                    probability = condition.get('probability', 0)
+                    st.write(f"Confidence: {probability}%")
+                    st.progress(probability / 100)
+                st.write("---")
+
+    # Recommendations
+    recommendations = analysis.get('recommendations', [])
+    if recommendations:
+        st.subheader("Personalized Recommendations")
+        for i, rec in enumerate(recommendations, 1):
+            st.write(f"{i}. {rec}")
+        st.write("---")
+
+    # Recommended Clinicians
+    clinicians = analysis_result.get('clinicians', [])
+    if clinicians:
+        st.subheader("Recommended Mental Health Professionals")
+        st.write("Based on your assessment, here are qualified professionals who specialize in your areas of need:")
+    
+        for clinician in clinicians[:5]:  # Show top 5
+            with st.expander(f" {clinician['name']} - {clinician['specialty']}"):
+                col1, col2 = st.columns(2)
+            
+                with col1:
+                    st.write(f"**Specialty:** {clinician['specialty']}")
+                    st.write(f"**Location:** {clinician['location']}")
+                    if clinician.get('distance_miles') is not None:
+                        st.write(f"**Distance:** {clinician['distance_miles']} miles")
+                    st.write(f"**Experience:** {clinician['years_experience']} years")
+                    if clinician.get('rating'):
+                        st.write(f"**Rating:** {clinician['rating']}/5.0 ⭐")
+            
+                with col2:
+                    st.write(f"**Phone:** {clinician['phone']}")
+                    if clinician.get('email'):
+                        st.write(f"**Email:** {clinician['email']}")
+                    if clinician.get('website'):
+                        st.write(f"**Website:** {clinician['website']}")
+                
+                    # Features
+                    features = []
+                    if clinician.get('accepts_insurance'):
+                        features.append("✅ Insurance Accepted")
+                    if clinician.get('online_sessions'):
+                        features.append("💻 Online Sessions")
+                    if features:
+                        st.write("**Features:** " + " | ".join(features))
+
+    # Disclaimer
+    st.write("---")
+    st.warning("**Important Disclaimer:** This assessment is for informational purposes only and should not replace professional medical advice. Please consult with qualified healthcare professionals for proper diagnosis and treatment.")
+
+    # Analysis metadata
+    analyzed_at = analysis_result.get('created_at') or datetime.now().strftime('%Y-%m-%d %H:%M')
+    st.caption(f"Analysis completed: {analyzed_at[:16]} | Session ID: {analysis_result['session_id'][:8]}...")
+
 def main():
     st.title("🧠 Enhanced Mental Health Assessment")
     st.write("A comprehensive mental health assessment with personalized clinician recommendations")
@@ -294,8 +512,8 @@ def main():
                                 valid_response = True
                             
                             if valid_response:
-                                # Submit response
-                                result = submit_response(
+                                # Submit response and get the questions with any new follow-ups
+                                questions = answer_question(
                                     st.session_state.user_id,
                                     current_question['id'],
                                     response_value or "",
@@ -303,12 +521,9 @@ def main():
                                     st.session_state.current_session_id
                                 )
                                 
-                                if result:
+                                if questions is not None:
                                     st.session_state.current_question_index += 1
-                                    # Refresh questions to check for new follow-ups
-                                    questions_data = get_questions_for_session(st.session_state.user_id, st.session_state.current_session_id)
-                                    if questions_data:
-                                        st.session_state.current_questions = questions_data['questions']
+                                    st.session_state.current_questions = questions
                                     st.rerun()
                             else:
                                 st.error("Please provide an answer before proceeding.")
@@ -327,8 +542,20 @@ def main():
     elif page == "My Sessions":
         st.header("My Assessment Sessions")
         
+        search_query = st.text_input("🔎 Search my answers", placeholder="e.g. work, sleep, family")
+        if search_query:
+            results = search_api(f"/search/responses/{st.session_state.user_id}", {"q": search_query})
+            if results and results['responses']:
+                for result in results['responses']:
+                    st.write(f"**{result['question_text']}** ({result['created_at'][:10]})")
+                    st.write(highlighted(result['snippet']))
+                st.write("---")
+            elif results is not None:
+                st.info("No answers matched your search.")
+        
         if st.session_state.current_session_id:
-            responses_data = get_session_responses(st.session_state.user_id, st.session_state.current_session_id)
+            responses_data = get_session_responses(st.session_state.user_id, st.session_state.current_session_id,
+                                                   fields=SESSION_RESPONSE_FIELDS)
             
             if responses_data and responses_data['responses']:
                 st.subheader("Current Session Responses")
@@ -353,128 +580,64 @@ def main():
             st.warning("No active session found. Please complete an assessment first.")
             return
         
-        if st.button("🔍 Analyze My Responses", type="primary", use_container_width=True):
+        user_location = st.text_input("Your location (optional)", placeholder="City, ST - used to find nearby clinicians")
+        
+        stored = get_latest_analysis(st.session_state.user_id, st.session_state.current_session_id)
+        label = "🔄 Re-analyze My Responses" if stored else "🔍 Analyze My Responses"
+        if st.button(label, type="primary", use_container_width=True):
             with st.spinner("Analyzing your responses with AI..."):
-                analysis_result = analyze_session(st.session_state.user_id, st.session_state.current_session_id)
-                
-                if analysis_result:
-                    st.success("Analysis completed!")
-                    
-                    analysis = analysis_result.get('analysis', {})
-                    
-                    # Overall Assessment
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        overall_score = analysis.get('overall_score', 50)
-                        st.metric("Overall Wellbeing Score", f"{overall_score}/100")
-                        
-                        # Score interpretation
-                        if overall_score >= 80:
-                            st.success("Excellent mental health indicators")
-                        elif overall_score >= 60:
-                            st.info("Good overall mental health")
-                        elif overall_score >= 40:
-                            st.warning("Some areas may need attention")
-                        else:
-                            st.error("Consider seeking professional support")
-                    
-                    with col2:
-                        risk_level = analysis.get('risk_level', 'Moderate')
-                        st.metric("Risk Level", risk_level)
-                        
-                        risk_colors = {
-                            'Low': 'success',
-                            'Moderate': 'warning',
-                            'High': 'error'
-                        }
-                        if risk_level in risk_colors:
-                            getattr(st, risk_colors[risk_level])(f"Current risk level: {risk_level}")
-                    
-                    st.write("---")
-                    
-                    # Overall Assessment Text
-                    if analysis.get('overall_assessment'):
-                        st.subheader("Professional Assessment Summary")
-                        st.info(analysis['overall_assessment'])
-                    
-                    # Conditions Identified
-                    conditions = analysis.get('conditions', [])
-                    if conditions:
-                        st.subheader("Areas of Focus Identified")
-                        
-                        for condition in conditions:
-                            with st.container():
-                                col1, col2 = st.columns([3, 1])
-                                with col1:
-                                    st.write(f"**{condition['name']}** ({condition['code']})")
-                                    if condition.get('reasoning'):
-                                        st.caption(condition['reasoning'])
-                                with col2:
-                                    probability = condition.get('probability', 0)
-                                    st.write(f"Confidence: {probability}%")
-                                    st.progress(probability / 100)
-                                st.write("---")
-                    
-                    # Recommendations
-                    recommendations = analysis.get('recommendations', [])
-                    if recommendations:
-                        st.subheader("Personalized Recommendations")
-                        for i, rec in enumerate(recommendations, 1):
-                            st.write(f"{i}. {rec}")
-                        st.write("---")
-                    
-                    # Recommended Clinicians
-                    clinicians = analysis_result.get('clinicians', [])
-                    if clinicians:
-                        st.subheader("Recommended Mental Health Professionals")
-                        st.write("Based on your assessment, here are qualified professionals who specialize in your areas of need:")
-                        
-                        for clinician in clinicians[:5]:  # Show top 5
-                            with st.expander(f" {clinician['name']} - {clinician['specialty']}"):
-                                col1, col2 = st.columns(2)
-                                
-                                with col1:
-                                    st.write(f"**Specialty:** {clinician['specialty']}")
-                                    st.write(f"**Location:** {clinician['location']}")
-                                    st.write(f"**Experience:** {clinician['years_experience']} years")
-                                    if clinician.get('rating'):
-                                        st.write(f"**Rating:** {clinician['rating']}/5.0 ⭐")
-                                
-                                with col2:
-                                    st.write(f"**Phone:** {clinician['phone']}")
-                                    if clinician.get('email'):
-                                        st.write(f"**Email:** {clinician['email']}")
-                                    if clinician.get('website'):
-                                        st.write(f"**Website:** {clinician['website']}")
-                                    
-                                    # Features
-                                    features = []
-                                    if clinician.get('accepts_insurance'):
-                                        features.append("✅ Insurance Accepted")
-                                    if clinician.get('online_sessions'):
-                                        features.append("💻 Online Sessions")
-                                    if features:
-                                        st.write("**Features:** " + " | ".join(features))
-                    
-                    # Disclaimer
-                    st.write("---")
-                    st.warning("**Important Disclaimer:** This assessment is for informational purposes only and should not replace professional medical advice. Please consult with qualified healthcare professionals for proper diagnosis and treatment.")
-                    
-                    # Analysis metadata
-                    st.caption(f"Analysis completed: {datetime.now().strftime('%Y-%m-%d %H:%M')} | Session ID: {st.session_state.current_session_id[:8]}...")
+                analysis_result = analyze_session(st.session_state.user_id, st.session_state.current_session_id, user_location)
+            if analysis_result:
+                st.success("Analysis completed!")
+                stored = analysis_result
+        
+        if stored:
+            render_analysis(stored)
+        else:
+            st.info("This session has not been analyzed yet.")
+        
+        history = get_analysis_history(st.session_state.user_id)
+        if history and history['analyses']:
+            st.subheader("Past Results")
+            for past in history['analyses']:
+                analysis = past['analysis']
+                st.write(f"{past['created_at'][:16]} - Score {analysis.get('overall_score', 50)}/100, "
+                         f"{analysis.get('risk_level', 'Moderate')} risk (session {past['session_id'][:8]}...)")
     
     # Find Clinicians Page
     elif page == "Find Clinicians":
         st.header("Find Mental Health Professionals")
         
+        search_query = st.text_input("🔎 Search by name, specialty or location", placeholder="e.g. trauma, anxiety, Boston")
+        if search_query:
+            results = search_api("/search/clinicians", {"q": search_query})
+            if results and results['clinicians']:
+                for clinician in results['clinicians']:
+                    st.write(f"{highlighted(clinician['name_highlight'])} - *{highlighted(clinician['specialty_highlight'])}* "
+                             f"- 📍 {highlighted(clinician['location_highlight'])} | 📞 {clinician['phone']}")
+            elif results is not None:
+                st.info("No clinicians matched your search.")
+            st.write("---")
+        
+        # Location search runs on the server, nearest clinicians first
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            near_location = st.text_input("Near", placeholder="City, ST (e.g. Austin, TX)")
+        with col2:
+            radius_miles = st.slider("Within (miles)", min_value=5, max_value=500, value=50, step=5)
+        
         try:
-            response = requests.get(f"{API_BASE_URL}/get_clinicians")
-            if response.status_code == 200:
+            params = {"location": near_location, "radius_miles": radius_miles} if near_location else {}
+            params["fields"] = ",".join(CLINICIAN_LIST_FIELDS)
+            response = requests.get(f"{API_BASE_URL}/get_clinicians", params=params)
+            if response.status_code != 200:
+                st.error(response.json().get('detail', 'Error loading clinicians'))
+            else:
                 all_clinicians = response.json()['clinicians']
                 
                 # Filters
                 st.subheader("Filter Clinicians")
-                col1, col2, col3 = st.columns(3)
+                col1, col2 = st.columns(2)
                 
                 with col1:
                     specialty_filter = st.selectbox(
@@ -483,20 +646,12 @@ def main():
                     )
                 
                 with col2:
-                    location_filter = st.selectbox(
-                        "Location",
-                        ["All"] + list(set([c['location'] for c in all_clinicians]))
-                    )
-                
-                with col3:
                     online_only = st.checkbox("Online Sessions Only")
                 
                 # Filter clinicians
                 filtered_clinicians = all_clinicians
                 if specialty_filter != "All":
                     filtered_clinicians = [c for c in filtered_clinicians if c['specialty'] == specialty_filter]
-                if location_filter != "All":
-                    filtered_clinicians = [c for c in filtered_clinicians if c['location'] == location_filter]
                 if online_only:
                     filtered_clinicians = [c for c in filtered_clinicians if c['online_sessions']]
                 
@@ -510,7 +665,10 @@ def main():
                         with col1:
                             st.write(f"**{clinician['name']}**")
                             st.write(f"*{clinician['specialty']}*")
-                            st.write(f"📍 {clinician['location']}")
+                            if clinician.get('distance_miles') is not None:
+                                st.write(f"📍 {clinician['location']} ({clinician['distance_miles']} miles away)")
+                            else:
+                                st.write(f"📍 {clinician['location']}")
                             st.write(f"⭐ {clinician['rating']}/5.0 | {clinician['years_experience']} years experience")
                         
                         with col2:
@@ -535,6 +693,7 @@ def main():
     
     # Logout
     elif page == "Logout":
+        close_channel()
         st.session_state.user_id = None
         st.session_state.current_session_id = None
         st.session_state.current_questions = []
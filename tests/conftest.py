@@ -0,0 +1,60 @@
+"""Fixtures for running the storage tests against every backend.
+
+SQLite runs against a file in the test's temporary directory. PostgreSQL
+runs against TEST_POSTGRES_DSN, a database the tests may wipe, for example
+
+    TEST_POSTGRES_DSN=postgresql://postgres@localhost:5432/mh_test pytest
+
+and is skipped when it is not set.
+"""
+import json
+import os
+
+import pytest
+
+from storage import SQLiteStorage, PostgresStorage
+
+QUESTIONS = [
+    {"question_type": "mood_scale", "question_text": "How would you rate your mood today?",
+     "scale_min": 1, "scale_max": 10},
+    {"question_type": "sleep_quality", "question_text": "How did you sleep last night?",
+     "options": json.dumps(["Very well", "Well", "Poorly", "Didn't sleep"])},
+    {"question_type": "negative_thoughts", "question_text": "Have you had thoughts of self-harm?",
+     "options": json.dumps(["Yes", "No"])},
+    {"question_type": "open_ended", "question_text": "What has been on your mind?"},
+]
+
+
+def reset_postgres(dsn: str):
+    import psycopg2
+
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DROP SCHEMA public CASCADE")
+            cursor.execute("CREATE SCHEMA public")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def storage(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SQLiteStorage(str(tmp_path / "test.db"), archive_dir=str(tmp_path / "archive"))
+    else:
+        dsn = os.getenv("TEST_POSTGRES_DSN")
+        if not dsn:
+            pytest.skip("TEST_POSTGRES_DSN is not set")
+        reset_postgres(dsn)
+        backend = PostgresStorage(dsn, max_connections=4)
+    backend.init_schema()
+    yield backend
+    backend.close()
+
+
+@pytest.fixture
+def questions(storage):
+    """The seeded questions by question_type"""
+    storage.seed_questions(QUESTIONS)
+    return {q["question_type"]: q for q in storage.list_questions()}
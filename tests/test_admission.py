@@ -0,0 +1,125 @@
+"""Admission pools: bounded concurrency and queues, shedding with Retry-After, and yielding."""
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionMiddleware, Overloaded, Pool
+
+
+async def settle():
+    """Let scheduled tasks and handed-over slots run until they next wait"""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def started(coroutine):
+    """Start a coroutine as a task and let it run up to its first wait"""
+    task = asyncio.ensure_future(coroutine)
+    await settle()
+    return task
+
+
+def test_full_queue_is_shed_and_waiters_are_admitted_in_order():
+    async def scenario():
+        pool = Pool("analysis", max_concurrent=1, max_queue=2, max_wait=5)
+        controller = AdmissionController({"analysis": pool}, classify=lambda path: "analysis")
+        await pool.acquire()
+        first = await started(pool.acquire())
+        second = await started(pool.acquire())
+
+        with pytest.raises(Overloaded) as shed:
+            await pool.acquire()
+        assert 1 <= shed.value.retry_after <= 60
+
+        controller.release(pool, 0.5)
+        await settle()
+        assert first.done() and not second.done()
+        controller.release(pool, 0.5)
+        await asyncio.wait_for(second, 1)
+        return pool.snapshot()
+
+    stats = asyncio.run(scenario())
+    assert (stats["active"], stats["admitted"], stats["queued"], stats["shed_queue_full"]) == (1, 3, 2, 1)
+
+
+def test_waiter_is_shed_after_max_wait():
+    async def scenario():
+        pool = Pool("bulk", max_concurrent=1, max_queue=5, max_wait=0.05)
+        await pool.acquire()
+        with pytest.raises(Overloaded):
+            await pool.acquire()
+        return pool.snapshot()
+
+    stats = asyncio.run(scenario())
+    assert (stats["queue_depth"], stats["shed_timeout"]) == (0, 1)
+
+
+def test_pool_yields_while_the_other_has_waiters():
+    async def scenario():
+        interactive = Pool("interactive", max_concurrent=1, max_queue=5, max_wait=5)
+        bulk = Pool("bulk", max_concurrent=5, max_queue=5, max_wait=5, yields_to=interactive)
+        controller = AdmissionController({"interactive": interactive, "bulk": bulk}, classify=lambda path: None)
+        await interactive.acquire()
+        queued = await started(interactive.acquire())
+
+        # Bulk has free slots, but waits behind the queued interactive request
+        held_back = await started(bulk.acquire())
+        assert not held_back.done()
+
+        controller.release(interactive, 0.1)
+        await asyncio.wait_for(asyncio.gather(queued, held_back), 1)
+
+    asyncio.run(scenario())
+
+
+class Recorder:
+    """An ASGI app that records whether it ran and answers 200 once released"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def request(middleware, path: str) -> dict:
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await middleware({"type": "http", "method": "GET", "path": path, "headers": [], "query_string": b""},
+                     receive, send)
+    start = sent[0]
+    return {"status": start["status"], "headers": dict(start.get("headers", []))}
+
+
+def test_middleware_sheds_with_503_and_retry_after():
+    async def scenario():
+        app = Recorder()
+        app.release = asyncio.Event()
+        pool = Pool("analysis", max_concurrent=1, max_queue=0, max_wait=1)
+        controller = AdmissionController({"analysis": pool},
+                                         classify=lambda path: None if path == "/health" else "analysis")
+        middleware = AdmissionMiddleware(app, controller)
+
+        held = await started(request(middleware, "/analyze"))
+        shed = await request(middleware, "/analyze")
+        assert shed["status"] == 503 and int(shed["headers"][b"retry-after"]) >= 1
+
+        # Unclassified paths bypass the pools even while they are full
+        app.release.set()
+        assert (await request(middleware, "/health"))["status"] == 200
+        assert (await held)["status"] == 200
+        assert pool.snapshot()["active"] == 0
+        return app.calls
+
+    assert asyncio.run(scenario()) == 2
@@ -0,0 +1,229 @@
+"""HTTP endpoints, run in-process against a fresh SQLite database."""
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+ADMIN = {"X-Admin-Token": "test-admin"}
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("api")
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv("STORAGE_BACKEND", "sqlite")
+        env.setenv("SQLITE_PATH", str(directory / "api.db"))
+        env.setenv("ARCHIVE_DIR", str(directory / "archive"))
+        env.setenv("RETENTION_ENABLED", "false")
+        env.setenv("ADMIN_TOKEN", "test-admin")
+        # Nothing listens here, so analyses fall back at once instead of calling OpenAI
+        env.setenv("OPENAI_BASE_URL", "http://127.0.0.1:9")
+        from fastapi.testclient import TestClient
+        import main
+
+        with TestClient(main.app) as client:
+            yield client
+
+
+def new_session(client, email: str) -> tuple:
+    user = client.post("/register_user", json={"name": "A", "email": email, "age": 30, "gender": "F"}).json()
+    return user["user_id"], user["session_id"]
+
+
+def answer(client, user_id: int, session_id: str, answers: dict):
+    """Submit {question_type: response_value} answers for a session"""
+    ids = {q["question_type"]: q["id"] for q in client.get(f"/get_questions/{user_id}/{session_id}").json()["questions"]}
+    for question_type, value in answers.items():
+        response = client.post("/submit_response", json={"user_id": user_id, "question_id": ids[question_type],
+                                                         "response_value": value, "session_id": session_id})
+        assert response.status_code == 200
+
+
+def test_list_limits_are_validated(client):
+    assert client.get("/get_clinicians", params={"limit": -1}).status_code == 422
+    assert client.get("/get_clinicians", params={"location": "New York, NY", "limit": 0}).status_code == 422
+    assert client.get("/search/clinicians", params={"q": "dr", "limit": 101}).status_code == 422
+    assert client.get("/admin/risk_alerts", params={"limit": 0}, headers=ADMIN).status_code == 422
+
+    assert len(client.get("/get_clinicians", params={"limit": 3}).json()["clinicians"]) == 3
+    nearby = client.get("/get_clinicians", params={"location": "New York, NY", "radius_miles": 3000,
+                                                   "limit": 8}).json()["clinicians"]
+    assert len(nearby) == 8
+    assert nearby[0]["location"] == "New York, NY"
+
+
+def test_reused_analysis_gets_clinicians_for_this_request(client):
+    import main
+
+    user_id, session_id = new_session(client, "reuse@example.com")
+    answer(client, user_id, session_id, {"mood_scale": "2", "sleep_quality": "Poorly"})
+    responses = main.storage.get_session_responses(user_id, session_id)
+
+    # Another worker holds the session's lease and saves an analysis it matched for elsewhere
+    assert main.storage.try_acquire_analysis_lock(user_id, session_id, "other-worker", 60)
+
+    def other_worker():
+        time.sleep(0.3)
+        main.storage.insert_analysis(user_id, session_id, {
+            "conditions": [{"code": "F32", "name": "Depressive Episode", "probability": 60}],
+            "risk_level": "Moderate", "overall_score": 45,
+        }, [{"name": "Dr. Somewhere Else"}], main.ANALYSIS_VERSION)
+        main.storage.release_analysis_lock(user_id, session_id, "other-worker")
+
+    threading.Thread(target=other_worker).start()
+    analysis, clinicians = asyncio.run(main.analyze_once(user_id, session_id, responses, "Chicago, IL", 50))
+
+    assert analysis["risk_level"] == "Moderate"
+    assert clinicians[0]["name"] == "Dr. Emily Johnson"
+    assert "Dr. Somewhere Else" not in [c["name"] for c in clinicians]
+
+
+def test_clinician_import_invalidates_cached_recommendations(client):
+    import main
+
+    depression = [{"code": "F32", "name": "Depressive Episode"}]
+    before = main.find_matching_clinicians(depression, "Boise, ID", 50)
+    assert all("distance_miles" not in c for c in before)
+    computed = main.recommendation_cache.snapshot()["computed"]
+    assert main.find_matching_clinicians(depression, "Boise, ID", 50) == before
+    assert main.recommendation_cache.snapshot()["computed"] == computed
+
+    feed = json.dumps([{"name": "Dr. Local Boise", "specialty": "Depression", "location": "Boise, ID",
+                        "license_number": "ID-1", "specializes_in": ["F32"], "rating": 4.0}])
+    response = client.post("/admin/clinicians/import", headers=ADMIN, files={"file": ("feed.json", feed)})
+    assert response.json()["upserted"] == 1
+
+    after = main.find_matching_clinicians(depression, "Boise, ID", 50)
+    assert (after[0]["name"], after[0]["distance_miles"]) == ("Dr. Local Boise", 0.0)
+    stats = main.recommendation_cache.snapshot()
+    assert (stats["computed"], stats["invalidations_sent"]) == (computed + 1, 1)
+
+
+def test_analysis_history_pages_with_a_cursor(client):
+    import main
+
+    user_id, session_id = new_session(client, "history@example.com")
+    assert client.get(f"/analysis/{user_id}/{session_id}/latest").status_code == 404
+    for score in range(5):
+        main.storage.insert_analysis(user_id, session_id, {"risk_level": "Low", "overall_score": score},
+                                     [{"name": "Dr. Emily Johnson"}], main.ANALYSIS_VERSION)
+
+    latest = client.get(f"/analysis/{user_id}/{session_id}/latest").json()
+    assert (latest["analysis"]["overall_score"], latest["clinicians"]) == (4, [{"name": "Dr. Emily Johnson"}])
+
+    scores, cursor = [], None
+    while True:
+        page = client.get(f"/analysis_history/{user_id}", params={"limit": 2, "cursor": cursor}).json()
+        scores.append([a["analysis"]["overall_score"] for a in page["analyses"]])
+        assert all("clinicians" not in a for a in page["analyses"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert scores == [[4, 3], [2, 1], [0]]
+    assert client.get(f"/analysis_history/{user_id}", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_response_history_streams_pages_with_a_cursor(client):
+    user_id, first = new_session(client, "responses@example.com")
+    second = "6f1c1f7e-9d0a-4a5e-8a5b-2d7c3e1b9f00"
+    answer(client, user_id, first, {"mood_scale": "3", "sleep_quality": "Poorly"})
+    answer(client, user_id, second, {"mood_scale": "6"})
+
+    values, cursor = [], None
+    while True:
+        response = client.get(f"/response_history/{user_id}", params={"limit": 2, "cursor": cursor})
+        assert response.headers["content-type"] == "application/json"
+        page = response.json()
+        values.append([(r["session_id"], r["response_value"]) for r in page["responses"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert values == [[(first, "3"), (first, "Poorly")], [(second, "6")]]
+
+    moods = client.get(f"/response_history/{user_id}", params={"question_type": "mood_scale",
+                                                              "fields": "response_value"}).json()
+    assert [set(r) for r in moods["responses"]] == [{"id", "created_at", "response_value"}] * 2
+    assert client.get(f"/response_history/{user_id}", params={"start_date": "yesterday"}).status_code == 400
+
+
+def test_fields_select_columns_and_large_lists_are_compressed(client):
+    nearby = client.get("/get_clinicians", params={"location": "Chicago, IL", "fields": "name,distance_miles",
+                                                   "limit": 2}).json()["clinicians"]
+    assert nearby[0] == {"name": "Dr. Emily Johnson", "distance_miles": 0.0}
+    assert all(set(c) == {"name", "distance_miles"} for c in nearby)
+    assert client.get("/get_clinicians", params={"fields": "name,password"}).status_code == 400
+
+    user_id, session_id = new_session(client, "fields@example.com")
+    answer(client, user_id, session_id, {"mood_scale": "7"})
+    responses = client.get(f"/get_session_responses/{user_id}/{session_id}",
+                           params={"fields": "question_type,response_value"}).json()["responses"]
+    assert responses == [{"question_type": "mood_scale", "response_value": "7"}]
+
+    full = client.get("/get_clinicians", headers={"Accept-Encoding": "gzip"})
+    assert full.headers["content-encoding"] == "gzip"
+    assert int(full.headers["content-length"]) < len(full.content)
+    assert len(full.json()["clinicians"]) >= 8
+
+
+def test_assessment_flow_over_a_websocket(client):
+    user_id, session_id = new_session(client, "socket@example.com")
+
+    with client.websocket_connect(f"/ws/assessment/{user_id}/{session_id}") as socket:
+        first = socket.receive_json()
+        assert first["type"] == "questions" and first["answered"] == []
+        mood = first["next_question"]
+        assert mood["question_type"] == "mood_scale"
+        assert "mood_follow_up" not in [q["question_type"] for q in first["questions"]]
+
+        # A low mood brings in its follow-up, which is asked next
+        socket.send_json({"type": "answer", "question_id": mood["id"], "response_value": "2"})
+        reply = socket.receive_json()
+        assert [q["question_type"] for q in reply["follow_ups"]] == ["mood_follow_up"]
+        assert reply["next_question"]["question_type"] == "mood_follow_up"
+        assert reply["answered"] == [mood["id"]]
+
+        socket.send_text("not json")
+        assert socket.receive_json()["type"] == "error"
+        socket.send_json({"type": "answer", "question_id": 99999, "response_value": "1"})
+        assert "Unknown question" in socket.receive_json()["detail"]
+        socket.send_json({"type": "shout"})
+        assert socket.receive_json()["type"] == "error"
+
+        socket.send_json({"type": "analyze", "location": "Chicago, IL"})
+        analysis = socket.receive_json()
+        assert (analysis["type"], analysis["session_id"], analysis["total_responses"]) == (
+            "analysis", session_id, 1)
+        assert analysis["clinicians"]
+
+    # Answers sent over the channel are saved like HTTP submissions
+    saved = client.get(f"/get_session_responses/{user_id}/{session_id}").json()["responses"]
+    assert [(r["question_type"], r["response_value"]) for r in saved] == [("mood_scale", "2")]
+    with client.websocket_connect(f"/ws/assessment/{user_id}/{session_id}") as socket:
+        assert socket.receive_json()["answered"] == [mood["id"]]
+
+
+def test_retried_submission_is_applied_once(client):
+    import main
+
+    user_id, session_id = new_session(client, "retry@example.com")
+    ids = {q["question_type"]: q["id"] for q in client.get(f"/get_questions/{user_id}/{session_id}").json()["questions"]}
+    answers_before = main.risk_evaluator.snapshot()["answers"]
+
+    def submit(value: str, key: str):
+        return client.post("/submit_response", json={"user_id": user_id, "question_id": ids["mood_scale"],
+                                                     "response_value": value, "session_id": session_id,
+                                                     "idempotency_key": key})
+
+    assert submit("3", "attempt-1").status_code == 200
+    assert submit("9", "attempt-1").status_code == 200
+    saved = client.get(f"/get_session_responses/{user_id}/{session_id}").json()["responses"]
+    assert [r["response_value"] for r in saved] == ["3"]
+    # The retry was not evaluated for risk a second time
+    assert main.risk_evaluator.snapshot()["answers"] == answers_before + 1
+
+    # A new submission for the same question replaces the answer in place
+    assert submit("8", "attempt-2").status_code == 200
+    saved = client.get(f"/get_session_responses/{user_id}/{session_id}").json()["responses"]
+    assert [r["response_value"] for r in saved] == ["8"]
@@ -0,0 +1,122 @@
+"""Circuit breaker state transitions and adaptive timeouts, on a controlled clock."""
+import pytest
+
+import breaker
+from breaker import CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    """Stands in for the time module inside breaker.py"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker, "time", clock)
+    return clock
+
+
+def succeed(clock, seconds: float = 0.25):
+    def call(timeout):
+        clock.now += seconds
+        return timeout
+    return call
+
+
+def fail(clock, seconds: float = 0.25):
+    def call(timeout):
+        clock.now += seconds
+        raise ConnectionError("unavailable")
+    return call
+
+
+def test_failures_open_the_circuit_once_enough_calls_are_seen(clock):
+    circuit = CircuitBreaker("openai", min_calls=4, failure_rate=0.5, open_seconds=30)
+
+    for call in (succeed, fail, succeed):
+        try:
+            circuit.call(call(clock))
+        except ConnectionError:
+            pass
+    assert circuit.snapshot()["state"] == CircuitBreaker.CLOSED
+    with pytest.raises(ConnectionError):
+        circuit.call(fail(clock))
+
+    assert circuit.snapshot()["state"] == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        circuit.call(succeed(clock))
+    assert circuit.snapshot()["rejected"] == 1
+
+
+def test_slow_calls_count_against_the_circuit(clock):
+    circuit = CircuitBreaker("openai", min_calls=2, failure_rate=0.5, slow_call_seconds=5)
+    circuit.call(succeed(clock, 6))
+    circuit.call(succeed(clock, 6))
+
+    assert circuit.snapshot()["state"] == CircuitBreaker.OPEN
+    assert circuit.snapshot()["slow_calls"] == 2
+
+
+def test_half_open_probe_closes_or_reopens(clock):
+    circuit = CircuitBreaker("openai", min_calls=1, failure_rate=0.5, open_seconds=30, half_open_probes=1)
+    with pytest.raises(ConnectionError):
+        circuit.call(fail(clock))
+    # The cool-down runs from when the failed call finished
+    clock.now += 29.75
+    assert circuit.snapshot()["state"] == CircuitBreaker.OPEN
+
+    # A failed probe opens it again for a full cool-down
+    clock.now += 0.25
+    assert circuit.snapshot()["state"] == CircuitBreaker.HALF_OPEN
+    with pytest.raises(ConnectionError):
+        circuit.call(fail(clock))
+    assert circuit.snapshot()["state"] == CircuitBreaker.OPEN
+    assert circuit.snapshot()["opened"] == 2
+
+    # Only one probe at a time; a healthy one closes the circuit with a clean window
+    clock.now += 30
+
+    def probe(timeout):
+        with pytest.raises(CircuitOpenError):
+            circuit.call(succeed(clock))
+        return timeout
+
+    circuit.call(probe)
+    stats = circuit.snapshot()
+    assert (stats["state"], stats["window_calls"]) == (CircuitBreaker.CLOSED, 0)
+
+
+def test_old_calls_leave_the_window(clock):
+    circuit = CircuitBreaker("openai", window_seconds=60, min_calls=3, failure_rate=0.5)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            circuit.call(fail(clock))
+    clock.now += 61
+    circuit.call(succeed(clock))
+
+    stats = circuit.snapshot()
+    assert (stats["state"], stats["window_calls"], stats["window_failures"]) == (CircuitBreaker.CLOSED, 1, 0)
+
+
+def test_timeout_follows_p95_latency_within_bounds(clock):
+    circuit = CircuitBreaker("openai", min_calls=100, timeout_default=15, timeout_min=2, timeout_max=30,
+                             timeout_multiplier=1.5)
+    assert circuit.call(succeed(clock, 4)) == 15
+
+    for _ in range(19):
+        circuit.call(succeed(clock, 4))
+    assert circuit.call(succeed(clock, 4)) == pytest.approx(6)
+
+    fast = CircuitBreaker("fast", timeout_min=2)
+    for _ in range(5):
+        fast.call(succeed(clock, 0.1))
+    assert fast.snapshot()["timeout_seconds"] == 2
+    for _ in range(5):
+        circuit.call(succeed(clock, 40))
+    assert circuit.snapshot()["timeout_seconds"] == 30
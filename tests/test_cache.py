@@ -0,0 +1,129 @@
+"""Versioned cache namespaces: per-namespace bounds and stats, sharing and invalidation."""
+import threading
+import time
+
+import pytest
+
+from cache import CacheNamespace, MemoryBackend, RedisBackend
+
+
+class Versions:
+    """Stands in for Storage.get_version"""
+
+    def __init__(self):
+        self.current = 1
+
+    def __call__(self) -> int:
+        return self.current
+
+
+def computed_by(tag: str, calls: list):
+    return lambda: calls.append(tag) or {"by": tag}
+
+
+def wait_for(condition, timeout: float = 2.0) -> bool:
+    started = time.monotonic()
+    while not condition():
+        if time.monotonic() - started > timeout:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_memory_namespaces_have_their_own_bound_and_stats():
+    backend = MemoryBackend()
+    versions = Versions()
+    small = CacheNamespace("small", backend, version=versions, max_entries=2, poll_seconds=60)
+    large = CacheNamespace("large", backend, version=versions, max_entries=100, poll_seconds=60)
+
+    for key in range(10):
+        small.get_or_compute(key, lambda: "small")
+        large.get_or_compute(key, lambda: "large")
+    large.get_or_compute(0, lambda: "recomputed")
+    small.get_or_compute(9, lambda: "recomputed")
+
+    assert (small.snapshot()["entries"], small.snapshot()["evictions"]) == (2, 8)
+    assert (large.snapshot()["entries"], large.snapshot()["evictions"]) == (10, 0)
+    assert (small.snapshot()["hits"], small.snapshot()["misses"], small.snapshot()["computed"]) == (1, 10, 10)
+    assert large.snapshot()["hit_rate"] == round(1 / 11, 3)
+
+
+def test_memory_invalidation_retires_entries():
+    backend = MemoryBackend()
+    versions = Versions()
+    recs = CacheNamespace("recs", backend, version=versions, poll_seconds=60)
+    calls = []
+
+    assert recs.get_or_compute("F32", computed_by("v1", calls)) == {"by": "v1"}
+    versions.current = 2
+    assert recs.get_or_compute("F32", computed_by("stale", calls)) == {"by": "v1"}
+    recs.invalidate()
+    assert recs.get_or_compute("F32", computed_by("v2", calls)) == {"by": "v2"}
+    assert calls == ["v1", "v2"]
+    assert recs.snapshot()["invalidations"] == 1
+
+
+@pytest.fixture
+def redis_url():
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("redis")
+    server = fakeredis.TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    yield f"redis://{host}:{port}/0"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def workers(redis_url):
+    """Two workers' namespaces on one Redis stand-in, reading the same data version"""
+    versions = Versions()
+    backends = [RedisBackend(redis_url), RedisBackend(redis_url)]
+    namespaces = [CacheNamespace("recs", backend, version=versions, max_entries=2, poll_seconds=60)
+                  for backend in backends]
+    yield versions, namespaces
+    for backend in backends:
+        backend.close()
+
+
+def test_redis_workers_share_entries(workers):
+    _, (a, b) = workers
+    calls = []
+
+    assert a.get_or_compute(("F32",), computed_by("a", calls)) == {"by": "a"}
+    assert b.get_or_compute(("F32",), computed_by("b", calls)) == {"by": "a"}
+    assert b.get_or_compute(("F32",), computed_by("b", calls)) == {"by": "a"}
+    assert calls == ["a"]
+
+    stats = b.snapshot()
+    assert (stats["hits"], stats["shared_hits"], stats["computed"], stats["hit_rate"]) == (1, 1, 0, 1.0)
+    for key in range(5):
+        b.get_or_compute(key, computed_by("b", calls))
+    assert (b.snapshot()["entries"], b.snapshot()["max_entries"]) == (2, 2)
+
+
+def test_redis_invalidation_reaches_other_workers(workers):
+    versions, (a, b) = workers
+    calls = []
+    b.get_or_compute(("F32",), computed_by("b", calls))
+
+    versions.current = 2
+    a.invalidate()
+    # Well inside poll_seconds: the other worker hears about it over pub/sub
+    assert wait_for(lambda: b.snapshot()["invalidations_received"] == 1)
+    assert b.get_or_compute(("F32",), computed_by("b", calls)) == {"by": "b"}
+    assert calls == ["b", "b"]
+    assert b.snapshot()["version"] == 2
+
+
+def test_unreachable_redis_degrades_to_computing():
+    pytest.importorskip("redis")
+    backend = RedisBackend("redis://127.0.0.1:1/0")
+    recs = CacheNamespace("recs", backend, version=Versions())
+
+    assert recs.get_or_compute("F32", lambda: 42) == 42
+    assert recs.get_or_compute("F32", lambda: 43) == 42
+    assert backend.snapshot()["errors"] >= 2
+    backend.close()
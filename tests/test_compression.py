@@ -0,0 +1,102 @@
+"""Response compression: encoding negotiation, size and type thresholds, and streamed flushing."""
+import asyncio
+import json
+import zlib
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import compression
+from compression import CompressionMiddleware, choose_encoding
+
+ROWS = [{"id": i, "response_value": "Poorly", "question_type": "sleep_quality"} for i in range(200)]
+
+
+@pytest.mark.parametrize("header, brotli_installed, expected", [
+    ("gzip, deflate, br", True, "br"),
+    ("gzip, deflate, br", False, "gzip"),
+    ("br;q=0, gzip;q=0.5", True, "gzip"),
+    ("gzip;q=0", False, None),
+    ("GZIP", False, "gzip"),
+    ("identity", True, None),
+    ("gzip;q=abc", False, None),
+    ("", True, None),
+])
+def test_choose_encoding(monkeypatch, header, brotli_installed, expected):
+    monkeypatch.setattr(compression, "brotli", object() if brotli_installed else None)
+    assert choose_encoding(header) == expected
+
+
+async def big(request):
+    return JSONResponse(ROWS)
+
+
+async def small(request):
+    return JSONResponse({"ok": True})
+
+
+async def image(request):
+    return Response(b"\x89PNG" + bytes(4096), media_type="image/png")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(compression, "brotli", None)
+    app = Starlette(routes=[Route("/big", big), Route("/small", small), Route("/image", image)])
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+
+def test_large_json_is_gzipped(client):
+    response = client.get("/big", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(json.dumps(ROWS)) / 5
+    assert response.json() == ROWS
+
+
+@pytest.mark.parametrize("path, accept", [("/small", "gzip"), ("/image", "gzip"), ("/big", "identity")])
+def test_small_binary_or_unaccepted_responses_pass_through(client, path, accept):
+    response = client.get(path, headers={"Accept-Encoding": accept})
+
+    assert "content-encoding" not in response.headers
+    assert int(response.headers["content-length"]) == len(response.content)
+
+
+def test_streamed_chunks_are_flushed_as_they_are_produced():
+    async def rows():
+        for row in ROWS[:3]:
+            yield json.dumps(row) + "\n"
+
+    async def app(scope, receive, send):
+        await StreamingResponse(rows(), media_type="application/x-ndjson")(scope, receive, send)
+
+    sent = []
+    requests = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # The client stays connected while the response streams
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", b"gzip")],
+             "query_string": b""}
+    asyncio.run(CompressionMiddleware(app)(scope, receive, send))
+
+    assert (b"content-encoding", b"gzip") in sent[0]["headers"]
+    assert not any(name == b"content-length" for name, _ in sent[0]["headers"])
+    # Each chunk decompresses to its row on its own, before the stream ends
+    decoder = zlib.decompressobj(31)
+    bodies = [message["body"] for message in sent[1:]]
+    for body, row in zip(bodies, ROWS[:3]):
+        assert json.loads(decoder.decompress(body)) == row
+    assert decoder.decompress(b"".join(bodies[3:])) + decoder.flush() == b""
+    assert decoder.eof
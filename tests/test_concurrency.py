@@ -0,0 +1,73 @@
+"""Stress test for several worker processes writing to one SQLite file at once,
+as when main.py runs under gunicorn with several uvicorn workers."""
+import json
+import multiprocessing
+import sqlite3
+import threading
+import uuid
+
+from storage import SQLiteStorage
+
+WORKERS = 4
+THREADS_PER_WORKER = 4
+SESSIONS_PER_THREAD = 10
+
+QUESTIONS = [
+    {"question_type": "mood_scale", "question_text": "How is your mood?", "scale_min": 1, "scale_max": 10},
+    {"question_type": "sleep_quality", "question_text": "How did you sleep?",
+     "options": json.dumps(["Well", "Poorly", "Didn't sleep"])},
+    {"question_type": "open_ended", "question_text": "Anything else?"},
+]
+
+
+def run_worker(path: str, archive_dir: str, worker: int, question_ids: list) -> list:
+    """One worker process: register users and answer sessions from several threads,
+    reading each session back; returns the errors raised"""
+    storage = SQLiteStorage(path, archive_dir=archive_dir)
+    errors = []
+
+    def answer_sessions(thread: int):
+        try:
+            user_id = storage.register_user(f"Worker {worker}.{thread}", f"w{worker}t{thread}@example.com",
+                                            30, "unspecified", str(uuid.uuid4()))
+            for _ in range(SESSIONS_PER_THREAD):
+                session_id = str(uuid.uuid4())
+                answers = dict(zip(question_ids, ["7", "Poorly", "Busy week"]))
+                for question_id, value in answers.items():
+                    storage.insert_response(user_id, question_id, value, None, session_id)
+                if storage.get_session_answers(user_id, session_id) != answers:
+                    errors.append(f"session {session_id} read back incomplete")
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=answer_sessions, args=(t,)) for t in range(THREADS_PER_WORKER)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    storage.close()
+    return errors
+
+
+def test_concurrent_writers_lose_nothing(tmp_path):
+    path = str(tmp_path / "stress.db")
+    archive_dir = str(tmp_path / "archive")
+    storage = SQLiteStorage(path, archive_dir=archive_dir)
+    storage.init_schema()
+    storage.seed_questions(QUESTIONS)
+    question_ids = [q["id"] for q in storage.list_questions()]
+    storage.close()
+
+    # Separate processes, so they contend for the file lock like real workers
+    with multiprocessing.get_context("spawn").Pool(WORKERS) as pool:
+        results = pool.starmap(run_worker, [(path, archive_dir, w, question_ids) for w in range(WORKERS)])
+
+    assert [e for errors in results for e in errors] == []
+    conn = sqlite3.connect(path)
+    try:
+        users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        responses = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    finally:
+        conn.close()
+    assert users == WORKERS * THREADS_PER_WORKER
+    assert responses == WORKERS * THREADS_PER_WORKER * SESSIONS_PER_THREAD * len(QUESTIONS)
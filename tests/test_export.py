@@ -0,0 +1,84 @@
+"""Streaming export encoders and the datasets they are fed from."""
+import io
+import csv
+import json
+
+import pytest
+
+import export
+
+COLUMNS = ["id", "user_id", "session_id", "response_value", "cost_usd", "created_at"]
+
+
+def rows(count: int) -> list:
+    return [{"id": i, "user_id": 7, "session_id": f"s{i % 3}", "response_value": None if i % 2 else f"v,{i}",
+             "cost_usd": i / 100, "created_at": "2025-01-02 03:04:05", "unexported": "x"}
+            for i in range(count)]
+
+
+def test_ndjson_has_one_object_per_row_in_chunks():
+    chunks = list(export.iter_ndjson(rows(export.CHUNK_ROWS + 1), COLUMNS))
+
+    assert len(chunks) == 2
+    lines = b"".join(chunks).decode().splitlines()
+    assert len(lines) == export.CHUNK_ROWS + 1
+    assert json.loads(lines[0]) == {"id": 0, "user_id": 7, "session_id": "s0", "response_value": "v,0",
+                                    "cost_usd": 0.0, "created_at": "2025-01-02 03:04:05"}
+    assert json.loads(lines[1])["response_value"] is None
+
+
+def test_csv_quotes_values_and_writes_the_header_once():
+    chunks = list(export.iter_csv(rows(export.CHUNK_ROWS + 1), COLUMNS))
+
+    assert len(chunks) == 2
+    parsed = list(csv.reader(io.StringIO(b"".join(chunks).decode())))
+    assert parsed[0] == COLUMNS
+    assert len(parsed) == export.CHUNK_ROWS + 2
+    assert parsed[1] == ["0", "7", "s0", "v,0", "0.0", "2025-01-02 03:04:05"]
+    assert parsed[2][3] == ""
+
+
+def test_csv_without_rows_is_just_the_header():
+    assert b"".join(export.iter_csv([], COLUMNS)).decode().splitlines() == [",".join(COLUMNS)]
+
+
+def test_parquet_writes_a_row_group_per_chunk_with_typed_columns():
+    pq = pytest.importorskip("pyarrow.parquet")
+    chunks = list(export.iter_parquet(rows(export.CHUNK_ROWS + 1), COLUMNS))
+
+    # Bytes arrive as each row group is written, not only at the end
+    assert len(chunks) == 3 and all(chunks[:2])
+    parquet = pq.ParquetFile(io.BytesIO(b"".join(chunks)))
+    assert parquet.metadata.num_row_groups == 2
+    assert str(parquet.schema_arrow.field("user_id").type) == "int64"
+    assert str(parquet.schema_arrow.field("cost_usd").type) == "double"
+    table = parquet.read().to_pylist()
+    assert len(table) == export.CHUNK_ROWS + 1
+    assert table[1] == {"id": 1, "user_id": 7, "session_id": "s1", "response_value": None, "cost_usd": 0.01,
+                        "created_at": "2025-01-02 03:04:05"}
+
+
+def test_export_stream_filters_by_user_and_date(storage, questions):
+    sleep = questions["sleep_quality"]["id"]
+    first = storage.register_user("A", "a@example.com", 30, "F", "s-a")
+    second = storage.register_user("B", "b@example.com", 30, "F", "s-b")
+    storage.insert_responses([
+        {"user_id": first, "question_id": sleep, "response_value": "Poorly", "response_text": None,
+         "session_id": "s-a", "created_at": "2025-01-02 10:00:00"},
+        {"user_id": first, "question_id": questions["mood_scale"]["id"], "response_value": "4",
+         "response_text": None, "session_id": "s-old", "created_at": "2024-12-30 10:00:00"},
+        {"user_id": second, "question_id": sleep, "response_value": "Well", "response_text": None,
+         "session_id": "s-b", "created_at": "2025-01-02 10:00:00"},
+    ])
+
+    data = b"".join(export.export_stream(storage, "responses", "ndjson", start_date="2025-01-01",
+                                         user_id=first))
+    exported = [json.loads(line) for line in data.decode().splitlines()]
+    assert [(r["user_id"], r["question_type"], r["response_value"]) for r in exported] == [
+        (first, "sleep_quality", "Poorly")]
+    assert list(exported[0]) == export.COLUMNS["responses"]
+
+    with pytest.raises(ValueError):
+        export.export_stream(storage, "users", "ndjson")
+    with pytest.raises(ValueError):
+        export.export_stream(storage, "responses", "xml")
@@ -0,0 +1,80 @@
+"""Geocoding, geohash cover and radius ranking of clinicians."""
+import math
+import random
+
+import pytest
+
+import geo
+from test_storage import clinician
+
+
+def test_geohash_matches_the_reference_encoding():
+    assert geo.geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geo.geohash_encode(40.71, -74.01) == "dr5reg"
+
+
+def test_geocode_normalizes_city_names_and_falls_back_to_the_state():
+    assert geo.geocode("St. Louis, MO") == geo.geocode("Saint Louis, mo") == (38.63, -90.20)
+    assert geo.geocode("Springfield, IL") == geo.STATE_CENTROIDS["IL"]
+    assert geo.geocode("TX") == geo.STATE_CENTROIDS["TX"]
+    assert geo.geocode("Atlantis, ZZ") is None
+    assert geo.geocode("") is None
+
+
+def test_prefix_range_is_the_next_prefix_in_the_alphabet():
+    assert geo.prefix_range("u4") == ("u4", "u5")
+    assert geo.prefix_range("9z") == ("9z", "b")
+    assert geo.prefix_range("zz") == ("zz", None)
+
+
+def offset(latitude: float, longitude: float, km: float, bearing: float) -> tuple:
+    """The point km away from (latitude, longitude) along bearing (radians)"""
+    d = km / geo.EARTH_RADIUS_KM
+    lat1, lon1 = math.radians(latitude), math.radians(longitude)
+    lat2 = math.asin(math.sin(lat1) * math.cos(d) + math.cos(lat1) * math.sin(d) * math.cos(bearing))
+    lon2 = lon1 + math.atan2(math.sin(bearing) * math.sin(d) * math.cos(lat1),
+                             math.cos(d) - math.sin(lat1) * math.sin(lat2))
+    return math.degrees(lat2), (math.degrees(lon2) + 540) % 360 - 180
+
+
+@pytest.mark.parametrize("latitude, longitude", [(40.71, -74.01), (61.22, -149.90), (0.01, 179.99)])
+@pytest.mark.parametrize("radius_km", [0.5, 8, 80, 400])
+def test_cover_prefixes_contain_every_point_in_the_radius(latitude, longitude, radius_km):
+    prefixes = geo.cover_prefixes(latitude, longitude, radius_km)
+    assert prefixes and len(prefixes) <= 9
+
+    rng = random.Random(0)
+    for _ in range(500):
+        point = offset(latitude, longitude, radius_km * rng.random(), rng.uniform(0, 2 * math.pi))
+        cell = geo.geohash_encode(*point)
+        assert any(cell.startswith(prefix) for prefix in prefixes), (point, cell)
+
+
+def test_cover_prefixes_give_up_on_a_continental_radius():
+    assert geo.cover_prefixes(40.71, -74.01, 20000) is None
+
+
+def test_nearest_clinicians_come_first_within_the_radius(storage):
+    storage.upsert_clinicians([
+        clinician("PHL", location="Philadelphia, PA"),
+        clinician("BKN-LOW", location="Brooklyn, NY", rating=3.0),
+        clinician("NYC", location="New York, NY"),
+        clinician("NWK", location="Newark, NJ"),
+        clinician("BKN-HIGH", location="Brooklyn, NY", rating=4.9),
+        clinician("LAX", location="Los Angeles, CA"),
+    ])
+    new_york = geo.geocode("New York, NY")
+
+    nearby = storage.find_clinicians_near(*new_york, 50)
+    # Same distance breaks ties by rating
+    assert [c["license_number"] for c in nearby] == ["NYC", "BKN-HIGH", "BKN-LOW", "NWK"]
+    assert nearby[0]["distance_km"] == pytest.approx(0, abs=0.01)
+    assert all(a["distance_km"] <= b["distance_km"] for a, b in zip(nearby, nearby[1:]))
+
+    # A limit widens the search only as far as it needs to, and fields= still ranks by distance
+    assert [c["license_number"] for c in storage.find_clinicians_near(*new_york, 200, limit=5)] == [
+        "NYC", "BKN-HIGH", "BKN-LOW", "NWK", "PHL"]
+    nearest = storage.find_clinicians_near(*new_york, 200, limit=1, fields=["license_number"])
+    assert [set(c) for c in nearest] == [{"license_number", "distance_km"}]
+    assert nearest[0]["license_number"] == "NYC"
+    assert len(storage.find_clinicians_near(*new_york, 5000)) == 6
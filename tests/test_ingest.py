@@ -0,0 +1,66 @@
+"""Clinician feed ingestion: bad rows are reported without aborting the load."""
+import io
+import json
+
+import pytest
+
+import ingest
+
+
+def feed_row(license_number: str) -> dict:
+    return {"name": "Dr. Emily Johnson", "specialty": "Family Therapy", "location": "Chicago, IL",
+            "license_number": license_number, "specializes_in": ["F32", "F41.1"], "rating": 4.5}
+
+
+def parsed(text: str, read_size: int) -> list:
+    rows = ingest.iter_json_rows(io.StringIO(text), read_size=read_size)
+    return [row["license_number"] if isinstance(row, dict) else "malformed" for row in rows]
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 65536])
+def test_malformed_json_rows_are_skipped_to_the_next_row(read_size):
+    lines = [json.dumps(feed_row("L1")), '{"license_number": "L2" "name": "x"}',
+             json.dumps(feed_row("L3")), '{"license_number": tru', json.dumps(feed_row("L5"))]
+    assert parsed("\n".join(lines) + "\n", read_size) == ["L1", "malformed", "L3", "malformed", "L5"]
+
+    pretty = json.dumps([feed_row("L1"), feed_row("L2"), feed_row("L3")], indent=2).replace('"L2"', '"L2" oops')
+    assert parsed(pretty, read_size) == ["L1", "malformed", "L3"]
+
+    one_line = "[" + ",".join([json.dumps(feed_row("L1")), '{"license_number": "L2",}', json.dumps(feed_row("L3"))]) + "]"
+    assert parsed(one_line, read_size) == ["L1", "malformed", "L3"]
+
+
+def test_oversized_row_is_rejected_without_buffering_the_feed():
+    text = '{"license_number": "' + "x" * 5000 + "\n" + json.dumps(feed_row("L2")) + "\n"
+    rows = ingest.iter_json_rows(io.StringIO(text), read_size=256, max_row_chars=1000)
+    assert [row["license_number"] if isinstance(row, dict) else "malformed" for row in rows] == ["malformed", "L2"]
+
+
+def test_ingest_reports_malformed_rows_and_loads_the_rest(storage):
+    text = "\n".join([json.dumps(feed_row("L1")), "{not json}", json.dumps(feed_row("L3")),
+                      json.dumps({**feed_row("L4"), "rating": 9})])
+    report = ingest.ingest_clinicians(storage, io.StringIO(text), "json", chunk_size=1)
+
+    assert (report["processed"], report["upserted"], report["rejected"]) == (4, 2, 2)
+    assert [(e["row"], e["error"].split(":")[0]) for e in report["errors"]] == [
+        (2, "malformed JSON"), (4, "rating must be a number between 0 and 5")]
+    assert sorted(c["license_number"] for c in storage.list_clinicians()) == ["L1", "L3"]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "json"])
+def test_rows_that_are_not_utf8_are_rejected(storage, fmt):
+    names = ["Dr. Emily Johnson", "Dr. Jos\xe9 Garc\xeda", "Dr. Maria Garcia"]
+    if fmt == "csv":
+        header = [b"name,specialty,location,license_number"]
+        rows = [f'{name},Family Therapy,"Chicago, IL",L{i}' for i, name in enumerate(names, start=1)]
+    else:
+        header = []
+        rows = [json.dumps({**feed_row(f"L{i}"), "name": name}, ensure_ascii=False)
+                for i, name in enumerate(names, start=1)]
+    # The middle row is Latin-1, the rest UTF-8
+    data = b"\n".join(header + [row.encode("latin-1" if i == 1 else "utf-8") for i, row in enumerate(rows)])
+    report = ingest.ingest_clinicians(storage, ingest.open_text(io.BytesIO(data)), fmt)
+
+    assert (report["processed"], report["upserted"], report["rejected"]) == (3, 2, 1)
+    assert report["errors"] == [{"row": 2, "license_number": "L2", "error": "row is not valid UTF-8"}]
+    assert sorted(c["license_number"] for c in storage.list_clinicians()) == ["L1", "L3"]
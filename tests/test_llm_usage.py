@@ -0,0 +1,93 @@
+"""OpenAI cost accounting, budget-aware model routing and the daily usage report."""
+import uuid
+
+import pytest
+
+import llm_usage
+from llm_usage import LLMRouter
+
+
+class Spend:
+    """Stands in for Storage.llm_spend_since"""
+
+    def __init__(self, spent: float = 0.0):
+        self.spent = spent
+        self.reads = 0
+
+    def __call__(self, since: str) -> float:
+        assert since == llm_usage.today()
+        self.reads += 1
+        return self.spent
+
+
+def router(spend, **kwargs) -> LLMRouter:
+    return LLMRouter(spend, primary_model="gpt-4o", economy_model="gpt-4o-mini", refresh_seconds=3600, **kwargs)
+
+
+def test_call_cost_uses_the_price_table():
+    assert llm_usage.call_cost("gpt-4o-mini", 1_000_000, 1_000_000) == 0.75
+    assert llm_usage.call_cost("gpt-4o", 1000, None) == 0.0025
+    assert llm_usage.call_cost("unknown-model", 1000, 1000) is None
+    assert llm_usage.call_cost("gpt-4o", None, None) is None
+
+
+def test_max_tokens_grow_with_the_session_within_bounds():
+    routes = router(Spend(), min_tokens=400, tokens_per_answer=40, max_tokens=1000)
+    assert [routes.route("prompt", answers)["max_tokens"] for answers in (0, 5, 100)] == [400, 600, 1000]
+    assert routes.route("prompt", 5) == {"model": "gpt-4o", "max_tokens": 600, "reason": "default"}
+
+
+def test_small_sessions_go_to_the_economy_model():
+    routes = router(Spend(), economy_prompt_tokens=50)
+    assert routes.route("x" * 100, 3)["reason"] == "small_session"
+    assert routes.route("x" * 400, 3)["model"] == "gpt-4o"
+
+
+def test_budget_switches_to_economy_then_stops_calls():
+    spend = Spend(7.0)
+    routes = router(spend, daily_budget=10.0, economy_fraction=0.8)
+    assert routes.route("prompt", 3)["model"] == "gpt-4o"
+
+    # This worker's own calls count at once, without re-reading the database
+    routes.record({"model": "gpt-4o", "prompt_tokens": 1000, "completion_tokens": 500, "cost_usd": 1.5})
+    assert routes.route("prompt", 3) == {"model": "gpt-4o-mini", "max_tokens": 520, "reason": "budget"}
+    routes.record({"model": "gpt-4o-mini", "prompt_tokens": 1000, "completion_tokens": 500, "cost_usd": 1.5})
+    assert routes.route("prompt", 3) is None
+
+    stats = routes.snapshot()
+    assert spend.reads == 1
+    assert (stats["spend_today_usd"], stats["routed_economy"], stats["budget_skipped"]) == (10.0, 1, 1)
+    assert stats["by_model"]["gpt-4o"] == {"calls": 1, "tokens": 1500, "cost_usd": 1.5}
+
+
+def test_daily_report_groups_by_day_and_model_with_percentiles(storage):
+    user_id = storage.register_user("A", "a@example.com", 30, "F", str(uuid.uuid4()))
+    session_id = str(uuid.uuid4())
+    for latency in range(10, 210, 10):
+        storage.insert_analysis(user_id, session_id, {"usage": {
+            "model": "gpt-4o-mini", "prompt_tokens": 100, "completion_tokens": 50, "latency_ms": latency,
+            "cost_usd": 0.001}}, [], "v1")
+    storage.insert_analysis(user_id, session_id, {"usage": {"model": "gpt-4o", "latency_ms": 30000}}, [], "v1")
+    # Rules and fallback analyses made no call and are left out
+    storage.insert_analysis(user_id, session_id, {"tier": "rules"}, [], "v1")
+
+    def set_days(cursor):
+        storage.execute(cursor, "UPDATE analysis_results SET created_at = ? WHERE llm_model = ?",
+                        ("2025-01-01 12:00:00", "gpt-4o-mini"))
+        storage.execute(cursor, "UPDATE analysis_results SET created_at = ? WHERE llm_model = ?",
+                        ("2025-01-02 12:00:00", "gpt-4o"))
+    storage.write(set_days)
+
+    mini, failed = llm_usage.daily_report(storage)
+    assert mini == {"day": "2025-01-01", "model": "gpt-4o-mini", "calls": 20, "failed": 0, "prompt_tokens": 2000,
+                    "completion_tokens": 1000, "cost_usd": 0.02, "latency_p50_ms": 100.0,
+                    "latency_p95_ms": 190.0, "latency_max_ms": 200.0}
+    assert (failed["day"], failed["calls"], failed["failed"], failed["latency_p95_ms"]) == (
+        "2025-01-02", 1, 1, 30000.0)
+    assert [row["day"] for row in llm_usage.daily_report(storage, start_date="2025-01-02")] == ["2025-01-02"]
+    assert llm_usage.daily_report(storage, end_date="2024-12-31") == []
+
+
+@pytest.mark.parametrize("fraction, expected", [(0.5, 2.0), (0.95, 4.0), (0.0, 1.0)])
+def test_percentile_is_nearest_rank(fraction, expected):
+    assert llm_usage._percentile([1.0, 2.0, 3.0, 4.0], fraction) == expected
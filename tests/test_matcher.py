@@ -0,0 +1,78 @@
+"""TF-IDF matching of session free text to clinician profiles."""
+import json
+
+from matcher import ClinicianMatcher, clinician_profile, tokenize
+
+CLINICIANS = [
+    {"id": 1, "specialty": "Depression Counseling", "specializes_in": json.dumps(["F32", "F33"])},
+    {"id": 2, "specialty": "Anxiety and Panic", "specializes_in": json.dumps(["F41", "F40"])},
+    {"id": 3, "specialty": "Trauma Therapy", "specializes_in": json.dumps(["F43"])},
+    {"id": 4, "specialty": "Eating Disorders", "specializes_in": json.dumps(["F50"])},
+]
+
+
+class Clinicians:
+    """Stands in for storage.list_clinicians and the clinician data version"""
+
+    def __init__(self, clinicians):
+        self.clinicians = clinicians
+        self.current = 1
+
+    def load(self):
+        return self.clinicians
+
+    def version(self) -> int:
+        return self.current
+
+
+def word(number: int) -> str:
+    """A distinct all-letter token for each number"""
+    return "".join(chr(ord("a") + int(digit)) for digit in f"{number:06d}")
+
+
+def ranked(matcher, text: str) -> list:
+    scores = matcher.similarities(text)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def test_tokenize_drops_stop_words_and_suffixes():
+    assert tokenize("I am feeling really hopeless and worried") == ["feel", "hopeles", "worri"]
+
+
+def test_free_text_ranks_the_matching_specialty_first():
+    data = Clinicians(CLINICIANS)
+    matcher = ClinicianMatcher(data.load, version=data.version)
+
+    assert ranked(matcher, "I feel hopeless and sad, crying most days")[0] == 1
+    assert ranked(matcher, "constant worry, my thoughts are racing and I panic in crowds")[0] == 2
+    assert ranked(matcher, "overwhelmed at work since the loss, burnout")[0] == 3
+    scores = matcher.similarities("hopeless")
+    assert set(scores) == {1} and 0 < scores[1] <= 1
+    assert matcher.similarities("") == {}
+    assert matcher.similarities("nothing here overlaps whatsoever") == {}
+
+
+def test_index_is_rebuilt_when_the_clinician_version_moves():
+    data = Clinicians(CLINICIANS[:1])
+    matcher = ClinicianMatcher(data.load, version=data.version)
+    assert matcher.similarities("binge eating") == {}
+
+    data.clinicians, data.current = CLINICIANS, 2
+    assert ranked(matcher, "binge eating") == [4]
+    assert matcher.snapshot()["version"] == 2
+
+
+def test_matrix_memory_grows_with_profile_terms_not_vocabulary():
+    # Every clinician adds a term of their own, so the vocabulary grows with the roster
+    clinicians = [{"id": i, "specialty": f"Counseling {word(i)}", "specializes_in": json.dumps(["F32", "F41"])}
+                  for i in range(20000)]
+    data = Clinicians(clinicians)
+    matcher = ClinicianMatcher(data.load, version=data.version)
+
+    assert ranked(matcher, f"hopeless {word(12345)}")[0] == 12345
+    stats = matcher.snapshot()
+    assert stats["vocabulary"] > 20000
+    terms = len(set(tokenize(clinician_profile(clinicians[0]))))
+    assert stats["matrix_bytes"] == len(clinicians) * (terms * 8 + 4) + 4
+    # A dense matrix would need clinicians x vocabulary float32s, about 1.6 GB here
+    assert stats["matrix_bytes"] < len(clinicians) * stats["vocabulary"] * 4 / 100
@@ -0,0 +1,85 @@
+"""Batch re-analysis: checkpointed batches that resume where an interrupted run stopped."""
+import uuid
+
+import reanalyze
+import rules
+
+OLD = "2024-01-01 09:00:00"
+
+
+def add_sessions(storage, questions, count: int) -> list:
+    """Idle sessions the rules cannot settle on their own, so each goes to the LLM"""
+    user_id = storage.register_user("A", "a@example.com", 30, "F", str(uuid.uuid4()))
+    mood = questions["mood_scale"]["id"]
+    sessions = [str(uuid.uuid4()) for _ in range(count)]
+    storage.insert_responses([{"user_id": user_id, "question_id": mood, "response_value": "4",
+                               "response_text": None, "session_id": session_id, "created_at": OLD}
+                              for session_id in sessions])
+    return [(user_id, session_id) for session_id in sessions]
+
+
+class LLM:
+    """Stands in for analyze_responses_with_openai, falling back for sessions in unavailable_for"""
+
+    def __init__(self):
+        self.analyzed = []
+        self.unavailable_for = set()
+
+    def __call__(self, responses):
+        key = (responses[0]["user_id"], responses[0]["session_id"])
+        self.analyzed.append(key)
+        tier = rules.TIER_FALLBACK if key in self.unavailable_for else rules.TIER_LLM
+        return {"tier": tier, "risk_level": "Moderate", "overall_score": 55, "conditions": []}
+
+
+def run(storage, llm, **kwargs) -> dict:
+    return reanalyze.run(storage, llm, lambda conditions, text: [], "v1", concurrency=2, **kwargs)
+
+
+def test_interrupted_run_resumes_after_the_checkpoint(storage, questions):
+    sessions = add_sessions(storage, questions, 5)
+    llm = LLM()
+
+    first = run(storage, llm, batch_size=2, limit=3)
+    assert (first["processed"], first["llm"], first["complete"]) == (3, 3, False)
+    checkpoint = storage.get_checkpoint(reanalyze.CHECKPOINT_NAME)
+    assert checkpoint["version"] == "v1"
+
+    second = run(storage, llm, batch_size=2)
+    assert second["resumed_after"] == checkpoint["after"]
+    assert (second["processed"], second["complete"]) == (2, True)
+    # Every session analyzed exactly once across the two runs, and the checkpoint cleared
+    assert sorted(llm.analyzed) == sorted(sessions)
+    assert storage.get_checkpoint(reanalyze.CHECKPOINT_NAME) is None
+    assert all(storage.get_latest_analysis(*key)["analysis_version"] == "v1" for key in sessions)
+
+    assert run(storage, llm)["processed"] == 0
+
+
+def test_fallback_sessions_are_left_for_the_next_run(storage, questions):
+    sessions = add_sessions(storage, questions, 3)
+    llm = LLM()
+    llm.unavailable_for = {sessions[1]}
+
+    report = run(storage, llm)
+    assert (report["processed"], report["llm"], report["deferred"]) == (3, 2, 1)
+    assert storage.get_latest_analysis(*sessions[1]) is None
+
+    llm.unavailable_for = set()
+    llm.analyzed = []
+    assert run(storage, llm)["llm"] == 1
+    assert llm.analyzed == [sessions[1]]
+
+
+def test_checkpoint_from_another_version_or_restart_is_ignored(storage, questions):
+    sessions = add_sessions(storage, questions, 2)
+    storage.save_checkpoint(reanalyze.CHECKPOINT_NAME, {"version": "v0", "after": list(max(sessions))})
+
+    llm = LLM()
+    report = run(storage, llm)
+    assert report["resumed_after"] is None
+    assert sorted(llm.analyzed) == sorted(sessions)
+
+    storage.save_checkpoint(reanalyze.CHECKPOINT_NAME, {"version": "v2", "after": list(max(sessions))})
+    report = reanalyze.run(storage, llm, lambda conditions, text: [], "v2", restart=True)
+    assert (report["resumed_after"], report["processed"]) == (None, 2)
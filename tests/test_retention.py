@@ -0,0 +1,105 @@
+"""Retention for the SQLite backend: closed sessions move to monthly archive files."""
+import os
+import threading
+import uuid
+
+import pytest
+
+import retention
+from conftest import QUESTIONS
+from storage import SQLiteStorage
+
+OLD = "2020-03-14 09:00:00"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    """Retention only applies to SQLite, so these tests do not run against PostgreSQL"""
+    backend = SQLiteStorage(str(tmp_path / "live.db"), archive_dir=str(tmp_path / "archive"))
+    backend.init_schema()
+    backend.seed_questions(QUESTIONS)
+    yield backend
+    backend.close()
+
+
+def add_session(storage, user_id: int, created_at: str, session_id=None) -> str:
+    session_id = session_id if session_id is not None else str(uuid.uuid4())
+    rows = [{"user_id": user_id, "question_id": q["id"], "response_value": value, "response_text": None,
+             "session_id": session_id, "created_at": created_at}
+            for q, value in zip(storage.list_questions(), ["4", "Poorly"])]
+    storage.insert_responses(rows)
+    return session_id
+
+
+def archive_with_timeout(storage, **kwargs) -> int:
+    """Run archive_closed_sessions, failing rather than hanging if it never finishes"""
+    result = []
+    worker = threading.Thread(target=lambda: result.append(retention.archive_closed_sessions(storage, **kwargs)),
+                              daemon=True)
+    worker.start()
+    worker.join(timeout=10)
+    assert result, "archive_closed_sessions did not finish"
+    return result[0]
+
+
+def test_closed_sessions_move_to_the_archive_and_stay_readable(storage):
+    user_id = storage.register_user("A", "a@example.com", 30, "F", str(uuid.uuid4()))
+    closed = add_session(storage, user_id, OLD)
+    storage.insert_analysis(user_id, closed, {"risk_level": "Low"}, [], "v1")
+    storage.write(lambda cursor: cursor.execute("UPDATE analysis_results SET created_at = ?", (OLD,)))
+    open_session = add_session(storage, user_id, "2999-01-01 00:00:00")
+
+    assert archive_with_timeout(storage, max_age_days=30, batch_size=1) == 1
+
+    assert os.path.exists(storage.archive_path("2020_03"))
+    with storage.read() as cursor:
+        cursor.execute("SELECT DISTINCT session_id FROM responses")
+        assert [row["session_id"] for row in cursor.fetchall()] == [open_session]
+        cursor.execute("SELECT COUNT(*) AS n FROM analysis_results")
+        assert cursor.fetchone()["n"] == 0
+    archived = storage.get_session_responses(user_id, closed)
+    assert [(r["session_id"], r["response_value"]) for r in archived] == [(closed, "4"), (closed, "Poorly")]
+
+    # A second pass has nothing left to do
+    assert archive_with_timeout(storage, max_age_days=30) == 0
+
+
+def test_recent_analysis_or_edit_keeps_a_session_live(storage):
+    user_id = storage.register_user("A", "a@example.com", 30, "F", str(uuid.uuid4()))
+    analyzed = add_session(storage, user_id, OLD)
+    storage.insert_analysis(user_id, analyzed, {"risk_level": "Low"}, [], "v1")
+    edited = add_session(storage, user_id, OLD)
+    mood = storage.list_questions()[0]["id"]
+    storage.insert_responses([{"user_id": user_id, "question_id": mood, "response_value": "9",
+                               "response_text": None, "session_id": edited, "created_at": "2999-01-01 00:00:00"}])
+
+    assert storage.find_closed_sessions(30) == []
+
+
+def test_answers_without_a_session_are_left_alone(storage):
+    user_id = storage.register_user("A", "a@example.com", 30, "F", str(uuid.uuid4()))
+    mood = storage.list_questions()[0]["id"]
+    storage.write(lambda cursor: cursor.execute(
+        "INSERT INTO responses (user_id, question_id, response_value, session_id, created_at) VALUES (?, ?, ?, NULL, ?)",
+        (user_id, mood, "4", OLD)))
+    closed = add_session(storage, user_id, OLD)
+
+    # A batch of one would keep returning the legacy row if it were selected
+    assert archive_with_timeout(storage, max_age_days=30, batch_size=1) == 1
+    with storage.read() as cursor:
+        cursor.execute("SELECT session_id FROM responses")
+        assert [row["session_id"] for row in cursor.fetchall()] == [None]
+    assert storage.get_session_responses(user_id, closed)
+
+
+def test_incremental_vacuum_returns_free_pages(storage):
+    user_id = storage.register_user("A", "a@example.com", 30, "F", str(uuid.uuid4()))
+    for _ in range(50):
+        add_session(storage, user_id, OLD)
+    archive_with_timeout(storage, max_age_days=30)
+
+    with storage.read() as cursor:
+        assert cursor.execute("PRAGMA freelist_count").fetchone()["freelist_count"] > 0
+    storage.incremental_vacuum()
+    with storage.read() as cursor:
+        assert cursor.execute("PRAGMA freelist_count").fetchone()["freelist_count"] == 0
@@ -0,0 +1,80 @@
+"""Streaming risk signals: which answers raise them and which alert rules they complete."""
+import risk
+
+
+def test_answer_signals_follow_the_signal_table():
+    assert risk.answer_signals("mood_scale", "3") == ["very_low_mood"]
+    assert risk.answer_signals("mood_scale", "4") == []
+    assert risk.answer_signals("mood_scale", "not a number") == []
+    assert risk.answer_signals("stress_scale", "10") == ["extreme_stress"]
+    # Crisis language counts on any question, in the value or the follow-up text
+    assert risk.answer_signals("gratitude", "nothing", "some days I want to die") == ["crisis_language"]
+    assert risk.answer_signals("mood_scale", "2", "I keep thinking about suicide") == ["crisis_language",
+                                                                                       "very_low_mood"]
+
+
+def rules_of(alerts) -> list:
+    return sorted(alert["rule"] for alert in alerts)
+
+
+def test_alert_fires_when_the_new_signal_completes_a_rule():
+    session = {1: ["very_low_mood"], 7: ["negative_thoughts"]}
+    alerts = risk.completed_alerts(session, ["negative_thoughts"])
+
+    assert alerts == [{"rule": "negative_thoughts_low_mood", "severity": "high",
+                       "signals": ["negative_thoughts", "very_low_mood"]}]
+
+
+def test_one_signal_can_complete_several_rules_once_each():
+    session = {1: ["very_low_mood"], 2: ["extreme_stress"], 3: ["no_sleep"]}
+    alerts = risk.completed_alerts(session, ["very_low_mood", "very_low_mood"])
+
+    assert rules_of(alerts) == ["low_mood_extreme_stress", "low_mood_no_sleep"]
+
+
+def test_rules_not_involving_the_new_signals_are_not_reported_again():
+    # The session already met negative_thoughts_low_mood; a new no_sleep signal only adds its own rule
+    session = {1: ["very_low_mood"], 7: ["negative_thoughts"], 3: ["no_sleep"]}
+    assert rules_of(risk.completed_alerts(session, ["no_sleep"])) == ["low_mood_no_sleep"]
+    assert risk.completed_alerts(session, []) == []
+
+
+def test_incomplete_rules_do_not_fire():
+    assert risk.completed_alerts({7: ["negative_thoughts"]}, ["negative_thoughts"]) == []
+    # A signal the changed answer no longer raises is not in the session any more
+    assert risk.completed_alerts({1: [], 7: ["negative_thoughts"]}, ["negative_thoughts"]) == []
+
+
+class Signals:
+    """Stands in for the session_risk_signals storage methods"""
+
+    def __init__(self):
+        self.by_question = {}
+        self.writes = 0
+
+    def list_questions(self):
+        return [{"id": 1, "question_type": "mood_scale"}, {"id": 7, "question_type": "negative_thoughts"}]
+
+    def get_risk_signals(self, user_id, session_id):
+        return dict(self.by_question)
+
+    def save_risk_signals(self, user_id, session_id, question_id, signals, alerts_for):
+        self.writes += 1
+        self.by_question[question_id] = signals
+        return alerts_for(dict(self.by_question))
+
+
+def test_evaluator_writes_only_when_an_answer_changes_its_signals():
+    storage = Signals()
+    evaluator = risk.RiskEvaluator(storage)
+
+    assert evaluator.evaluate(1, "s", 1, "2") == []
+    assert evaluator.evaluate(1, "s", 1, "3") == []
+    assert rules_of(evaluator.evaluate(1, "s", 7, "Yes")) == ["negative_thoughts_low_mood"]
+    # Raising mood clears its signal and answering it low again completes the rule again;
+    # the outbox that keeps it to one alert per session is covered in test_storage.py
+    assert evaluator.evaluate(1, "s", 1, "8") == []
+    assert rules_of(evaluator.evaluate(1, "s", 1, "1")) == ["negative_thoughts_low_mood"]
+
+    assert storage.writes == 4
+    assert evaluator.snapshot() == {"answers": 5, "state_writes": 4, "alerts": 2}
@@ -0,0 +1,75 @@
+"""Local rule tiers and the offline comparison with stored LLM analyses."""
+import json
+
+import pytest
+
+import rules
+
+
+def answers(**values) -> list:
+    return [{"question_type": question_type, "response_value": value, "response_text": None}
+            for question_type, value in values.items()]
+
+
+CLEAR_CUT = answers(mood_scale="8", stress_scale="3", sleep_quality="Very well", energy_level="High",
+                    negative_thoughts="No")
+
+
+def test_clear_cut_session_stays_local():
+    decision = rules.evaluate(CLEAR_CUT)
+
+    assert decision["tier"] == rules.TIER_RULES
+    assert decision["confidence"] >= rules.MIN_CONFIDENCE
+    assert decision["analysis"]["risk_level"] == "Low"
+    assert decision["analysis"]["conditions"] == []
+
+
+@pytest.mark.parametrize("responses, high_risk", [
+    (answers(mood_scale="1", stress_scale="3", sleep_quality="Very well", energy_level="High",
+             negative_thoughts="No"), ["mood_scale"]),
+    (answers(mood_scale="8", stress_scale="3", sleep_quality="Very well", energy_level="High",
+             negative_thoughts="Yes"), ["negative_thoughts"]),
+    (CLEAR_CUT + [{"question_type": "open_ended", "response_value": "sometimes I want to die",
+                   "response_text": None}], ["open_ended"]),
+])
+def test_high_risk_answers_go_to_the_llm(responses, high_risk):
+    decision = rules.evaluate(responses)
+
+    assert decision["tier"] == rules.TIER_LLM
+    assert decision["high_risk"] == high_risk
+
+
+def test_incomplete_or_mixed_sessions_go_to_the_llm():
+    assert rules.evaluate(answers(mood_scale="8"))["tier"] == rules.TIER_LLM
+    mixed = rules.evaluate(answers(mood_scale="4", stress_scale="3", sleep_quality="Very well",
+                                   energy_level="Low", negative_thoughts="No"))
+    assert mixed["confidence"] < rules.MIN_CONFIDENCE
+    assert mixed["tier"] == rules.TIER_LLM
+    assert rules.evaluate(CLEAR_CUT, min_confidence=1.01)["tier"] == rules.TIER_LLM
+
+
+class StoredAnalyses:
+    """Stands in for the two storage methods evaluate_stored reads"""
+
+    def __init__(self, scores):
+        self.rows = [{"user_id": 1, "session_id": f"s{i}",
+                      "conditions": json.dumps({"tier": rules.TIER_LLM, "risk_level": "Low", "conditions": [],
+                                                "overall_score": score})}
+                     for i, score in enumerate(scores)]
+
+    def iter_export(self, dataset):
+        assert dataset == "analyses"
+        return iter(self.rows)
+
+    def get_session_responses(self, user_id, session_id):
+        return CLEAR_CUT
+
+
+def test_evaluate_stored_parses_scores_the_llm_wrote_as_text():
+    local = rules.evaluate(CLEAR_CUT)["analysis"]["overall_score"]
+    report = rules.evaluate_stored(StoredAnalyses([local - 10, f"{local - 20}%", "high", None]))
+
+    assert (report["evaluated"], report["kept_local"], report["risk_level_agreement"]) == (4, 4, 1.0)
+    # Only the two numeric scores count towards the mean
+    assert report["mean_score_difference"] == 15.0
+    assert rules.evaluate_stored(StoredAnalyses(["high"]))["mean_score_difference"] is None
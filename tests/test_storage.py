@@ -0,0 +1,413 @@
+"""Repository behaviour that every storage backend must share (see conftest.py)."""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+import pytest
+
+import risk
+from storage import IntegrityError, PostgresStorage, SQLiteStorage, Storage
+
+
+def clinician(license_number: str, **overrides) -> dict:
+    row = {
+        "name": "Dr. Sarah Mitchell",
+        "specialty": "Clinical Psychology",
+        "location": "New York, NY",
+        "phone": "212-555-0101",
+        "email": "sarah.mitchell@example.com",
+        "website": "www.example.com",
+        "license_number": license_number,
+        "specializes_in": json.dumps(["F32", "F41"]),
+        "rating": 4.8,
+        "years_experience": 12,
+        "accepts_insurance": True,
+        "online_sessions": True,
+    }
+    row.update(overrides)
+    return row
+
+
+def new_user(storage, email: str = "a@example.com") -> tuple:
+    session_id = str(uuid.uuid4())
+    return storage.register_user("A", email, 30, "F", session_id), session_id
+
+
+def test_a_driver_must_provide_every_hook():
+    class Partial(Storage):
+        def init_schema(self):
+            pass
+
+    with pytest.raises(TypeError, match="_run_transaction"):
+        Partial()
+    assert not SQLiteStorage.__abstractmethods__ and not PostgresStorage.__abstractmethods__
+
+
+def test_register_user_rejects_duplicate_email(storage):
+    user_id, _ = new_user(storage)
+    assert isinstance(user_id, int)
+    with pytest.raises(IntegrityError):
+        new_user(storage)
+
+
+def test_answers_read_back_as_submitted(storage, questions):
+    user_id, session_id = new_user(storage)
+    answers = {
+        questions["mood_scale"]["id"]: "3",
+        questions["sleep_quality"]["id"]: "Didn't sleep",
+        questions["open_ended"]["id"]: "text_response",
+    }
+    for question_id, value in answers.items():
+        assert storage.insert_response(user_id, question_id, value, "work and money", session_id)
+
+    assert storage.get_session_answers(user_id, session_id) == answers
+    responses = storage.get_session_responses(user_id, session_id, fields=["session_id", "question_type", "response_value"])
+    assert [r["response_value"] for r in responses] == list(answers.values())
+    assert {r["session_id"] for r in responses} == {session_id}
+
+
+def test_answering_again_replaces_the_answer(storage, questions):
+    user_id, session_id = new_user(storage)
+    question_id = questions["sleep_quality"]["id"]
+    storage.insert_response(user_id, question_id, "Well", None, session_id)
+    storage.insert_response(user_id, question_id, "Poorly", None, session_id)
+
+    responses = storage.get_session_responses(user_id, session_id)
+    assert [r["response_value"] for r in responses] == ["Poorly"]
+
+
+def stored_answers(storage, user_id: int) -> dict:
+    """question_id -> (value_code, response_value) as the rows hold them"""
+    def read(cursor):
+        storage.execute(cursor, "SELECT question_id, value_code, response_value FROM responses WHERE user_id = ?",
+                        (user_id,))
+        return {row["question_id"]: (row["value_code"], row["response_value"]) for row in cursor.fetchall()}
+    return storage.write(read)
+
+
+def test_choice_and_scale_answers_are_stored_as_codes(storage, questions):
+    user_id, session_id = new_user(storage)
+    mood, sleep, open_ended = (questions[t]["id"] for t in ("mood_scale", "sleep_quality", "open_ended"))
+    answers = {mood: "-3", sleep: "Poorly", open_ended: "7"}
+    for question_id, value in answers.items():
+        storage.insert_response(user_id, question_id, value, None, session_id)
+
+    assert stored_answers(storage, user_id) == {mood: (-3, ""), sleep: (2, ""), open_ended: (None, "7")}
+    assert storage.get_session_answers(user_id, session_id) == answers
+
+    # Values without a code keep their text, so they read back exactly as sent
+    storage.insert_response(user_id, mood, "07", None, session_id)
+    storage.insert_response(user_id, sleep, "Not sure", None, session_id)
+    assert stored_answers(storage, user_id)[mood] == (None, "07")
+    assert storage.get_session_answers(user_id, session_id) == {mood: "07", sleep: "Not sure", open_ended: "7"}
+
+
+def test_session_ids_read_back_exactly(storage, questions):
+    question_id = questions["sleep_quality"]["id"]
+    for session_id in (str(uuid.uuid4()), str(uuid.uuid4()).upper(), "legacy-session"):
+        user_id = storage.register_user("A", f"{session_id}@example.com", 30, "F", session_id)
+        storage.insert_response(user_id, question_id, "Well", None, session_id)
+        responses = storage.get_session_responses(user_id, session_id, fields=["session_id"])
+        assert [r["session_id"] for r in responses] == [session_id]
+        assert storage.get_session_answers(user_id, session_id) == {question_id: "Well"}
+    if isinstance(storage, SQLiteStorage):
+        def kinds(cursor):
+            storage.execute(cursor, "SELECT typeof(session_id) AS kind FROM responses ORDER BY id")
+            return [row["kind"] for row in cursor.fetchall()]
+        # Only the canonical UUID form is packed into 16 bytes
+        assert storage.write(kinds) == ["blob", "text", "text"]
+
+
+def test_migration_encodes_rows_written_before_compact_storage(storage, questions):
+    user_id, session_id = new_user(storage)
+    mood, sleep, open_ended = (questions[t]["id"] for t in ("mood_scale", "sleep_quality", "open_ended"))
+    answers = {mood: "8", sleep: "Didn't sleep", open_ended: "Poorly"}
+
+    def downgrade(cursor):
+        storage.execute(cursor, "ALTER TABLE responses DROP COLUMN value_code")
+        storage.executemany(cursor, """
+            INSERT INTO responses (user_id, question_id, response_value, session_id, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(user_id, question_id, value, session_id, "2024-01-01 09:00:00")
+              for question_id, value in answers.items()])
+    storage.write(downgrade)
+    storage.init_schema()
+
+    assert stored_answers(storage, user_id) == {mood: (8, ""), sleep: (3, ""), open_ended: (None, "Poorly")}
+    assert storage.get_session_answers(user_id, session_id) == answers
+    if isinstance(storage, SQLiteStorage):
+        def kinds(cursor):
+            storage.execute(cursor, "SELECT DISTINCT typeof(session_id) AS kind FROM responses")
+            return [row["kind"] for row in cursor.fetchall()]
+        assert storage.write(kinds) == ["blob"]
+
+
+def answer_at(storage, user_id: int, session_id: str, question_id: int, value: str, at: str):
+    storage.insert_responses([{"user_id": user_id, "question_id": question_id, "response_value": value,
+                               "response_text": None, "session_id": session_id, "created_at": at}])
+
+
+def test_changed_answer_keeps_its_place_and_is_reanalyzed(storage, questions):
+    user_id, session_id = new_user(storage)
+    mood, sleep = questions["mood_scale"]["id"], questions["sleep_quality"]["id"]
+    answer_at(storage, user_id, session_id, mood, "3", "2024-01-01 09:00:00")
+    answer_at(storage, user_id, session_id, sleep, "Well", "2024-01-01 09:01:00")
+    storage.insert_analysis(user_id, session_id, {"risk_level": "Low"}, [], "v1")
+    storage.write(lambda cursor: storage.execute(
+        cursor, "UPDATE analysis_results SET created_at = ? WHERE user_id = ?", ("2024-01-01 10:00:00", user_id)))
+
+    idle_before = "2024-01-02 00:00:00"
+    assert storage.find_sessions_to_analyze("v1", idle_before) == []
+    assert [s["session_id"] for s in storage.find_sessions_to_analyze("v2", idle_before)] == [session_id]
+
+    # The same answer again changes nothing; a different one is an edit after the analysis
+    answer_at(storage, user_id, session_id, mood, "3", "2024-01-01 10:30:00")
+    assert storage.find_sessions_to_analyze("v1", idle_before) == []
+    answer_at(storage, user_id, session_id, mood, "8", "2024-01-01 11:00:00")
+    assert [s["session_id"] for s in storage.find_sessions_to_analyze("v1", idle_before)] == [session_id]
+    assert storage.find_sessions_to_analyze("v1", "2024-01-01 10:59:00") == []
+
+    responses = storage.get_session_responses(user_id, session_id, fields=["question_id", "response_value", "created_at"])
+    assert [(r["question_id"], r["response_value"]) for r in responses] == [(mood, "8"), (sleep, "Well")]
+    assert str(responses[0]["created_at"]) == "2024-01-01 09:00:00"
+
+
+def test_idempotency_key_applies_a_submission_once(storage, questions):
+    user_id, session_id = new_user(storage)
+    question_id = questions["mood_scale"]["id"]
+    assert storage.insert_response(user_id, question_id, "4", None, session_id, idempotency_key="k1")
+    assert not storage.insert_response(user_id, question_id, "9", None, session_id, idempotency_key="k1")
+    assert storage.get_session_answers(user_id, session_id) == {question_id: "4"}
+
+
+def test_batch_insert_saves_checkpoint_with_rows(storage, questions):
+    user_id, session_id = new_user(storage)
+    rows = [
+        {"user_id": user_id, "question_id": q["id"], "response_value": value, "response_text": None,
+         "session_id": session_id, "created_at": "2024-01-01 09:00:00", "idempotency_key": key}
+        for q, value, key in [(questions["mood_scale"], "8", "a"), (questions["open_ended"], "fine", "b"),
+                              (questions["mood_scale"], "1", "a")]
+    ]
+    storage.insert_responses(rows, checkpoint=("test", {"seq": 3}))
+
+    # The repeated key is skipped
+    assert storage.get_session_answers(user_id, session_id) == {
+        questions["mood_scale"]["id"]: "8", questions["open_ended"]["id"]: "fine"}
+    assert storage.get_checkpoint("test") == {"seq": 3}
+
+
+def test_clinicians_upsert_on_license_number(storage):
+    before = storage.get_version(storage.CLINICIANS_VERSION)
+    storage.upsert_clinicians([clinician("PSY1"), clinician("PSY2", name="Dr. James Wilson")])
+    storage.upsert_clinicians([clinician("PSY1", rating=3.5)])
+
+    clinicians = {c["license_number"]: c for c in storage.list_clinicians()}
+    assert set(clinicians) == {"PSY1", "PSY2"}
+    assert clinicians["PSY1"]["rating"] == 3.5
+    assert clinicians["PSY1"]["geohash"]
+    assert storage.get_version(storage.CLINICIANS_VERSION) == before + 2
+
+
+def test_clinician_search_and_distance(storage):
+    storage.upsert_clinicians([
+        clinician("PSY1", specialty="Anxiety Disorders & Trauma", location="Los Angeles, CA"),
+        clinician("PSY2", name="Dr. James Wilson", specialty="Family Therapy"),
+    ])
+
+    results = storage.search_clinicians("anxi")
+    assert [c["license_number"] for c in results] == ["PSY1"]
+    assert storage.HIGHLIGHT_START in results[0]["specialty_highlight"]
+
+    # New York, NY to the NY clinician only
+    nearby = storage.find_clinicians_near(40.7128, -74.0060, 50)
+    assert [c["license_number"] for c in nearby] == ["PSY2"]
+
+
+def test_analysis_lock_has_one_owner_at_a_time(storage):
+    user_id, session_id = new_user(storage)
+    assert storage.try_acquire_analysis_lock(user_id, session_id, "a", 60)
+    assert not storage.try_acquire_analysis_lock(user_id, session_id, "b", 60)
+    storage.release_analysis_lock(user_id, session_id, "a")
+    assert storage.try_acquire_analysis_lock(user_id, session_id, "b", 60)
+    # An expired lease can be taken over
+    assert storage.try_acquire_analysis_lock(user_id, session_id, "c", -1) is False
+    storage.release_analysis_lock(user_id, session_id, "b")
+    assert storage.try_acquire_analysis_lock(user_id, session_id, "c", -1)
+    assert storage.try_acquire_analysis_lock(user_id, session_id, "d", 60)
+
+
+def test_latest_analysis_and_history(storage):
+    user_id, session_id = new_user(storage)
+    storage.insert_analysis(user_id, session_id, {"risk_level": "Low", "overall_score": 20}, [], "v1")
+    storage.insert_analysis(user_id, session_id, {"risk_level": "High", "overall_score": 80,
+                                                  "usage": {"model": "gpt-4o-mini", "cost_usd": 0.01}}, [], "v1")
+
+    latest = storage.get_latest_analysis(user_id, session_id)
+    assert latest["risk_level"] == "High"
+    assert latest["session_id"] == session_id
+    assert latest["llm_model"] == "gpt-4o-mini"
+    assert "usage" not in json.loads(latest["conditions"])
+    history = storage.get_analysis_history(user_id)
+    assert [row["risk_level"] for row in history] == ["High", "Low"]
+
+
+def test_analysis_history_pages_by_keyset_across_equal_timestamps(storage):
+    user_id, session_id = new_user(storage)
+    for score in range(5):
+        storage.insert_analysis(user_id, session_id, {"overall_score": score}, [], "v1")
+    storage.write(lambda cursor: storage.execute(
+        cursor, "UPDATE analysis_results SET created_at = ? WHERE overall_score < 3", ("2024-01-01 10:00:00",)))
+
+    pages, before = [], None
+    while True:
+        page = storage.get_analysis_history(user_id, before=before, limit=2)
+        if not page:
+            break
+        pages.append([row["overall_score"] for row in page])
+        before = (page[-1]["created_at"], page[-1]["id"])
+    # Newest first, and rows sharing a timestamp are split across pages by id
+    assert pages == [[4, 3], [2, 1], [0]]
+
+
+def test_response_history_pages_across_sessions(storage, questions):
+    user_id, first = new_user(storage)
+    second = str(uuid.uuid4())
+    mood, sleep = questions["mood_scale"]["id"], questions["sleep_quality"]["id"]
+    answer_at(storage, user_id, first, mood, "3", "2024-01-01 09:00:00")
+    answer_at(storage, user_id, first, sleep, "Poorly", "2024-01-01 09:00:00")
+    answer_at(storage, user_id, second, mood, "6", "2024-01-02 09:00:00")
+    answer_at(storage, user_id, second, sleep, "Well", "2024-01-03 09:00:00")
+    other, _ = new_user(storage, "b@example.com")
+    answer_at(storage, other, second, mood, "9", "2024-01-02 09:00:00")
+
+    pages, after = [], None
+    while True:
+        page = list(storage.iter_response_history(user_id, after=after, limit=3, batch_size=2))
+        if not page:
+            break
+        pages.append([(row["session_id"], row["response_value"]) for row in page])
+        after = (page[-1]["created_at"], page[-1]["id"])
+    assert pages == [[(first, "3"), (first, "Poorly"), (second, "6")], [(second, "Well")]]
+
+    moods = list(storage.iter_response_history(user_id, question_type="mood_scale", start_date="2024-01-02",
+                                               fields=["response_value"]))
+    assert [(set(row), row["response_value"]) for row in moods] == [({"id", "created_at", "response_value"}, "6")]
+
+
+def test_risk_alerts_are_raised_once_per_session(storage, questions):
+    user_id, session_id = new_user(storage)
+    evaluator = risk.RiskEvaluator(storage)
+    assert evaluator.evaluate(user_id, session_id, questions["mood_scale"]["id"], "2") == []
+    alerts = evaluator.evaluate(user_id, session_id, questions["negative_thoughts"]["id"], "Yes")
+    assert [a["rule"] for a in alerts] == ["negative_thoughts_low_mood"]
+    # Answering again changes nothing, and the rule does not fire twice
+    assert evaluator.evaluate(user_id, session_id, questions["negative_thoughts"]["id"], "Yes") == []
+
+    outbox = storage.list_risk_alerts()
+    assert [a["rule"] for a in outbox] == ["negative_thoughts_low_mood"]
+    assert storage.mark_risk_alerts_delivered([outbox[0]["id"]]) == 1
+    assert storage.list_risk_alerts() == []
+
+
+def test_export_streams_decoded_rows(storage, questions):
+    user_id, session_id = new_user(storage)
+    storage.insert_response(user_id, questions["sleep_quality"]["id"], "Poorly", None, session_id)
+    rows = list(storage.iter_export("responses", user_id=user_id))
+    assert [(r["session_id"], r["response_value"]) for r in rows] == [(session_id, "Poorly")]
+
+
+def test_reads_are_read_only(storage):
+    with pytest.raises(Exception):
+        with storage.read() as cursor:
+            storage.execute(cursor, "INSERT INTO data_versions (name, version) VALUES (?, ?)", ("x", 1))
+    assert storage.get_version("x") == 0
+
+
+def contention_error(storage, cursor):
+    """Fail the way a write that lost a lock or a serialization race does on this backend"""
+    if isinstance(storage, PostgresStorage):
+        cursor.execute("DO $$ BEGIN RAISE EXCEPTION 'conflict' USING ERRCODE = 'serialization_failure'; END $$")
+    raise sqlite3.OperationalError("database is locked")
+
+
+def test_write_retries_contention_only(storage):
+    storage.retry_delay = 0.001
+    attempts = []
+
+    def flaky(cursor):
+        attempts.append(1)
+        if len(attempts) == 1:
+            contention_error(storage, cursor)
+        storage._bump_version(cursor, "retried")
+
+    storage.write(flaky)
+    assert len(attempts) == 2
+    assert storage.get_version("retried") == 1
+
+    attempts.clear()
+
+    def broken(cursor):
+        attempts.append(1)
+        storage.execute(cursor, "SELECT * FROM no_such_table")
+
+    with pytest.raises(Exception):
+        storage.write(broken)
+    assert len(attempts) == 1
+
+
+def run_concurrently(callers: int, call) -> list:
+    """Run call() from callers threads at once, returning the errors raised"""
+    errors = []
+    start = threading.Barrier(callers)
+
+    def run():
+        start.wait()
+        try:
+            call()
+        except Exception as e:
+            errors.append(repr(e))
+
+    threads = [threading.Thread(target=run) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def test_callers_wait_for_a_pooled_connection(storage):
+    # Far more callers than the fixture's Postgres pools hold, each keeping its
+    # connection long enough that they all overlap
+    def slow_write(cursor):
+        time.sleep(0.02)
+        storage._bump_version(cursor, "concurrent")
+
+    def slow_read():
+        with storage.read() as cursor:
+            time.sleep(0.02)
+            storage.execute(cursor, "SELECT version FROM data_versions WHERE name = ?", ("concurrent",))
+
+    assert run_concurrently(16, lambda: storage.write(slow_write)) == []
+    assert run_concurrently(16, slow_read) == []
+    assert storage.get_version("concurrent") == 16
+
+
+def test_concurrent_retries_of_a_submission_apply_it_once(storage, questions):
+    user_id, session_id = new_user(storage)
+    other, other_session = new_user(storage, "b@example.com")
+    question_id = questions["mood_scale"]["id"]
+    applied = []
+
+    def submit():
+        if storage.insert_response(user_id, question_id, "4", None, session_id, idempotency_key="retry"):
+            applied.append(True)
+
+    assert run_concurrently(8, submit) == []
+    assert applied == [True]
+    with storage.read() as cursor:
+        storage.execute(cursor, "SELECT COUNT(*) AS n FROM responses WHERE user_id = ?", (user_id,))
+        assert cursor.fetchone()["n"] == 1
+    # Keys belong to one user; another user's submission with the same key is applied
+    assert storage.insert_response(other, question_id, "7", None, other_session, idempotency_key="retry")
@@ -0,0 +1,77 @@
+"""Write-behind group commit: a row that can never be saved must not hold up the rest."""
+import os
+import json
+import time
+import uuid
+
+import pytest
+
+from writebehind import WriteBehindWriter
+
+
+@pytest.fixture
+def writer(storage, tmp_path):
+    writer = WriteBehindWriter(storage, str(tmp_path / "journal"), flush_interval=0.005)
+    writer.start()
+    yield writer
+    writer.stop()
+
+
+def dead_letters(storage) -> list:
+    with storage.read() as cursor:
+        storage.execute(cursor, "SELECT record, error FROM response_dead_letters ORDER BY id")
+        return [dict(row) for row in cursor.fetchall()]
+
+
+def test_failing_row_is_dead_lettered_and_the_rest_commit(storage, questions, writer):
+    session_id = str(uuid.uuid4())
+    user_id = storage.register_user("A", "a@example.com", 30, "F", session_id)
+    mood, sleep = questions["mood_scale"]["id"], questions["sleep_quality"]["id"]
+
+    # Journaled together, so they go to the database as one group; response_value
+    # is NOT NULL, so the middle row fails however often it is retried
+    futures = [writer.submit(user_id, mood, "6", None, session_id),
+               writer.submit(user_id, sleep, None, None, session_id),
+               writer.submit(user_id, sleep, "Poorly", None, session_id)]
+    for future in futures:
+        future.result(timeout=5)
+
+    started = time.monotonic()
+    writer.wait_committed(user_id, session_id)
+    assert time.monotonic() - started < 2
+    assert storage.get_session_answers(user_id, session_id) == {mood: "6", sleep: "Poorly"}
+    letters = dead_letters(storage)
+    assert [json.loads(letter["record"])["response_value"] for letter in letters] == [None]
+    assert writer.snapshot()["dead_lettered"] == 1
+    assert writer.snapshot()["pending"] == 0
+    assert writer.snapshot()["batches"] == 1
+
+
+def test_rows_wait_while_the_database_is_unavailable(storage, questions, writer, monkeypatch):
+    session_id = str(uuid.uuid4())
+    user_id = storage.register_user("A", "a@example.com", 30, "F", session_id)
+    mood = questions["mood_scale"]["id"]
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("database unavailable")
+
+    with monkeypatch.context() as down:
+        down.setattr(storage, "insert_responses", unavailable)
+        down.setattr(storage, "dead_letter_responses", unavailable)
+        writer.submit(user_id, mood, "4", None, session_id).result(timeout=5)
+        time.sleep(0.2)
+        assert writer.snapshot()["pending"] == 1
+
+    writer.wait_committed(user_id, session_id)
+    assert storage.get_session_answers(user_id, session_id) == {mood: "4"}
+    assert dead_letters(storage) == []
+
+
+def test_second_worker_on_a_journal_dir_warns_about_routing(storage, writer, caplog):
+    other = WriteBehindWriter(storage, writer.journal_dir)
+    with caplog.at_level("WARNING", logger="writebehind"):
+        other.start()
+    other.stop()
+
+    assert os.path.exists(os.path.join(writer.journal_dir, "responses-1.journal"))
+    assert "routed to one worker" in caplog.text
@@ -0,0 +1,252 @@
+"""Write-behind group commit for response submissions.
+
+With WRITE_BEHIND enabled, /submit_response appends the response to a local
+journal file and is acknowledged once the journal is fsynced. A background
+thread fsyncs the journal and commits everything queued to the database in
+one transaction every few milliseconds (or as soon as max_batch rows are
+waiting), so a burst of submissions shares a handful of commits.
+
+Each record carries a sequence number, and the last committed sequence is
+saved in pipeline_checkpoints in the same transaction as the rows. Whoever
+claims a journal file next replays the records after that point, so a
+crash loses nothing and commits nothing twice. Each worker process claims
+its own journal file with an exclusive lock.
+
+Reads of a session with queued writes wait for them to commit first
+(wait_committed), so users always see their own answers. Only the worker
+that journaled a write knows it is queued, so this holds only if every
+request for a session reaches the same worker: with more than one worker
+or node, WRITE_BEHIND requires routing sticky by session_id (e.g. a load
+balancer hashing on the session path segment). Otherwise leave it off and
+submissions commit synchronously, visible to every worker at once. A worker
+that finds another journal already claimed logs a warning as a reminder.
+
+If a group commit fails, its records are retried one at a time. A record
+that still fails on its own is moved to the response_dead_letters table,
+in the same transaction as the checkpoint that skips it, so one bad row
+cannot hold up everything queued behind it. If the move fails too, the
+database itself is unavailable, and the records wait in the journal until
+it comes back.
+"""
+import os
+import json
+import time
+import fcntl
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Optional
+
+from storage import Storage
+
+MAX_JOURNALS = 64
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindWriter:
+    def __init__(self, storage: Storage, journal_dir: str, flush_interval: float = 0.005, max_batch: int = 500):
+        self.storage = storage
+        self.journal_dir = journal_dir
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self._journal = None
+        self._checkpoint_name = None
+        self._seq = 0
+        self._committed_seq = 0
+        # [(seq, record, future)] appended to the journal but not yet committed
+        self._pending = []
+        # (user_id, session_id) -> highest pending seq for that session
+        self._session_seq = {}
+        self._stats = {"submitted": 0, "batches": 0, "rows_committed": 0, "journal_fsyncs": 0,
+                       "replayed": 0, "commit_errors": 0, "dead_lettered": 0, "last_batch_ms": 0.0}
+
+    def start(self):
+        self._claim_journal()
+        self._replay()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Commit everything queued, then release the journal"""
+        with self._cond:
+            self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+        if self._journal:
+            self._journal.close()
+
+    def _claim_journal(self):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        for index in range(MAX_JOURNALS):
+            path = os.path.join(self.journal_dir, f"responses-{index}.journal")
+            journal = open(path, "a+", encoding="utf-8")
+            try:
+                fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                journal.close()
+                continue
+            self._journal = journal
+            self._checkpoint_name = f"write_behind:{os.path.basename(path)}"
+            if index:
+                logger.warning("Write-behind: another worker holds a journal in %s; reads only see a "
+                               "session's queued answers if its requests are routed to one worker",
+                               self.journal_dir)
+            return
+        raise RuntimeError(f"No free journal file in {self.journal_dir}")
+
+    def _replay(self):
+        """Commit records a previous owner of this journal journaled but never committed"""
+        checkpoint = self.storage.get_checkpoint(self._checkpoint_name) or {}
+        committed = checkpoint.get("seq", 0)
+        records = []
+
+        self._journal.seek(0)
+        for line in self._journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A torn final line from a crash mid-append was never acknowledged
+                break
+            if record["seq"] > committed:
+                records.append(record)
+
+        last = max([committed] + [r["seq"] for r in records])
+        if records:
+            if self._commit_records(records) < len(records):
+                raise RuntimeError(f"Could not replay {self._journal.name}: the database is unavailable")
+            self._stats["replayed"] = len(records)
+        self._seq = self._committed_seq = last
+        self._journal.seek(0)
+        self._journal.truncate()
+
+    def submit(self, user_id: int, question_id: int, response_value: str, response_text, session_id: str,
+               idempotency_key: Optional[str] = None) -> Future:
+        """Journal a response; the future completes once it is durable in the journal.
+        A repeated idempotency_key is only detected when the batch is committed."""
+        future = Future()
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError("write-behind writer is stopped")
+            self._seq += 1
+            record = {
+                "seq": self._seq,
+                "user_id": user_id,
+                "question_id": question_id,
+                "response_value": response_value,
+                "response_text": response_text,
+                "session_id": session_id,
+                "idempotency_key": idempotency_key,
+                "created_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            self._journal.write(json.dumps(record) + "\n")
+            self._pending.append((self._seq, record, future))
+            self._session_seq[(user_id, session_id)] = self._seq
+            self._stats["submitted"] += 1
+            if len(self._pending) >= self.max_batch:
+                self._wake.set()
+        return future
+
+    def has_pending(self, user_id: int, session_id: str) -> bool:
+        return (user_id, session_id) in self._session_seq
+
+    def wait_committed(self, user_id: int, session_id: str, timeout: float = 5.0):
+        """Block until this session's queued writes are committed"""
+        with self._cond:
+            target = self._session_seq.get((user_id, session_id))
+            if target is None:
+                return
+            self._wake.set()
+            self._cond.wait_for(lambda: self._committed_seq >= target, timeout=timeout)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            with self._cond:
+                if not self._pending:
+                    if self._stopping:
+                        return
+                    continue
+                batch = self._pending[:self.max_batch]
+                self._journal.flush()
+                if len(self._pending) > self.max_batch:
+                    self._wake.set()
+
+            # One fsync makes the whole group durable, then the submitters are acknowledged
+            os.fsync(self._journal.fileno())
+            self._stats["journal_fsyncs"] += 1
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+            started = time.monotonic()
+            done = self._commit_records([record for _, record, _ in batch])
+            if done:
+                last = batch[done - 1][0]
+                with self._cond:
+                    del self._pending[:done]
+                    self._committed_seq = last
+                    for key, seq in list(self._session_seq.items()):
+                        if seq <= last:
+                            del self._session_seq[key]
+                    # Everything journaled is committed: start the journal afresh
+                    if not self._pending:
+                        self._journal.seek(0)
+                        self._journal.truncate()
+                    self._cond.notify_all()
+                self._stats["batches"] += 1
+                self._stats["rows_committed"] += done
+                self._stats["last_batch_ms"] = round((time.monotonic() - started) * 1000, 2)
+            if done < len(batch):
+                # The rest are safe in the journal; try them again shortly
+                time.sleep(min(1.0, self.flush_interval * 10))
+
+    def _commit_records(self, records) -> int:
+        """Commit journal records in order, returning how many of the leading ones are done
+        (saved or dead-lettered); the rest could not be written at all"""
+        try:
+            self.storage.insert_responses(records, checkpoint=(self._checkpoint_name, {"seq": records[-1]["seq"]}))
+            return len(records)
+        except Exception as e:
+            self._stats["commit_errors"] += 1
+            logger.warning("Write-behind commit error: %s", e)
+
+        # Find the record the group commit failed on by committing them one at a time
+        for done, record in enumerate(records):
+            checkpoint = (self._checkpoint_name, {"seq": record["seq"]})
+            try:
+                self.storage.insert_responses([record], checkpoint=checkpoint)
+            except Exception as e:
+                if not self._dead_letter(record, e):
+                    return done
+        return len(records)
+
+    def _dead_letter(self, record: dict, error: Exception) -> bool:
+        """Move a record that fails on its own out of the way; returns False if that fails too"""
+        try:
+            self.storage.dead_letter_responses([(record, repr(error))],
+                                               checkpoint=(self._checkpoint_name, {"seq": record["seq"]}))
+        except Exception as e:
+            logger.error("Write-behind dead-letter error: %s", e)
+            return False
+        self._stats["dead_lettered"] += 1
+        logger.warning("Write-behind: response %s moved to response_dead_letters: %r", record["seq"], error)
+        return True
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            batches = self._stats["batches"]
+            return {
+                "pending": len(self._pending),
+                "committed_seq": self._committed_seq,
+                "mean_batch_rows": round(self._stats["rows_committed"] / batches, 1) if batches else None,
+                **self._stats,
+            }